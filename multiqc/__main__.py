@@ -9,14 +9,13 @@ $ python -m multiqc .
 """
 
 
-import pkg_resources
-
 from . import multiqc
+from .utils.entry_points import get_entry_points
 
 
 def run_multiqc():
     # Add any extra plugin command line options
-    for entry_point in pkg_resources.iter_entry_points("multiqc.cli_options.v1"):
+    for entry_point in get_entry_points("multiqc.cli_options.v1"):
         opt_func = entry_point.load()
         multiqc.run_cli = opt_func(multiqc.run_cli)
     # Call the main function
@@ -3,24 +3,37 @@
 """ MultiQC modules base class, contains helper functions """
 
 
+import concurrent.futures
+import contextlib
 import fnmatch
 import io
 import itertools
 import logging
 import mimetypes
+import multiprocessing
 import os
 import re
+import sqlite3
+import sys
 import textwrap
+import zlib
 from collections import OrderedDict
 
 import markdown
 
-from multiqc.utils import config, report, util_functions
+from multiqc.utils import config, file_sniffer, parse_cache, regex_cache, report, spans, util_functions
 
 logger = logging.getLogger(__name__)
 
+# Parser function of the current map_log_files() call, inherited by its worker processes
+_map_parser = None
+
 
 class BaseMultiqcModule(object):
+    # Set to True in modules that read or change report state shared with other modules,
+    # so that they are never run in a separate process with --module-workers
+    serial_only = False
+
     def __init__(
         self,
         name="base",
@@ -95,11 +108,17 @@ class BaseMultiqcModule(object):
 
         self.sections = list()
 
-    def find_log_files(self, sp_key, filecontents=True, filehandles=False):
+        # Set by map_log_files() when it looks files up in the parse cache, see run()
+        self.parse_cache_used = False
+
+    @spans.timed("find_log_files", args=("sp_key",))
+    def find_log_files(self, sp_key, filecontents=True, filehandles=False, parse_cache=None):
         """
         Return matches log files of interest.
         :param sp_key: Search pattern key specified in config
         :param filehandles: Set to true to return a file handle instead of slurped file contents
+        :param parse_cache: ParseCache to look files up in. Files with a cached parse result are
+                            not opened, and are yielded with the result in `parsed`.
         :return: Yields a dict with filename (fn), root directory (root), cleaned sample name
                  generated from the filename (s_name) and either the file contents or file handle
                  for the current matched file (f).
@@ -177,30 +196,103 @@ class BaseMultiqcModule(object):
             # Make a sample name from the filename
             f["sp_key"] = sp_key
             f["s_name"] = self.clean_s_name(f["fn"], f)
+            if parse_cache is not None:
+                hit, parsed = parse_cache.get(f)
+                if hit:
+                    f["parsed"] = parsed
+                    yield f
+                    continue
             if filehandles or filecontents:
                 try:
-                    # Custom content module can now handle image files
-                    (ftype, encoding) = mimetypes.guess_type(os.path.join(f["root"], f["fn"]))
-                    if ftype is not None and ftype.startswith("image"):
-                        with io.open(os.path.join(f["root"], f["fn"]), "rb") as fh:
-                            # always return file handles
-                            f["f"] = fh
-                            yield f
-                    else:
-                        # Everything else - should be all text files
-                        with io.open(os.path.join(f["root"], f["fn"]), "r", encoding="utf-8") as fh:
-                            if filehandles:
-                                f["f"] = fh
-                                yield f
-                            elif filecontents:
-                                f["f"] = fh.read()
-                                yield f
-                except (IOError, OSError, ValueError, UnicodeDecodeError) as e:
+                    with open_log_file(f, filehandles) as f["f"]:
+                        yield f
+                except (IOError, OSError, ValueError, UnicodeDecodeError, EOFError, zlib.error) as e:
                     logger.debug("Couldn't open filehandle when returning file: {}\n{}".format(f["fn"], e))
                     f["f"] = None
             else:
                 yield f
 
+    @spans.timed("map_log_files", args=("sp_key",))
+    def map_log_files(self, sp_key, parser, filehandles=False, workers=None, section=None):
+        """
+        Parse all log files found for a search key with a parser function, using several
+        processes if `workers` (default: config.parse_workers) is more than 1.
+        :param sp_key: Search pattern key specified in config
+        :param parser: Function taking a dict from find_log_files() and returning the parsed data.
+                       Should not change anything else, as it may be run in another process.
+        :param filehandles: Set to true to give the parser a file handle instead of the file contents
+        :param workers: Number of processes to parse files with
+        :param section: Section name for add_data_source()
+        :return: List of (f, parsed data) tuples, in the same order as find_log_files(). Files that
+                 the parser returns nothing for (None or an empty dict / list) are left out, the rest
+                 are added as data sources. File contents are not kept in `f` when using workers.
+        """
+        if workers is None:
+            workers = config.parse_workers
+        workers = max(1, int(workers or 1))
+        # Don't start processes within processes, eg. when running with --module-workers.
+        # Forked workers need ProcessPoolExecutor(mp_context), new in Python 3.7
+        if (
+            multiprocessing.current_process().name != "MainProcess"
+            or "fork" not in multiprocessing.get_all_start_methods()
+            or sys.version_info < (3, 7)
+        ):
+            workers = 1
+
+        # Reuse what the parser returned for unchanged files in the last run, in incremental mode
+        cache = None
+        cache_path = parse_cache.cache_path()
+        if cache_path is not None:
+            try:
+                cache = parse_cache.ParseCache(cache_path, "{} {}".format(self.anchor, sp_key), parser)
+                self.parse_cache_used = True
+            except sqlite3.Error as e:
+                logger.error("Could not open parse cache '{}': {}".format(cache_path, e))
+
+        results = list()
+        if workers > 1:
+            files = list(self.find_log_files(sp_key, filecontents=False, parse_cache=cache))
+            to_parse = [f for f in files if "parsed" not in f]
+            workers = min(workers, len(to_parse))
+            logger.debug("{}: Parsing {} files with {} workers".format(sp_key, len(to_parse), workers))
+            global _map_parser
+            _map_parser = parser
+            try:
+                if workers > 1:
+                    # Workers are forked with the parser function, so it doesn't need to be picklable
+                    with concurrent.futures.ProcessPoolExecutor(
+                        max_workers=workers, mp_context=multiprocessing.get_context("fork")
+                    ) as executor:
+                        chunksize = max(1, len(to_parse) // (workers * 4))
+                        args = [(f, filehandles) for f in to_parse]
+                        parsed = list(executor.map(_parse_log_file, args, chunksize=chunksize))
+                else:
+                    parsed = [_parse_log_file((f, filehandles)) for f in to_parse]
+            finally:
+                _map_parser = None
+            parsed = iter(parsed)
+            results = [(f, f.pop("parsed") if "parsed" in f else next(parsed)) for f in files]
+        else:
+            for f in self.find_log_files(sp_key, filehandles=filehandles, parse_cache=cache):
+                results.append((f, f.pop("parsed") if "parsed" in f else parser(f)))
+
+        if cache is not None:
+            for f, parsed_data in results:
+                cache.add(f, parsed_data)
+            try:
+                cache.save()
+            except sqlite3.Error as e:
+                logger.error("Could not save parse cache '{}': {}".format(cache_path, e))
+
+        results = [
+            (f, parsed_data)
+            for f, parsed_data in results
+            if parsed_data is not None and not (isinstance(parsed_data, (dict, list)) and len(parsed_data) == 0)
+        ]
+        for f, _ in results:
+            self.add_data_source(f, section=section)
+        return results
+
     def add_section(
         self,
         name=None,
@@ -336,35 +428,31 @@ class BaseMultiqcModule(object):
 
         if config.fn_clean_sample_names:
             # Split then take first section to remove everything after these matches
-            for ext in config.fn_clean_exts:
+            for ext_type, pattern, ext_modules, ext in regex_cache.compile_clean_exts(config.fn_clean_exts):
                 # Check if this config is limited to a module
-                if "module" in ext:
-                    if type(ext["module"]) is str:
-                        ext["module"] = [ext["module"]]
-                    if not any([m == self.anchor for m in ext["module"]]):
-                        continue
+                if ext_modules is not None and self.anchor not in ext_modules:
+                    continue
 
                 # Go through different filter types
-                if type(ext) is str:
-                    ext = {"type": "truncate", "pattern": ext}
-                if ext.get("type") == "truncate":
-                    s_name = s_name.split(ext["pattern"], 1)[0]
-                elif ext.get("type") in ("remove", "replace"):
-                    if ext["type"] == "replace":
+                if ext_type == "truncate":
+                    if pattern in s_name:
+                        s_name = s_name.split(pattern, 1)[0]
+                elif ext_type in ("remove", "replace"):
+                    if ext_type == "replace":
                         logger.warning(
                             "use 'config.fn_clean_sample_names.remove' instead "
                             "of 'config.fn_clean_sample_names.replace' [deprecated]"
                         )
-                    s_name = s_name.replace(ext["pattern"], "")
-                elif ext.get("type") == "regex":
-                    s_name = re.sub(ext["pattern"], "", s_name)
-                elif ext.get("type") == "regex_keep":
-                    match = re.search(ext["pattern"], s_name)
+                    s_name = s_name.replace(pattern, "")
+                elif ext_type == "regex":
+                    s_name = pattern.sub("", s_name)
+                elif ext_type == "regex_keep":
+                    match = pattern.search(s_name)
                     s_name = match.group() if match else s_name
-                elif ext.get("type") is None:
+                elif ext_type is None:
                     logger.error('config.fn_clean_exts config was missing "type" key: {}'.format(ext))
                 else:
-                    logger.error("Unrecognised config.fn_clean_exts type: {}".format(ext.get("type")))
+                    logger.error("Unrecognised config.fn_clean_exts type: {}".format(ext_type))
             # Trim off characters at the end of names
             for chrs in config.fn_clean_trim:
                 if s_name.endswith(chrs):
@@ -521,3 +609,39 @@ class BaseMultiqcModule(object):
         if pconfig is None:
             pconfig = {}
         return linegraph.plot(data, pconfig)
+
+
+@contextlib.contextmanager
+def open_log_file(f, filehandles=False):
+    """
+    Open a log file found by the search, giving the file contents, or a file handle with
+    `filehandles`. Image files are always given as a binary file handle.
+    """
+    path = os.path.join(f["root"], f["fn"])
+    # Custom content module can now handle image files
+    (ftype, encoding) = mimetypes.guess_type(path)
+    if ftype is not None and ftype.startswith("image"):
+        with io.open(path, "rb") as fh:
+            yield fh
+        return
+    # Contents already read by the file search, if kept (see config.search_buffer_mb)
+    buffered = report.file_buffers.get(path)
+    if buffered is not None:
+        with io.StringIO(buffered) as fh:
+            yield fh if filehandles else buffered
+        return
+    # Everything else - should be all text files. Decompressed as it is read if gzipped.
+    fh, _ = file_sniffer.open_text(path, decompress=config.search_compressed, text_only=False)
+    with fh:
+        yield fh if filehandles else fh.read()
+
+
+def _parse_log_file(args):
+    """Open and parse a single log file in a map_log_files() worker process"""
+    f, filehandles = args
+    try:
+        with open_log_file(f, filehandles) as f["f"]:
+            return _map_parser(f)
+    except (IOError, OSError, ValueError, UnicodeDecodeError, EOFError, zlib.error) as e:
+        logger.debug("Couldn't open filehandle when returning file: {}\n{}".format(f["fn"], e))
+        return None
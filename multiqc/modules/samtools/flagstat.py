@@ -19,13 +19,10 @@ class FlagstatReportMixin:
         """Find Samtools flagstat logs and parse their data"""
 
         self.samtools_flagstat = dict()
-        for f in self.find_log_files("samtools/flagstat"):
-            parsed_data = parse_single_report(f["f"])
-            if len(parsed_data) > 0:
-                if f["s_name"] in self.samtools_flagstat:
-                    log.debug("Duplicate sample name found! Overwriting: {}".format(f["s_name"]))
-                self.add_data_source(f, section="flagstat")
-                self.samtools_flagstat[f["s_name"]] = parsed_data
+        for f, parsed_data in self.map_log_files("samtools/flagstat", parse_flagstat_file, section="flagstat"):
+            if f["s_name"] in self.samtools_flagstat:
+                log.debug("Duplicate sample name found! Overwriting: {}".format(f["s_name"]))
+            self.samtools_flagstat[f["s_name"]] = parsed_data
 
         # Filter to strip out ignored sample names
         self.samtools_flagstat = self.ignore_samples(self.samtools_flagstat)
@@ -126,6 +123,11 @@ flagstat_regexes = {
 }
 
 
+def parse_flagstat_file(f):
+    """Parse a flagstat file found by find_log_files()"""
+    return parse_single_report(f["f"])
+
+
 def parse_single_report(file_obj):
     """
     Take a filename, parse the data assuming it's a flagstat file
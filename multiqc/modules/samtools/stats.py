@@ -20,34 +20,10 @@ class StatsReportMixin:
         """Find Samtools stats logs and parse their data"""
 
         self.samtools_stats = dict()
-        for f in self.find_log_files("samtools/stats"):
-            parsed_data = dict()
-            for line in f["f"].splitlines():
-                if not line.startswith("SN"):
-                    continue
-                sections = line.split("\t")
-                field = sections[1].strip()[:-1]
-                field = field.replace(" ", "_")
-                value = float(sections[2].strip())
-                parsed_data[field] = value
-
-            if len(parsed_data) > 0:
-                # Work out some percentages
-                if "raw_total_sequences" in parsed_data:
-                    for k in list(parsed_data.keys()):
-                        if (
-                            k.startswith("reads_")
-                            and k != "raw_total_sequences"
-                            and parsed_data["raw_total_sequences"] > 0
-                        ):
-                            parsed_data["{}_percent".format(k)] = (
-                                parsed_data[k] / parsed_data["raw_total_sequences"]
-                            ) * 100
-
-                if f["s_name"] in self.samtools_stats:
-                    log.debug("Duplicate sample name found! Overwriting: {}".format(f["s_name"]))
-                self.add_data_source(f, section="stats")
-                self.samtools_stats[f["s_name"]] = parsed_data
+        for f, parsed_data in self.map_log_files("samtools/stats", parse_stats_file, section="stats"):
+            if f["s_name"] in self.samtools_stats:
+                log.debug("Duplicate sample name found! Overwriting: {}".format(f["s_name"]))
+            self.samtools_stats[f["s_name"]] = parsed_data
 
         # Filter to strip out ignored sample names
         self.samtools_stats = self.ignore_samples(self.samtools_stats)
@@ -226,3 +202,23 @@ def alignment_chart(data):
         "cpswitch_counts_label": "Number of Reads",
     }
     return bargraph.plot(data, keys, plot_conf)
+
+
+def parse_stats_file(f):
+    """Parse the SN summary numbers of a samtools stats file found by find_log_files()"""
+    parsed_data = dict()
+    for line in f["f"].splitlines():
+        if not line.startswith("SN"):
+            continue
+        sections = line.split("\t")
+        field = sections[1].strip()[:-1]
+        field = field.replace(" ", "_")
+        value = float(sections[2].strip())
+        parsed_data[field] = value
+
+    # Work out some percentages
+    if "raw_total_sequences" in parsed_data:
+        for k in list(parsed_data.keys()):
+            if k.startswith("reads_") and k != "raw_total_sequences" and parsed_data["raw_total_sequences"] > 0:
+                parsed_data["{}_percent".format(k)] = (parsed_data[k] / parsed_data["raw_total_sequences"]) * 100
+    return parsed_data
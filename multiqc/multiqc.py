@@ -7,7 +7,6 @@ The main function to run MultiQC. Sorry about the messy namespace.
 Primarily called by multiqc.__main__.py
 Imported by __init__.py so available as multiqc.run()
 """
-import base64
 import errno
 import io
 import os
@@ -18,17 +17,26 @@ import sys
 import tempfile
 import time
 import traceback
-from distutils import version
-from distutils.dir_util import copy_tree
-from urllib.request import urlopen
 
-import jinja2
 import rich
 import rich_click as click
-from rich.syntax import Syntax
 
-from .plots import table
-from .utils import config, lint_helpers, log, megaqc, plugin_hooks, report, util_functions
+from .utils import (
+    assets,
+    config,
+    lint_helpers,
+    log,
+    megaqc,
+    plugin_hooks,
+    regex_cache,
+    report,
+    spans,
+    stages,
+    template_env,
+    util_functions,
+)
+from .utils.module_pool import ModulePool
+from .utils.watchdog import ModuleLimitExceeded, ModuleWatchdog, module_limits
 
 # Set up logging
 start_execution_time = time.time()
@@ -58,6 +66,7 @@ click.rich_click.OPTION_GROUPS = {
                 "--ignore-samples",
                 "--ignore-symlinks",
                 "--file-list",
+                "--merge-data",
             ],
         },
         {
@@ -112,6 +121,13 @@ click.rich_click.OPTION_GROUPS = {
                 "--quiet",
                 "--lint",
                 "--profile-runtime",
+                "--search-workers",
+                "--search-cache",
+                "--search-compressed",
+                "--module-workers",
+                "--incremental",
+                "--stage",
+                "--shard",
                 "--no-megaqc-upload",
                 "--no-ansi",
                 "--version",
@@ -192,6 +208,13 @@ click.rich_click.OPTION_GROUPS = {
 @click.option(
     "-l", "--file-list", is_flag=True, help="Supply a file containing a list of file paths to be searched, one per row"
 )
+@click.option(
+    "--merge-data",
+    "merge_data",
+    is_flag=True,
+    default=None,
+    help="Make a report from the [yellow]multiqc_data[/] directories of earlier runs, instead of searching for files",
+)
 @click.option(
     "-e",
     "--exclude",
@@ -257,6 +280,63 @@ click.rich_click.OPTION_GROUPS = {
 @click.option("-v", "--verbose", count=True, default=0, help="Increase output verbosity.")
 @click.option("-q", "--quiet", is_flag=True, help="Only show log warnings")
 @click.option("--profile-runtime", is_flag=True, help="Add analysis of how long MultiQC takes to run to the report")
+@click.option(
+    "--search-workers",
+    "search_workers",
+    type=click.IntRange(min=1),
+    help="Number of threads to use when searching files. Speeds up searches on network filesystems.",
+)
+@click.option(
+    "--search-cache",
+    "search_cache",
+    type=click.Path(dir_okay=False),
+    help="File to cache search results in. Unchanged files are not searched again on later runs.",
+)
+@click.option(
+    "--search-compressed",
+    "search_compressed",
+    is_flag=True,
+    default=None,
+    help="Also search and parse gzip-compressed log files.",
+)
+@click.option(
+    "--module-workers",
+    "module_workers",
+    type=click.IntRange(min=1),
+    help="Number of processes to use for running modules.",
+)
+@click.option(
+    "--incremental",
+    "incremental",
+    is_flag=True,
+    default=None,
+    help="Keep parsed results next to the report, and only parse new or changed files on later runs.",
+)
+@click.option(
+    "--stage",
+    "stage",
+    type=click.Choice(["search", "parse", "render"]),
+    help="Run one stage: search for files, parse a shard of the modules, or render the report from all shards.",
+)
+@click.option(
+    "--shard",
+    "shard",
+    metavar="i/N",
+    help="Shard of the modules to run in the parse stage, eg. [yellow]1/4[/] for the first of four.",
+)
+@click.option(
+    "--split-assets",
+    "split_assets",
+    is_flag=True,
+    default=None,
+    help="Link to JavaScript, CSS and images in a shared directory instead of including them in the report.",
+)
+@click.option(
+    "--assets-dir",
+    "assets_dir",
+    type=click.Path(file_okay=False),
+    help="Directory to write report assets to, with [yellow]--split-assets[/]. Can be shared by many reports.",
+)
 @click.option("--no-ansi", is_flag=True, help="Disable coloured log output")
 @click.option(
     "--custom-css-file",
@@ -289,6 +369,7 @@ def run_cli(**kwargs):
 
 
 # Main function that runs MultiQC. Available to use within an interactive Python environment
+@spans.timed("run")
 def run(
     analysis_dir,
     dirs=False,
@@ -308,6 +389,7 @@ def run(
     sample_names=None,
     sample_filters=None,
     file_list=False,
+    merge_data=None,
     filename=None,
     make_data_dir=False,
     no_data_dir=False,
@@ -327,6 +409,15 @@ def run(
     verbose=0,
     quiet=False,
     profile_runtime=False,
+    search_workers=None,
+    search_cache=None,
+    search_compressed=None,
+    module_workers=None,
+    incremental=None,
+    stage=None,
+    shard=None,
+    split_assets=None,
+    assets_dir=None,
     no_ansi=False,
     custom_css_files=(),
     **kwargs,
@@ -381,6 +472,9 @@ def run(
     # Check that we're running the latest version of MultiQC
     if config.no_version_check is not True:
         try:
+            from distutils import version
+            from urllib.request import urlopen
+
             response = urlopen("http://multiqc.info/version.php?v={}".format(config.short_version), timeout=5)
             remote_version = response.read().decode("utf-8").strip()
             if version.StrictVersion(re.sub("[^0-9\.]", "", remote_version)) > version.StrictVersion(
@@ -455,6 +549,27 @@ def run(
         config.exclude_modules = exclude
     if profile_runtime:
         config.profile_runtime = True
+    if search_workers is not None:
+        config.search_workers = search_workers
+    if search_cache is not None:
+        config.search_cache = search_cache
+    if search_compressed is not None:
+        config.search_compressed = search_compressed
+    if module_workers is not None:
+        config.module_workers = module_workers
+    if incremental is not None:
+        config.incremental = incremental
+    if merge_data is not None:
+        config.merge_data = merge_data
+    if stage is not None:
+        config.stage = stage
+    if shard is not None:
+        config.shard = shard
+    if split_assets is not None:
+        config.split_assets = split_assets
+    if assets_dir is not None:
+        config.assets_dir = assets_dir
+        config.split_assets = True
     if no_ansi:
         config.no_ansi = True
     if custom_css_files:
@@ -505,6 +620,9 @@ def run(
         config.fn_ignore_files.extend(ignore)
         config.fn_ignore_dirs.extend(ignore)
         config.fn_ignore_paths.extend(ignore)
+    if config.search_compressed and "*.txt.gz" in config.fn_ignore_files:
+        logger.debug("Searching compressed files, so not ignoring '*.txt.gz' files")
+        config.fn_ignore_files = [n for n in config.fn_ignore_files if n != "*.txt.gz"]
     if len(ignore_samples) > 0:
         logger.debug("Ignoring sample names that match: {}".format(", ".join(ignore_samples)))
         config.sample_names_ignore.extend(ignore_samples)
@@ -625,33 +743,73 @@ def run(
         pass  # custom_data not in config
 
     # Get the list of files to search
-    for d in config.analysis_dir:
-        logger.info("Search path : {}".format(os.path.abspath(d)))
-    report.get_filelist(run_module_names)
-
-    # Only run the modules for which any files were found
-    non_empty_modules = {key.split("/")[0].lower() for key, files in report.files.items() if len(files) > 0}
-    # Always run custom content, as it can have data purely from a MultiQC config file (no search files)
-    if "custom_content" not in non_empty_modules:
-        non_empty_modules.add("custom_content")
-    run_modules = [m for m in run_modules if list(m.keys())[0].lower() in non_empty_modules]
+    if config.merge_data:
+        # Modules aren't run when merging the data of earlier runs
+        run_modules = []
+    elif config.stage == "parse":
+        # Files found by the search stage
+        run_modules = [m for m in stages.load_search(config.analysis_dir) if list(m.keys())[0] in run_module_names]
+    elif config.stage == "render":
+        # Modules were run by the parse stage
+        shard_results = stages.ShardResults(config.analysis_dir)
+        run_modules = shard_results.run_modules
+    else:
+        for d in config.analysis_dir:
+            logger.info("Search path : {}".format(os.path.abspath(d)))
+        report.get_filelist(run_module_names)
+
+        # Only run the modules for which any files were found
+        non_empty_modules = {key.split("/")[0].lower() for key, files in report.files.items() if len(files) > 0}
+        # Always run custom content, as it can have data purely from a MultiQC config file (no search files)
+        if "custom_content" not in non_empty_modules:
+            non_empty_modules.add("custom_content")
+        run_modules = [m for m in run_modules if list(m.keys())[0].lower() in non_empty_modules]
     run_module_names = [list(m.keys())[0] for m in run_modules]
 
+    # Compile the sample name cleaning regexes once, before any module uses them
+    regex_cache.compile_clean_exts(config.fn_clean_exts)
+
+    # Stop after the search or parse stage, if only running one stage
+    if config.stage in ["search", "parse"]:
+        sys_exit_code = 0
+        if config.stage == "search":
+            stages.save_search(run_modules)
+        else:
+            sys_exit_code = stages.run_shard(run_modules, config.shard)
+        shutil.rmtree(tmp_dir)
+        logger.info("MultiQC complete")
+        log.move_tmp_log(logger)
+        return {"report": report, "config": config, "sys_exit_code": sys_exit_code}
+
     # Run the modules!
     plugin_hooks.mqc_trigger("before_modules")
     report.modules_output = list()
     sys_exit_code = 0
     total_mods_starttime = time.time()
+    modules_span = spans.span("run_modules")
+    modules_span.enter()
+    # Start running independent modules in worker processes, if requested
+    if config.stage == "render":
+        module_pool = shard_results
+    else:
+        module_pool = ModulePool(run_modules, config.module_workers)
     for mod_idx, mod_dict in enumerate(run_modules):
         mod_starttime = time.time()
+        watchdog = None
         try:
             this_module = list(mod_dict.keys())[0]
             mod_cust_config = list(mod_dict.values())[0]
             if mod_cust_config is None:
                 mod_cust_config = {}
-            mod = config.avail_modules[this_module].load()
-            mod.mod_cust_config = mod_cust_config  # feels bad doing this, but seems to work
-            output = mod()
+            # Results of modules run in a worker process are merged into the report in module order
+            output = module_pool.collect(mod_idx)
+            if output is None:
+                mod = config.avail_modules[this_module].load()
+                mod.mod_cust_config = mod_cust_config  # feels bad doing this, but seems to work
+                # Stop the module if it goes over its time or memory limit
+                watchdog = ModuleWatchdog(this_module, **module_limits(mod_cust_config))
+                with watchdog, spans.span("module", module=this_module):
+                    output = mod()
             if type(output) != list:
                 output = [output]
             for m in output:
@@ -687,6 +845,7 @@ def run(
         except UserWarning:
             logger.debug("No samples found: {}".format(list(mod_dict.keys())[0]))
         except KeyboardInterrupt:
+            module_pool.shutdown(wait=False)
             shutil.rmtree(tmp_dir)
             logger.critical(
                 "User Cancelled Execution!\n{eq}\n{tb}{eq}\n".format(eq=("=" * 60), tb=traceback.format_exc())
@@ -698,6 +857,14 @@ def run(
             class CustomTraceback:
                 def __rich_console__(self, console: rich.console.Console, options: rich.console.ConsoleOptions):
                     sys_tb = sys.exc_info()
+                    if isinstance(sys_tb[1], ModuleLimitExceeded):
+                        yield (
+                            "{}. The rest of the report is still produced.\n"
+                            "The last file found was: [green]{}[/]\n"
+                            "Limits can be changed with [yellow]time_limit[/] and [yellow]memory_limit[/] "
+                            "in the [yellow]module_order[/] config.".format(sys_tb[1], report.last_found_file)
+                        )
+                        return
                     issue_url = "https://github.com/ewels/MultiQC/issues/new?template=bug_report.md&title={}%20module%20-%20{}".format(
                         this_module, sys_tb[0].__name__
                     )
@@ -707,6 +874,8 @@ def run(
                             issue_url, report.last_found_file
                         )
                     )
+                    from rich.syntax import Syntax
+
                     yield Syntax(traceback.format_exc(), "python")
 
                 def __rich_measure__(self, console: rich.console.Console, options: rich.console.ConsoleOptions):
@@ -718,13 +887,15 @@ def run(
                     panel_width = max(tb_width, log_width)
                     return rich.console.Measurement(panel_width, panel_width)
 
+            from rich.panel import Panel
+
             console = rich.console.Console(
                 stderr=True,
                 force_terminal=util_functions.force_term_colors(),
                 color_system=None if no_ansi else "auto",
             )
             console.print(
-                rich.panel.Panel(
+                Panel(
                     CustomTraceback(),
                     title="Oops! The '[underline]{}[/]' MultiQC module broke...".format(this_module),
                     expand=False,
@@ -743,8 +914,40 @@ def run(
             # Exit code 1 for CI failures etc
             sys_exit_code = 1
 
-        report.runtimes["mods"][run_module_names[mod_idx]] = time.time() - mod_starttime
+        report.runtimes["mods"][run_module_names[mod_idx]] = module_pool.runtimes.get(
+            mod_idx, time.time() - mod_starttime
+        )
+        report.runtimes["mods_peak_rss"][run_module_names[mod_idx]] = module_pool.peak_rss.get(
+            mod_idx, watchdog.peak_rss if watchdog is not None else None
+        )
+    module_pool.shutdown()
+    modules_span.exit()
+    modules_span.close()
     report.runtimes["total_mods"] = time.time() - total_mods_starttime
+    if report.file_buffers.enabled:
+        logger.debug(
+            "File buffer pool: {} files served from memory, {} read from disk, {} evicted".format(
+                report.file_buffers.hits, report.file_buffers.misses, report.file_buffers.evicted
+            )
+        )
+        report.file_buffers.clear()
+
+    # Only modules that parse files with map_log_files() can reuse cached parse results
+    if config.incremental:
+        from .utils import parse_cache
+
+        if parse_cache.cache_path() is not None:
+            uncached = [m.name for m in report.modules_output if not getattr(m, "parse_cache_used", False)]
+            if uncached:
+                logger.info(
+                    "Modules that parsed all files again, without the parse cache: {}".format(", ".join(uncached))
+                )
+
+    # Merge the data of earlier runs
+    if config.merge_data:
+        from multiqc.utils import merge_data
+
+        report.modules_output.extend(merge_data.merge_data(config.analysis_dir))
 
     # Special-case module if we want to profile the MultiQC running time
     if config.profile_runtime:
@@ -844,22 +1047,28 @@ def run(
             "save_file": True,
             "raw_data_fn": "multiqc_general_stats",
         }
+        from .plots import table
+
         report.general_stats_html = table.plot(report.general_stats_data, report.general_stats_headers, pconfig)
     else:
         config.skip_generalstats = True
 
     if config.data_dir is not None:
-        # Write the report sources to disk
-        report.data_sources_tofile()
+        with spans.span("write_data_files"):
+            # Write the report sources to disk
+            report.data_sources_tofile()
 
-        # Create a file with the module DOIs
-        report.dois_tofile()
+            # Create a file with the module DOIs
+            report.dois_tofile()
 
     if config.make_report:
         # Compress the report plot JSON data
         runtime_compression_start = time.time()
         logger.info("Compressing plot data")
-        report.plot_compressed_json = report.compress_json(report.plot_data)
+        if config.lazy_plot_data:
+            report.plot_compressed_data = report.compress_plot_data(report.plot_data)
+        else:
+            report.plot_compressed_json = report.compress_json(report.plot_data)
         report.runtimes["total_compression"] = time.time() - runtime_compression_start
 
     plugin_hooks.mqc_trigger("before_report_generation")
@@ -938,8 +1147,9 @@ def run(
             # Modules have run, so data directory should be complete by now. Move its contents.
             logger.debug("Moving data file from '{}' to '{}'".format(config.data_tmp_dir, config.data_dir))
             # Disable preserving of times and mode on purpose to avoid problems with mounted CIFS shares (see #625)
-            copy_tree(config.data_tmp_dir, config.data_dir, preserve_times=0, preserve_mode=0)
-            shutil.rmtree(config.data_tmp_dir)
+            with spans.span("copy_data_dir"):
+                util_functions.copy_tree(config.data_tmp_dir, config.data_dir, preserve=False)
+                shutil.rmtree(config.data_tmp_dir)
 
         # Copy across the static plot images if requested
         if config.export_plots:
@@ -958,48 +1168,80 @@ def run(
             # Modules have run, so plots directory should be complete by now. Move its contents.
             logger.debug("Moving plots directory from '{}' to '{}'".format(config.plots_tmp_dir, config.plots_dir))
             # Disable preserving of times and mode on purpose to avoid problems with mounted CIFS shares (see #625)
-            copy_tree(config.plots_tmp_dir, config.plots_dir, preserve_times=0, preserve_mode=0)
-            shutil.rmtree(config.plots_tmp_dir)
+            with spans.span("copy_plots_dir"):
+                util_functions.copy_tree(config.plots_tmp_dir, config.plots_dir, preserve=False)
+                shutil.rmtree(config.plots_tmp_dir)
 
     plugin_hooks.mqc_trigger("before_template")
 
     # Generate report if required
     if config.make_report:
-        # Load in parent template files first if a child theme
-        try:
-            parent_template = config.avail_templates[template_mod.template_parent].load()
-            copy_tree(parent_template.template_dir, tmp_dir)
-        except AttributeError:
-            pass  # Not a child theme
-
-        # Copy the template files to the tmp directory (distutils overwrites parent theme files)
-        copy_tree(template_mod.template_dir, tmp_dir)
+        # Template files are used from where they are installed, child template files first
+        tmpl_dirs = template_env.template_dirs(template_mod)
+
+        # Static files are linked from the report instead of included in it, if requested
+        split_assets = config.split_assets
+        if split_assets and (filename == "stdout" or make_pdf):
+            logger.warning("Can't split the report assets when printing the report to stdout or making a PDF")
+            split_assets = False
+        if split_assets:
+            logger.info("Assets      : {}".format(os.path.relpath(assets.assets_dir())))
+
+        # Path of a file given to the functions below: in the template directories, or in `fdir`
+        def file_path(name, fdir):
+            if fdir is tmpl_dirs:
+                return template_env.template_file(tmpl_dirs, name)
+            return os.path.join(fdir or "", name)
 
         # Function to include file contents in Jinja template
-        def include_file(name, fdir=tmp_dir, b64=False):
+        def include_file(name, fdir=tmpl_dirs, b64=False):
             try:
-                if fdir is None:
-                    fdir = ""
                 if b64:
-                    with io.open(os.path.join(fdir, name), "rb") as f:
-                        return base64.b64encode(f.read()).decode("utf-8")
+                    return assets.read_b64(file_path(name, fdir))
                 else:
-                    with io.open(os.path.join(fdir, name), "r", encoding="utf-8") as f:
-                        return f.read()
+                    return assets.read_text(file_path(name, fdir))
             except (OSError, IOError) as e:
                 logger.error("Could not include file '{}': {}".format(name, e))
 
-        # Load the report template
+        # Functions to include a static file in the report, or link to it with config.split_assets
+        def asset_url(name, mime, fdir=tmpl_dirs):
+            if not split_assets:
+                return "data:{};base64,{}".format(mime, include_file(name, fdir, b64=True))
+            try:
+                return assets.write_asset(file_path(name, fdir))
+            except (OSError, IOError) as e:
+                logger.error("Could not write report asset '{}': {}".format(name, e))
+
+        def include_script(name, fdir=tmpl_dirs):
+            if split_assets:
+                return '<script type="text/javascript" src="{}"></script>'.format(asset_url(name, None, fdir))
+            return '<script type="text/javascript">{}</script>'.format(include_file(name, fdir))
+
+        def include_style(name, fdir=tmpl_dirs):
+            if split_assets:
+                return '<link rel="stylesheet" type="text/css" href="{}">'.format(asset_url(name, None, fdir))
+            return '<style type="text/css">{}</style>'.format(include_file(name, fdir))
+
+        # Load the report template. The Jinja environment is reused by later runs, so the
+        # functions for this run are given to the template with the report and config
         try:
-            env = jinja2.Environment(loader=jinja2.FileSystemLoader(tmp_dir))
-            env.globals["include_file"] = include_file
-            j_template = env.get_template(template_mod.base_fn)
+            with spans.span("load_template"):
+                env = template_env.get_environment(tmpl_dirs)
+                j_template = env.get_template(template_mod.base_fn)
         except:
             raise IOError("Could not load {} template file '{}'".format(config.template, template_mod.base_fn))
 
         # Use jinja2 to render the template and overwrite
         config.analysis_dir = [os.path.realpath(d) for d in config.analysis_dir]
-        report_output = j_template.render(report=report, config=config)
+        with spans.span("render_template"):
+            report_output = j_template.render(
+                report=report,
+                config=config,
+                include_file=include_file,
+                asset_url=asset_url,
+                include_script=include_script,
+                include_style=include_style,
+            )
         if filename == "stdout":
             print(report_output.encode("utf-8"), file=sys.stdout)
         else:
@@ -1011,16 +1253,20 @@ def run(
 
             # Copy over files if requested by the theme
             try:
-                for f in template_mod.copy_files:
-                    fn = os.path.join(tmp_dir, f)
-                    dest_dir = os.path.join(os.path.dirname(config.output_fn), f)
-                    copy_tree(fn, dest_dir)
+                with spans.span("copy_template_files"):
+                    for f in template_mod.copy_files:
+                        dest = os.path.join(os.path.dirname(config.output_fn), f)
+                        template_env.copy_template_files(tmpl_dirs, f, dest)
             except AttributeError:
                 pass  # No files to copy
 
     # Clean up temporary directory
     shutil.rmtree(tmp_dir)
 
+    # Save the timed parts of the run to the data directory
+    if config.profile_runtime and config.make_data_dir and filename != "stdout":
+        spans.write_spans(config.data_dir)
+
     # Zip the data directory if requested
     if config.zip_data_dir and config.data_dir is not None:
         shutil.make_archive(config.data_dir, "zip", config.data_dir)
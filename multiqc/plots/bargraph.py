@@ -11,28 +11,12 @@ import math
 import os
 import random
 import re
-import sys
 from collections import OrderedDict
 
-from multiqc.utils import config, report, util_functions
+from multiqc.utils import config, report, spans, util_functions
 
 logger = logging.getLogger(__name__)
 
-try:
-    # Import matplot lib but avoid default X environment
-    import matplotlib
-
-    matplotlib.use("Agg")
-    import matplotlib.pyplot as plt
-
-    logger.debug("Using matplotlib version {}".format(matplotlib.__version__))
-except Exception as e:
-    # MatPlotLib can break in a variety of ways. Fake an error message and continue without it if so.
-    # The lack of the library will be handled when plots are attempted
-    print("##### ERROR! MatPlotLib library could not be loaded!    #####", file=sys.stderr)
-    print("##### Flat plots will instead be plotted as interactive #####", file=sys.stderr)
-    print(e)
-
 letters = "abcdefghijklmnopqrstuvwxyz"
 
 # Load the template so that we can access its configuration
@@ -47,6 +31,7 @@ def get_template_mod():
     return _template_mod
 
 
+@spans.timed("bargraph.plot")
 def plot(data, cats=None, pconfig=None):
     """Plot a horizontal bar graph. Expects a 2D dict of sample
     data. Also can take info about categories. There are quite a
@@ -181,7 +166,14 @@ def plot(data, cats=None, pconfig=None):
         logger.warning(f"Tried to make bar plot, but had no data: {pconfig.get('id')}")
         return '<p class="text-danger">Error - was not able to plot data.</p>'
 
-    # Make a plot - custom, interactive or flat
+    return make_plot(plotdata, plotsamples, pconfig)
+
+
+def make_plot(plotdata, plotsamples, pconfig):
+    """
+    Make a plot - custom, interactive or flat - from the formatted plot data. The data of flat
+    plots is kept in report.flat_plot_data, so that `multiqc --merge-data` can plot it again.
+    """
     try:
         return get_template_mod().bargraph(plotdata, plotsamples, pconfig)
     except (AttributeError, TypeError):
@@ -190,7 +182,14 @@ def plot(data, cats=None, pconfig=None):
         ):
             try:
                 report.num_mpl_plots += 1
-                return matplotlib_bargraph(plotdata, plotsamples, pconfig)
+                html = matplotlib_bargraph(plotdata, plotsamples, pconfig)
+                report.flat_plot_data[pconfig["id"]] = {
+                    "plot_type": "bar_graph",
+                    "samples": plotsamples,
+                    "datasets": plotdata,
+                    "config": pconfig,
+                }
+                return html
             except Exception as e:
                 logger.error("############### Error making MatPlotLib figure! Falling back to HighCharts.")
                 logger.debug(e, exc_info=True)
@@ -308,6 +307,7 @@ def matplotlib_bargraph(plotdata, plotsamples, pconfig=None):
     encoded image within HTML or writes the plot and links to it. Should be called by
     plot_bargraph, which properly formats the input data.
     """
+    plt = util_functions.get_pyplot()
 
     if pconfig is None:
         pconfig = {}
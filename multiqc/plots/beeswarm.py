@@ -6,13 +6,14 @@ import logging
 import random
 
 from multiqc.plots import table_object
-from multiqc.utils import config, report
+from multiqc.utils import config, report, spans
 
 logger = logging.getLogger(__name__)
 
 letters = "abcdefghijklmnopqrstuvwxyz"
 
 
+@spans.timed("beeswarm.plot")
 def plot(data, headers=None, pconfig=None):
     """Helper HTML for a beeswarm plot.
     :param data: A list of data dicts
@@ -86,12 +87,23 @@ def make_plot(dt):
         logger.warning("Tried to make beeswarm plot, but had no data")
         return '<p class="text-danger">Error - was not able to plot data.</p>'
 
+    return highcharts_beeswarm(bs_id, s_names, data, categories, dt.pconfig)
+
+
+def highcharts_beeswarm(bs_id, s_names, data, categories, pconfig=None):
+    """
+    Build the HTML needed for a HighCharts beeswarm plot. Should be
+    called by make_plot(), which checks the plot ID and formats the data.
+    """
+    if pconfig is None:
+        pconfig = {}
+
     # Plot HTML
     html = """<div class="hc-plot-wrapper"{height}>
         <div id="{bid}" class="hc-plot not_rendered hc-beeswarm-plot"><small>loading..</small></div>
     </div>""".format(
         bid=bs_id,
-        height=f' style="height:{dt.pconfig["height"]}px"' if "height" in dt.pconfig else "",
+        height=f' style="height:{pconfig["height"]}px"' if "height" in pconfig else "",
     )
 
     report.num_hc_plots += 1
@@ -9,25 +9,10 @@ import os
 import random
 from collections import OrderedDict
 
-from multiqc.utils import config, report
+from multiqc.utils import config, report, spans, util_functions
 
 logger = logging.getLogger(__name__)
 
-try:
-    # Import matplot lib but avoid default X environment
-    import matplotlib
-
-    matplotlib.use("Agg")
-    import matplotlib.pyplot as plt
-
-    logger.debug("Using matplotlib version {}".format(matplotlib.__version__))
-except Exception as e:
-    # MatPlotLib can break in a variety of ways. Fake an error message and continue without it if so.
-    # The lack of the library will be handled when plots are attempted
-    print("##### ERROR! MatPlotLib library could not be loaded!    #####", file=sys.stderr)
-    print("##### Flat plots will instead be plotted as interactive #####", file=sys.stderr)
-    print(e)
-
 letters = "abcdefghijklmnopqrstuvwxyz"
 
 # Load the template so that we can access its configuration
@@ -42,6 +27,7 @@ def get_template_mod():
     return _template_mod
 
 
+@spans.timed("boxplot.plot")
 def plot(data, pconfig=None):
     """Plot a box-and-whisker plot
     :param data: 2D dict, first keys as read positions, then as quantile:QV pairs
@@ -82,6 +68,7 @@ def matplotlib_boxplot(plotdata, pconfig=None):
     encoded image within HTML or writes the plot and links to it. Should be called by
     plot_bargraph, which properly formats the input data.
     """
+    plt = util_functions.get_pyplot()
     if pconfig is None:
         pconfig = {}
 
@@ -9,28 +9,12 @@ import logging
 import os
 import random
 import re
-import sys
 from collections import OrderedDict
 
-from multiqc.utils import config, report, util_functions
+from multiqc.utils import config, report, spans, util_functions
 
 logger = logging.getLogger(__name__)
 
-try:
-    # Import matplot lib but avoid default X environment
-    import matplotlib
-
-    matplotlib.use("Agg")
-    import matplotlib.pyplot as plt
-
-    logger.debug("Using matplotlib version {}".format(matplotlib.__version__))
-except Exception as e:
-    # MatPlotLib can break in a variety of ways. Fake an error message and continue without it if so.
-    # The lack of the library will be handled when plots are attempted
-    print("##### ERROR! MatPlotLib library could not be loaded!    #####", file=sys.stderr)
-    print("##### Flat plots will instead be plotted as interactive #####", file=sys.stderr)
-    print(e)
-
 letters = "abcdefghijklmnopqrstuvwxyz"
 
 # Load the template so that we can access its configuration
@@ -45,6 +29,7 @@ def get_template_mod():
     return _template_mod
 
 
+@spans.timed("linegraph.plot")
 def plot(data, pconfig=None):
     """Plot a line graph with X,Y data.
     :param data: 2D dict, first keys as sample names, then x:y data pairs
@@ -215,7 +200,14 @@ def plot(data, pconfig=None):
     except (KeyError, IndexError):
         pass
 
-    # Make a plot - template custom, or interactive or flat
+    return make_plot(plotdata, pconfig)
+
+
+def make_plot(plotdata, pconfig):
+    """
+    Make a plot - template custom, or interactive or flat - from the formatted plot data. The data of
+    flat plots is kept in report.flat_plot_data, so that `multiqc --merge-data` can plot it again.
+    """
     try:
         return get_template_mod().linegraph(plotdata, pconfig)
     except (AttributeError, TypeError):
@@ -224,7 +216,9 @@ def plot(data, pconfig=None):
         ):
             try:
                 report.num_mpl_plots += 1
-                return matplotlib_linegraph(plotdata, pconfig)
+                html = matplotlib_linegraph(plotdata, pconfig)
+                report.flat_plot_data[pconfig["id"]] = {"plot_type": "xy_line", "datasets": plotdata, "config": pconfig}
+                return html
             except Exception as e:
                 logger.error("############### Error making MatPlotLib figure! Falling back to HighCharts.")
                 logger.debug(e, exc_info=True)
@@ -321,6 +315,7 @@ def matplotlib_linegraph(plotdata, pconfig=None):
     encoded image within HTML or writes the plot and links to it. Should be called by
     plot_bargraph, which properly formats the input data.
     """
+    plt = util_functions.get_pyplot()
     if pconfig is None:
         pconfig = {}
 
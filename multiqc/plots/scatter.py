@@ -5,13 +5,14 @@
 import logging
 import random
 
-from multiqc.utils import config, report
+from multiqc.utils import config, report, spans
 
 logger = logging.getLogger(__name__)
 
 letters = "abcdefghijklmnopqrstuvwxyz"
 
 
+@spans.timed("scatter.plot")
 def plot(data, pconfig=None):
     """Plot a scatter plot with X,Y data.
     :param data: 2D dict, first keys as sample names, then x:y data pairs
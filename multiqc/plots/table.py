@@ -7,13 +7,14 @@ import random
 from collections import OrderedDict, defaultdict
 
 from multiqc.plots import beeswarm, table_object
-from multiqc.utils import config, mqc_colour, report, util_functions
+from multiqc.utils import config, mqc_colour, report, spans, util_functions
 
 logger = logging.getLogger(__name__)
 
 letters = "abcdefghijklmnopqrstuvwxyz"
 
 
+@spans.timed("table.plot")
 def plot(data, headers=None, pconfig=None):
     """Return HTML for a MultiQC table.
     :param data: 2D dict, first keys as sample names, then x:y data pairs
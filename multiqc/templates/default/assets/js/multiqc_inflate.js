@@ -0,0 +1,261 @@
+////////////////////////////////////////////////
+// MultiQC plot data decompression
+////////////////////////////////////////////////
+
+// The plot data is compressed by report.compress_json() with the codec in
+// config.plot_data_codec: "zlib" (base64-encoded zlib data, RFC 1950 / 1951)
+// or "lzstring" (lz-string base64). The lz-string library is only included
+// in the report when it is used, so if a custom template doesn't give the codec
+// in mqc_config, it is zlib unless lz-string is there.
+
+// Small synchronous inflate implementation, following the approach of tinf
+// by Joergen Ibsen. Decoding tables are built per dynamic block, and the
+// output buffer grows as needed.
+var mqc_inflate = (function () {
+  function Tree() {
+    this.table = new Uint16Array(16); // Number of codes of each length
+    this.trans = new Uint16Array(288); // Code -> symbol translation table
+  }
+
+  function Data(source) {
+    this.source = source;
+    this.sourceIndex = 0;
+    this.tag = 0;
+    this.bitcount = 0;
+    this.dest = new Uint8Array(Math.max(1024, source.length * 4));
+    this.destLen = 0;
+    this.ltree = new Tree();
+    this.dtree = new Tree();
+  }
+
+  // Fixed literal / length and distance trees
+  var sltree = new Tree();
+  var sdtree = new Tree();
+
+  // Extra bits and base values of length and distance codes
+  var length_bits = new Uint8Array(30);
+  var length_base = new Uint16Array(30);
+  var dist_bits = new Uint8Array(30);
+  var dist_base = new Uint16Array(30);
+
+  // Order of the code length codes
+  var clcidx = new Uint8Array([16, 17, 18, 0, 8, 7, 9, 6, 10, 5, 11, 4, 12, 3, 13, 2, 14, 1, 15]);
+
+  var code_tree = new Tree();
+  var lengths = new Uint8Array(288 + 32);
+  var offs = new Uint16Array(16);
+
+  function build_bits_base(bits, base, delta, first) {
+    var i, sum;
+    for (i = 0; i < delta; ++i) bits[i] = 0;
+    for (i = 0; i < 30 - delta; ++i) bits[i + delta] = (i / delta) | 0;
+    for (sum = first, i = 0; i < 30; ++i) {
+      base[i] = sum;
+      sum += 1 << bits[i];
+    }
+  }
+
+  function build_fixed_trees(lt, dt) {
+    var i;
+    for (i = 0; i < 7; ++i) lt.table[i] = 0;
+    lt.table[7] = 24;
+    lt.table[8] = 152;
+    lt.table[9] = 112;
+    for (i = 0; i < 24; ++i) lt.trans[i] = 256 + i;
+    for (i = 0; i < 144; ++i) lt.trans[24 + i] = i;
+    for (i = 0; i < 8; ++i) lt.trans[24 + 144 + i] = 280 + i;
+    for (i = 0; i < 112; ++i) lt.trans[24 + 144 + 8 + i] = 144 + i;
+    for (i = 0; i < 5; ++i) dt.table[i] = 0;
+    dt.table[5] = 32;
+    for (i = 0; i < 32; ++i) dt.trans[i] = i;
+  }
+
+  function build_tree(t, lengths, off, num) {
+    var i, sum;
+    for (i = 0; i < 16; ++i) t.table[i] = 0;
+    for (i = 0; i < num; ++i) t.table[lengths[off + i]]++;
+    t.table[0] = 0;
+    for (sum = 0, i = 0; i < 16; ++i) {
+      offs[i] = sum;
+      sum += t.table[i];
+    }
+    for (i = 0; i < num; ++i) {
+      if (lengths[off + i]) t.trans[offs[lengths[off + i]]++] = i;
+    }
+  }
+
+  function getbit(d) {
+    if (!d.bitcount--) {
+      d.tag = d.source[d.sourceIndex++];
+      d.bitcount = 7;
+    }
+    var bit = d.tag & 1;
+    d.tag >>>= 1;
+    return bit;
+  }
+
+  function read_bits(d, num, base) {
+    if (!num) return base;
+    while (d.bitcount < 24) {
+      d.tag |= d.source[d.sourceIndex++] << d.bitcount;
+      d.bitcount += 8;
+    }
+    var val = d.tag & (0xffff >>> (16 - num));
+    d.tag >>>= num;
+    d.bitcount -= num;
+    return val + base;
+  }
+
+  function decode_symbol(d, t) {
+    while (d.bitcount < 24) {
+      d.tag |= d.source[d.sourceIndex++] << d.bitcount;
+      d.bitcount += 8;
+    }
+    var sum = 0,
+      cur = 0,
+      len = 0,
+      tag = d.tag;
+    // Codes are stored most significant bit first, one length at a time
+    do {
+      cur = 2 * cur + (tag & 1);
+      tag >>>= 1;
+      ++len;
+      sum += t.table[len];
+      cur -= t.table[len];
+    } while (cur >= 0);
+    d.tag = tag;
+    d.bitcount -= len;
+    return t.trans[sum + cur];
+  }
+
+  function decode_trees(d, lt, dt) {
+    var hlit = read_bits(d, 5, 257);
+    var hdist = read_bits(d, 5, 1);
+    var hclen = read_bits(d, 4, 4);
+    var i, num, length, prev, sym;
+    for (i = 0; i < 19; ++i) lengths[i] = 0;
+    for (i = 0; i < hclen; ++i) lengths[clcidx[i]] = read_bits(d, 3, 0);
+    build_tree(code_tree, lengths, 0, 19);
+    for (num = 0; num < hlit + hdist; ) {
+      sym = decode_symbol(d, code_tree);
+      if (sym === 16) {
+        prev = lengths[num - 1];
+        for (length = read_bits(d, 2, 3); length; --length) lengths[num++] = prev;
+      } else if (sym === 17) {
+        for (length = read_bits(d, 3, 3); length; --length) lengths[num++] = 0;
+      } else if (sym === 18) {
+        for (length = read_bits(d, 7, 11); length; --length) lengths[num++] = 0;
+      } else {
+        lengths[num++] = sym;
+      }
+    }
+    build_tree(lt, lengths, 0, hlit);
+    build_tree(dt, lengths, hlit, hdist);
+  }
+
+  function ensure_space(d, num) {
+    if (d.destLen + num > d.dest.length) {
+      var dest = new Uint8Array(Math.max(d.dest.length * 2, d.destLen + num));
+      dest.set(d.dest.subarray(0, d.destLen));
+      d.dest = dest;
+    }
+  }
+
+  function inflate_block_data(d, lt, dt) {
+    var sym, length, dist, start, i;
+    while (true) {
+      sym = decode_symbol(d, lt);
+      if (sym === 256) return;
+      // A literal, or a copy of at most 258 bytes
+      ensure_space(d, 258);
+      if (sym < 256) {
+        d.dest[d.destLen++] = sym;
+      } else {
+        sym -= 257;
+        length = read_bits(d, length_bits[sym], length_base[sym]);
+        dist = decode_symbol(d, dt);
+        start = d.destLen - read_bits(d, dist_bits[dist], dist_base[dist]);
+        for (i = start; i < start + length; ++i) d.dest[d.destLen++] = d.dest[i];
+      }
+    }
+  }
+
+  function inflate_uncompressed_block(d) {
+    // Give back the whole bytes in the bit buffer, and skip to the next byte
+    while (d.bitcount >= 8) {
+      d.sourceIndex--;
+      d.bitcount -= 8;
+    }
+    var length = d.source[d.sourceIndex + 1] * 256 + d.source[d.sourceIndex];
+    var invlength = d.source[d.sourceIndex + 3] * 256 + d.source[d.sourceIndex + 2];
+    if (length !== (~invlength & 0xffff)) throw new Error("Invalid stored block length");
+    d.sourceIndex += 4;
+    ensure_space(d, length);
+    d.dest.set(d.source.subarray(d.sourceIndex, d.sourceIndex + length), d.destLen);
+    d.destLen += length;
+    d.sourceIndex += length;
+    d.tag = 0;
+    d.bitcount = 0;
+  }
+
+  build_fixed_trees(sltree, sdtree);
+  build_bits_base(length_bits, length_base, 4, 3);
+  build_bits_base(dist_bits, dist_base, 2, 1);
+  length_bits[28] = 0;
+  length_base[28] = 258;
+
+  // Decompress zlib data (a Uint8Array). Returns a Uint8Array.
+  return function (source) {
+    var cmf = source[0],
+      flg = source[1];
+    if ((cmf & 0x0f) !== 8 || ((cmf << 8) | flg) % 31 !== 0 || flg & 0x20) {
+      throw new Error("Invalid zlib header");
+    }
+    var d = new Data(source);
+    d.sourceIndex = 2;
+    var bfinal, btype;
+    do {
+      bfinal = getbit(d);
+      btype = read_bits(d, 2, 0);
+      if (btype === 0) {
+        inflate_uncompressed_block(d);
+      } else if (btype === 1) {
+        inflate_block_data(d, sltree, sdtree);
+      } else if (btype === 2) {
+        decode_trees(d, d.ltree, d.dtree);
+        inflate_block_data(d, d.ltree, d.dtree);
+      } else {
+        throw new Error("Invalid deflate block type");
+      }
+    } while (!bfinal);
+    return d.dest.subarray(0, d.destLen);
+  };
+})();
+
+// Decode UTF-8 bytes to a string
+function mqc_utf8_decode(bytes) {
+  if (typeof TextDecoder !== "undefined") {
+    return new TextDecoder("utf-8").decode(bytes);
+  }
+  var chunks = [];
+  for (var i = 0; i < bytes.length; i += 0x8000) {
+    chunks.push(String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000)));
+  }
+  return decodeURIComponent(escape(chunks.join("")));
+}
+
+// Decompress the plot data JSON string, compressed with the given codec
+function mqc_decompress(compressed, codec) {
+  if (codec === undefined) {
+    codec = typeof LZString === "undefined" ? "zlib" : "lzstring";
+  }
+  if (codec === "zlib") {
+    var binary = atob(compressed.trim());
+    var bytes = new Uint8Array(binary.length);
+    for (var i = 0; i < binary.length; i++) {
+      bytes[i] = binary.charCodeAt(i);
+    }
+    return mqc_utf8_decode(mqc_inflate(bytes));
+  }
+  return LZString.decompressFromBase64(compressed);
+}
@@ -22,8 +22,14 @@ $(function () {
   // Show loading warning
   $(".mqc_loading_warning").show();
 
-  // Decompress the JSON plot data
-  mqc_plots = JSON.parse(LZString.decompressFromBase64(mqc_compressed_plotdata));
+  // Decompress the JSON plot data. Plots with their own compressed data
+  // are only decompressed when first used, so that big reports open quickly.
+  if (mqc_compressed_plotdata.trim().length > 0) {
+    mqc_plots = JSON.parse(mqc_decompress(mqc_compressed_plotdata, mqc_config["plot_data_codec"]));
+  }
+  $("script.mqc_compressed_plot").each(function () {
+    mqc_lazy_plot_data($(this).attr("data-plot-id"), this);
+  });
 
   // HighCharts Defaults
   window.HCDefaults = $.extend(true, {}, Highcharts.getOptions(), {});
@@ -239,6 +245,31 @@ $(function () {
   });
 });
 
+// Make the data of a plot available as mqc_plots[plot_id], decompressing
+// it from a script element when it is first used
+function mqc_lazy_plot_data(plot_id, el) {
+  function set_data(data) {
+    Object.defineProperty(mqc_plots, plot_id, {
+      value: data,
+      writable: true,
+      configurable: true,
+      enumerable: true,
+    });
+  }
+  Object.defineProperty(mqc_plots, plot_id, {
+    configurable: true,
+    enumerable: true,
+    get: function () {
+      var data = JSON.parse(mqc_decompress(el.textContent, mqc_config["plot_data_codec"]));
+      set_data(data);
+      // Free the compressed data
+      $(el).remove();
+      return data;
+    },
+    set: set_data,
+  });
+}
+
 // Call to render any plot
 function plot_graph(target, ds, max_num) {
   if (mqc_plots[target] === undefined) {
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+""" MultiQC report assets. Static files used by the report templates (JavaScript, CSS,
+images and fonts) are either included in the report itself, or with config.split_assets,
+written once to a shared directory with the hash of their contents in the file name, and
+linked from the report. The contents and hashes of the files are kept for the rest of the
+process, so that later reports don't have to read and encode them again. """
+
+
+import base64
+import hashlib
+import io
+import os
+import tempfile
+
+from . import config
+
+logger = config.logger
+
+# Asset file contents, base64 strings and hashed file names, by path, size and modification time
+_cache = dict()
+
+
+def _cached(path, kind, func):
+    """Cached result of func(path), until the file changes"""
+    st = os.stat(path)
+    key = (os.path.realpath(path), st.st_size, st.st_mtime_ns, kind)
+    try:
+        return _cache[key]
+    except KeyError:
+        _cache[key] = func(path)
+        return _cache[key]
+
+
+def read_text(path):
+    """Contents of a text file"""
+
+    def read(path):
+        with io.open(path, "r", encoding="utf-8") as fh:
+            return fh.read()
+
+    return _cached(path, "text", read)
+
+
+def read_b64(path):
+    """Contents of a file as a base64 string"""
+
+    def read(path):
+        with io.open(path, "rb") as fh:
+            return base64.b64encode(fh.read()).decode("utf-8")
+
+    return _cached(path, "b64", read)
+
+
+def hashed_fn(path):
+    """File name of an asset in the assets directory: its name with the start of the hash of its contents"""
+
+    def file_hash(path):
+        sha = hashlib.sha256()
+        with io.open(path, "rb") as fh:
+            for block in iter(lambda: fh.read(1024 * 1024), b""):
+                sha.update(block)
+        base, ext = os.path.splitext(os.path.basename(path))
+        return "{}.{}{}".format(base, sha.hexdigest()[:12], ext)
+
+    return _cached(path, "hash", file_hash)
+
+
+def assets_dir():
+    """Directory that split report assets are written to"""
+    if config.assets_dir:
+        return os.path.realpath(config.assets_dir)
+    return os.path.join(os.path.dirname(os.path.realpath(config.output_fn)), config.assets_dir_name)
+
+
+def write_asset(path):
+    """
+    Copy a file to the assets directory, unless it is already there. Returns the URL of the copy,
+    relative to the report. As the file name has the hash of the contents, an existing file is
+    always the same - so reports can share the directory, even when they are written at the same time.
+    """
+    dest_dir = assets_dir()
+    dest = os.path.join(dest_dir, hashed_fn(path))
+    if not os.path.exists(dest):
+        os.makedirs(dest_dir, exist_ok=True)
+        with io.open(path, "rb") as fh:
+            contents = fh.read()
+        # Write to a temporary file first, so that a half-written asset is never seen
+        fd, tmp_fn = tempfile.mkstemp(dir=dest_dir, prefix=".tmp_")
+        try:
+            with io.open(fd, "wb") as fh:
+                fh.write(contents)
+            os.chmod(tmp_fn, 0o644)
+            os.replace(tmp_fn, dest)
+        except BaseException:
+            os.remove(tmp_fn)
+            raise
+        logger.debug("Wrote report asset {}".format(dest))
+    rel_path = os.path.relpath(dest, os.path.dirname(os.path.realpath(config.output_fn)))
+    return rel_path.replace(os.sep, "/")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+""" MultiQC file buffer pool. Keeps the contents of small files that were already
+read during the file search, so that modules can be given them without opening
+and reading the files a second time. """
+
+
+from collections import OrderedDict
+
+from . import config
+
+logger = config.logger
+
+
+class FileBufferPool(object):
+    """
+    Bounded least-recently-used store of file contents, keyed by file path.
+
+    Each file is stored with the number of times it is expected to be used (the
+    number of search keys that it matched). It is dropped as soon as it has been
+    used that many times, or when the pool is over `max_bytes` and it is the
+    least recently added file.
+    """
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._buffers = OrderedDict()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def add(self, path, text, uses=1):
+        """Keep the contents of a file, if it fits in the pool"""
+        size = len(text)
+        if not self.enabled or size > self.max_bytes or uses < 1:
+            return
+        self.discard(path)
+        self._buffers[path] = [text, uses]
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (old_text, _) = self._buffers.popitem(last=False)
+            self.size -= len(old_text)
+            self.evicted += 1
+
+    def get(self, path):
+        """Get the contents of a file, or None if it isn't in the pool"""
+        buf = self._buffers.get(path)
+        if buf is None:
+            if self.enabled:
+                self.misses += 1
+            return None
+        self.hits += 1
+        buf[1] -= 1
+        if buf[1] <= 0:
+            self.discard(path)
+        return buf[0]
+
+    def discard(self, path):
+        """Remove a file from the pool"""
+        buf = self._buffers.pop(path, None)
+        if buf is not None:
+            self.size -= len(buf[0])
+
+    def clear(self):
+        """Remove everything from the pool"""
+        self._buffers.clear()
+        self.size = 0
@@ -14,16 +14,17 @@ import subprocess
 import sys
 from datetime import datetime
 
-import pkg_resources
 import yaml
 
 import multiqc
 
+from .entry_points import get_entry_points, get_version
+
 logger = logging.getLogger("multiqc")
 
 # Get the MultiQC version
-version = pkg_resources.get_distribution("multiqc").version
-short_version = pkg_resources.get_distribution("multiqc").version
+version = get_version("multiqc")
+short_version = version
 script_path = os.path.dirname(os.path.realpath(__file__))
 git_hash = None
 git_hash_short = None
@@ -41,15 +42,17 @@ MULTIQC_DIR = os.path.dirname(os.path.realpath(inspect.getfile(multiqc)))
 
 ##### MultiQC Defaults
 # Default MultiQC config
+# Use the much faster LibYAML parser for the big default config files, if available
+yaml_loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 searchp_fn = os.path.join(MULTIQC_DIR, "utils", "config_defaults.yaml")
 with open(searchp_fn) as f:
-    configs = yaml.safe_load(f)
+    configs = yaml.load(f, Loader=yaml_loader)
     for c, v in configs.items():
         globals()[c] = v
 # Module filename search patterns
 searchp_fn = os.path.join(MULTIQC_DIR, "utils", "search_patterns.yaml")
 with open(searchp_fn) as f:
-    sp = yaml.safe_load(f)
+    sp = yaml.load(f, Loader=yaml_loader)
 
 # Other defaults that can't be set in YAML
 data_tmp_dir = "/tmp"  # will be overwritten by core script
@@ -64,17 +67,15 @@ megaqc_access_token = os.environ.get("MEGAQC_ACCESS_TOKEN")
 # Modules must be listed in setup.py under entry_points['multiqc.modules.v1']
 # Get all modules, including those from other extension packages
 avail_modules = dict()
-for entry_point in pkg_resources.iter_entry_points("multiqc.modules.v1"):
-    nicename = str(entry_point).split("=")[0].strip()
-    avail_modules[nicename] = entry_point
+for entry_point in get_entry_points("multiqc.modules.v1"):
+    avail_modules[entry_point.name] = entry_point
 
 ##### Available templates
 # Templates must be listed in setup.py under entry_points['multiqc.templates.v1']
 # Get all templates, including those from other extension packages
 avail_templates = {}
-for entry_point in pkg_resources.iter_entry_points("multiqc.templates.v1"):
-    nicename = str(entry_point).split("=")[0].strip()
-    avail_templates[nicename] = entry_point
+for entry_point in get_entry_points("multiqc.templates.v1"):
+    avail_templates[entry_point.name] = entry_point
 
 ##### Check we have modules & templates
 # Check that we were able to find some modules and templates
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+""" MultiQC entry points. Modules, templates, plugin hooks and extra command line
+options are found through the entry points of installed packages. These are read
+from the package metadata once and kept for the rest of the session, using
+importlib.metadata instead of the slow to import pkg_resources where possible. """
+
+
+import functools
+
+try:
+    from importlib import metadata
+except ImportError:  # Python < 3.8
+    metadata = None
+
+# Entry point groups used by MultiQC
+groups = ["multiqc.modules.v1", "multiqc.templates.v1", "multiqc.hooks.v1", "multiqc.cli_options.v1"]
+
+
+@functools.lru_cache(maxsize=None)
+def entry_point_table():
+    """Dict of the entry points of every installed package for each MultiQC entry point group"""
+    table = {group: list() for group in groups}
+    if metadata is None:
+        import pkg_resources
+
+        for group in groups:
+            table[group] = list(pkg_resources.iter_entry_points(group))
+        return table
+
+    all_entry_points = metadata.entry_points()
+    for group in groups:
+        if hasattr(all_entry_points, "select"):
+            group_entry_points = all_entry_points.select(group=group)
+        else:  # Python < 3.10
+            group_entry_points = all_entry_points.get(group, [])
+        # The same package can be found more than once on the path
+        seen = set()
+        for entry_point in group_entry_points:
+            if (entry_point.name, entry_point.value) not in seen:
+                seen.add((entry_point.name, entry_point.value))
+                table[group].append(entry_point)
+    return table
+
+
+def get_entry_points(group):
+    """List of entry points in a group, with `name` and `load()`"""
+    return entry_point_table()[group]
+
+
+def get_version(package):
+    """Installed version of a package"""
+    if metadata is None:
+        import pkg_resources
+
+        return pkg_resources.get_distribution(package).version
+    return metadata.version(package)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+""" MultiQC file type sniffer. Classifies files from their first few bytes, so that
+binary and compressed files can be ruled out before searching them as text. """
+
+
+import codecs
+import gzip
+import io
+import zlib
+
+# Number of bytes read from the start of a file to work out its type
+SNIFF_BYTES = 512
+
+# File types, as recorded in report.file_search_stats
+FILE_TYPES = ["text", "gzip", "bgzf", "bam", "cram", "zip", "image", "binary"]
+
+# File types that can be decompressed as a gzip stream
+GZIP_TYPES = ["gzip", "bgzf"]
+
+# Magic bytes at the start of image files
+IMAGE_MAGIC = [
+    b"\x89PNG\r\n\x1a\n",  # PNG
+    b"\xff\xd8\xff",  # JPEG
+    b"GIF87a",  # GIF
+    b"GIF89a",  # GIF
+    b"II*\x00",  # TIFF, little-endian
+    b"MM\x00*",  # TIFF, big-endian
+    b"%PDF-",  # PDF
+]
+
+
+class BinaryFileError(ValueError):
+    """Raised by open_text() when trying to read a file that isn't text. `file_type` is the type it was sniffed as"""
+
+    def __init__(self, file_type):
+        super().__init__("Not a text file ({})".format(file_type))
+        self.file_type = file_type
+
+    def __reduce__(self):
+        return BinaryFileError, (self.file_type,)
+
+
+def sniff_file_type(head, eof=None):
+    """
+    Classify a file as one of FILE_TYPES from its first SNIFF_BYTES bytes.
+    `eof` says whether `head` is the whole file (guessed from its length if not given),
+    so that a multi-byte character cut off at the end of `head` isn't taken as invalid text.
+    """
+    if eof is None:
+        eof = len(head) < SNIFF_BYTES
+    if head.startswith(b"\x1f\x8b"):
+        # BGZF is gzip with an extra "BC" subfield. BAM is BGZF-compressed, starting with "BAM\1"
+        if len(head) >= 18 and head[3] & 4 and head[12:14] == b"BC":
+            try:
+                if zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(head, 4).startswith(b"BAM\x01"):
+                    return "bam"
+            except zlib.error:
+                pass
+            return "bgzf"
+        return "gzip"
+    if head.startswith(b"CRAM"):
+        return "cram"
+    if head.startswith(b"PK\x03\x04") or head.startswith(b"PK\x05\x06"):
+        return "zip"
+    if any(head.startswith(magic) for magic in IMAGE_MAGIC):
+        return "image"
+    if b"\x00" in head:
+        return "binary"
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=eof)
+    except UnicodeDecodeError:
+        return "binary"
+    return "text"
+
+
+def open_text(path, decompress=False, text_only=True):
+    """
+    Open a file for reading as UTF-8 text, sniffing its type from the first bytes
+    without opening it twice. Returns the text file handle and the file type.
+
+    With `decompress`, gzip and BGZF files are decompressed as they are read, so
+    only as much of the file is decompressed as is actually read.
+    With `text_only`, BinaryFileError is raised for any file that isn't text
+    (or compressed text, if decompressing), with the type of the file.
+    """
+    fh = io.open(path, "rb")
+    try:
+        head = fh.peek(SNIFF_BYTES)[:SNIFF_BYTES]
+        file_type = sniff_file_type(head)
+        if decompress and file_type in GZIP_TYPES:
+            gz = gzip.GzipFile(fileobj=fh)
+            # Close the underlying file along with the gzip stream, as if gzip had opened it
+            gz.myfileobj = fh
+            return io.TextIOWrapper(gz, encoding="utf-8"), file_type
+        if text_only and file_type != "text":
+            raise BinaryFileError(file_type)
+        return io.TextIOWrapper(fh, encoding="utf-8"), file_type
+    except BaseException:
+        fh.close()
+        raise
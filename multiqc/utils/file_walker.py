@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+""" MultiQC directory walker. Collects the list of files to search from the
+analysis directories, using os.scandir so that file type and size checks reuse
+the information from the directory listing instead of making new syscalls. """
+
+
+import concurrent.futures
+import fnmatch
+import os
+import time
+from collections import defaultdict
+
+from . import config
+
+logger = config.logger
+
+# If all of these files are found in one directory, we're probably running in the MultiQC source directory
+multiqc_installation_dir_files = [
+    "LICENSE",
+    "CHANGELOG.md",
+    "Dockerfile",
+    "MANIFEST.in",
+    ".gitmodules",
+    "README.md",
+    "CSP.txt",
+    "setup.py",
+    ".gitignore",
+]
+
+
+def walk_analysis_paths(paths, workers=1):
+    """
+    Walk through the analysis paths (files or directories) and collect the files to search.
+    Files matching `config.fn_ignore_files` or bigger than `config.log_filesize_limit` are
+    skipped during the walk, as are directories matching `config.fn_ignore_dirs` / `fn_ignore_paths`.
+
+    With workers > 1, the analysis paths are listed concurrently. The files are always
+    returned in the same order as a single-threaded walk.
+
+    Returns a list of [fn, root, stat] items, where `stat` is an os.stat_result (or None
+    if the file could not be stat'd), and a dict of counts of skipped files and syscalls.
+    """
+    start = time.time()
+    workers = min(max(1, int(workers or 1)), len(paths))
+    if workers > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            walked = list(executor.map(walk_analysis_path, paths))
+    else:
+        walked = [walk_analysis_path(path) for path in paths]
+
+    searchfiles = list()
+    stats = defaultdict(int)
+    for path_files, path_stats in walked:
+        searchfiles.extend(path_files)
+        for key, count in path_stats.items():
+            stats[key] += count
+    stats["walk_time"] = time.time() - start
+    return searchfiles, stats
+
+
+def walk_analysis_path(path):
+    """Collect the files to search for a single analysis path. Returns the files and skip / syscall counts."""
+    searchfiles = list()
+    stats = defaultdict(int)
+    if os.path.islink(path) and config.ignore_symlinks:
+        stats["skipped_symlinks"] += 1
+    elif os.path.isfile(path):
+        add_searchfile(os.path.basename(path), os.path.dirname(path), None, searchfiles, stats)
+    elif os.path.isdir(path):
+        walk_directory(path, searchfiles, stats)
+    return searchfiles, stats
+
+
+def walk_directory(top, searchfiles, stats):
+    """
+    Depth-first walk of a directory with os.scandir, visiting files and sub-directories
+    in the same order as os.walk(topdown=True).
+    """
+    followlinks = not config.ignore_symlinks
+
+    # Skip files in the top directory itself if it matches the ignore params
+    skip_top = any([fnmatch.fnmatch(os.path.basename(top), n.rstrip(os.sep)) for n in config.fn_ignore_dirs]) or any(
+        [fnmatch.fnmatch(top, n.rstrip(os.sep)) for n in config.fn_ignore_paths]
+    )
+
+    stack = [top]
+    while stack:
+        root = stack.pop()
+        dir_entries = list()
+        file_entries = list()
+        try:
+            stats["walk_scandir_calls"] += 1
+            with os.scandir(root) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        dir_entries.append(entry)
+                    else:
+                        file_entries.append(entry)
+        except OSError as e:
+            logger.debug("Couldn't list directory when searching for files: {} ({})".format(root, e))
+            continue
+
+        # Skip any sub-directories matching ignore params
+        dirnames = list()
+        for entry in dir_entries:
+            if any([fnmatch.fnmatch(entry.name, n.rstrip(os.sep)) for n in config.fn_ignore_dirs]) or any(
+                [fnmatch.fnmatch(os.path.join(root, entry.name), n.rstrip(os.sep)) for n in config.fn_ignore_paths]
+            ):
+                stats["skipped_directory_fn_ignore_dirs"] += 1
+                continue
+            dirnames.append(entry)
+
+        if root == top and skip_top:
+            stats["skipped_directory_fn_ignore_dirs"] += 1
+            file_entries = list()
+
+        # Sanity check - make sure that we're not just running in the installation directory
+        filenames = [entry.name for entry in file_entries]
+        if len(filenames) > 0 and all([fn in filenames for fn in multiqc_installation_dir_files]):
+            logger.error("Error: MultiQC is running in source code directory! {}".format(root))
+            logger.warning("Please see the docs for how to use MultiQC: https://multiqc.info/docs/#running-multiqc")
+            continue
+
+        # Files in this directory
+        for entry in file_entries:
+            add_searchfile(entry.name, root, entry, searchfiles, stats)
+
+        # Walk sub-directories in listing order, symlinked directories only if we follow links
+        for entry in reversed(dirnames):
+            if not followlinks and entry.is_symlink():
+                continue
+            stack.append(os.path.join(root, entry.name))
+
+
+def add_searchfile(fn, root, entry, searchfiles, stats):
+    """
+    Check that a file found in the walk should be searched and add it to the list.
+    `entry` is the os.DirEntry from the directory listing if there was one, its cached
+    type and stat results are used so that each file is only stat'd once.
+    """
+    # Check that this is a file and not a pipe or anything weird
+    try:
+        if entry is not None:
+            is_file = entry.is_file()
+        else:
+            stats["walk_stat_calls"] += 1
+            is_file = os.path.isfile(os.path.join(root, fn))
+    except OSError:
+        is_file = False
+    if not is_file:
+        stats["skipped_not_a_file"] += 1
+        return
+
+    # Check that we don't want to ignore this file
+    i_matches = [n for n in config.fn_ignore_files if fnmatch.fnmatch(fn, n)]
+    if len(i_matches) > 0:
+        stats["skipped_ignore_pattern"] += 1
+        return
+
+    # Limit search to small files, to avoid 30GB FastQ files etc.
+    try:
+        stats["walk_stat_calls"] += 1
+        st = entry.stat() if entry is not None else os.stat(os.path.join(root, fn))
+    except (IOError, OSError, ValueError, UnicodeDecodeError):
+        logger.debug("Couldn't read file when checking filesize: {}".format(fn))
+        st = None
+    else:
+        if st.st_size > config.log_filesize_limit:
+            stats["skipped_filesize_limit"] += 1
+            return
+
+    searchfiles.append([fn, root, st])
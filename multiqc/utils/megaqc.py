@@ -6,9 +6,9 @@
 import gzip
 import io
 import json
+import math
 import os
-
-import requests
+import re
 
 from . import config
 
@@ -34,6 +34,7 @@ def multiqc_dump_json(report):
             "general_stats_headers",
             "multiqc_command",
             "plot_data",
+            "flat_plot_data",
             "saved_raw_data",
         ],
         "config": [
@@ -68,9 +69,72 @@ def multiqc_dump_json(report):
                 exported_data["config_analysis_dir_abs"].append(os.path.abspath(d))
             except:
                 pass
+    exported_data["report_modules"] = modules_outline(report)
+    exported_data["report_general_stats_modify"] = general_stats_modify(report)
     return exported_data
 
 
+def general_stats_modify(report):
+    """
+    Scale factors of the `modify` functions of the general statistics columns, in the same order as
+    the headers. Headers are exported with `modify` as its value for 1, so this records whether that
+    is the factor the values are multiplied by, or None if `modify` does something else.
+    Used to apply `modify` again with `multiqc --merge-data`.
+    """
+    scales = list()
+    for headers in getattr(report, "general_stats_headers", []):
+        scales.append({k: modify_scale(h["modify"]) for k, h in headers.items() if callable(h.get("modify"))})
+    return scales
+
+
+def modify_scale(modify):
+    """The number that a `modify` function multiplies values by, or None if it isn't a multiplication"""
+    try:
+        scale = float(modify(1))
+        for x in [0, 2, 0.5, 100, 123456.789]:
+            if not math.isclose(float(modify(x)), x * scale, rel_tol=1e-9, abs_tol=1e-12):
+                return None
+    except Exception:
+        return None
+    return scale
+
+
+def modules_outline(report):
+    """
+    Names, anchors and text of the report modules and their sections, with the IDs of the
+    plots in each section (interactive or flat). Used to put merged plots back in place with `multiqc --merge-data`.
+    """
+    outline = list()
+    for mod in getattr(report, "modules_output", []):
+        sections = list()
+        for section in mod.sections:
+            plot_ids = list()
+            for html_id in re.findall(r'id="([^"]+)"', "{}{}".format(section["plot"], section["content"])):
+                is_plot = html_id in report.plot_data or html_id in getattr(report, "flat_plot_data", {})
+                if is_plot and html_id not in plot_ids:
+                    plot_ids.append(html_id)
+            sections.append(
+                {
+                    "name": section["name"],
+                    "anchor": section["anchor"],
+                    "description": section["description"],
+                    "comment": section["comment"],
+                    "helptext": section["helptext"],
+                    "plot_ids": plot_ids,
+                }
+            )
+        outline.append(
+            {
+                "name": mod.name,
+                "anchor": mod.anchor,
+                "intro": getattr(mod, "intro", None),
+                "comment": mod.comment,
+                "sections": sections,
+            }
+        )
+    return outline
+
+
 def multiqc_api_post(exported_data):
     headers = {"Content-Type": "application/json", "content-encoding": "gzip"}
     if config.megaqc_access_token is not None:
@@ -85,6 +149,9 @@ def multiqc_api_post(exported_data):
     gzfh.close()
     request_body = sio_obj.getvalue()
 
+    # Only imported when uploading, as requests is slow to import
+    import requests
+
     log.debug("Sending data to MegaQC")
     log.debug("MegaQC URL: {}".format(config.megaqc_url))
     try:
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+
+""" MultiQC data merging. Builds a report from the multiqc_data.json files written by
+earlier runs (see megaqc.multiqc_dump_json()), without searching for or parsing any
+analysis files. Used with `multiqc --merge-data run1/multiqc_data run2/multiqc_data`. """
+
+
+import io
+import json
+import os
+import re
+from collections import OrderedDict
+
+from ..modules.base_module import BaseMultiqcModule
+from ..plots import bargraph, beeswarm, heatmap, linegraph, scatter
+from . import config, report, util_functions
+
+logger = config.logger
+
+# Plot types that can be rendered again from the plot data, and merged between runs
+render_functions = {
+    "bar_graph": lambda pid, pdata: bargraph.make_plot(
+        pdata["datasets"], pdata["samples"], dict(pdata["config"], id=pid)
+    ),
+    "xy_line": lambda pid, pdata: linegraph.make_plot(pdata["datasets"], dict(pdata["config"], id=pid)),
+    "scatter": lambda pid, pdata: scatter.highcharts_scatter_plot(pdata["datasets"], dict(pdata["config"], id=pid)),
+    "heatmap": lambda pid, pdata: heatmap.highcharts_heatmap(
+        heatmap_matrix(pdata), pdata["xcats"], pdata["ycats"], dict(pdata["config"], id=pid)
+    ),
+    "beeswarm": lambda pid, pdata: beeswarm.highcharts_beeswarm(
+        report.save_htmlid(pid), pdata["samples"], pdata["datasets"], pdata["categories"]
+    ),
+}
+
+
+def find_dump_file(path):
+    """Path to the multiqc_data.json file of a run, given the file itself, the data directory or the report directory"""
+    for fn in [path, os.path.join(path, "multiqc_data.json"), os.path.join(path, "multiqc_data", "multiqc_data.json")]:
+        if os.path.isfile(fn):
+            return fn
+    return None
+
+
+def load_dumps(paths):
+    """Load the multiqc_data.json files of earlier runs. Returns a list of dicts"""
+    dumps = list()
+    for path in paths:
+        fn = find_dump_file(path)
+        if fn is None:
+            logger.error("Could not find multiqc_data.json in {}".format(path))
+            continue
+        logger.info("Merging data : {}".format(os.path.abspath(fn)))
+        try:
+            with io.open(fn, "r", encoding="utf-8") as fh:
+                dumps.append(json.load(fh))
+        except (IOError, OSError, ValueError) as e:
+            logger.error("Could not load {}: {}".format(fn, e))
+    return dumps
+
+
+def merge_order(order, keys):
+    """
+    Add the keys of one run that aren't in the merged order yet, before the next key of that
+    run that is. Keeps things in the same order as a single run would have them.
+    """
+    for idx, key in enumerate(keys):
+        if key not in order:
+            following = [order.index(k) for k in keys[idx + 1 :] if k in order]
+            order.insert(following[0] if following else len(order), key)
+
+
+def merge_dicts(a, b):
+    """Recursively merge dict b into dict a, values from b replace those in a"""
+    for k, v in b.items():
+        if isinstance(v, dict) and isinstance(a.get(k), dict):
+            merge_dicts(a[k], v)
+        else:
+            a[k] = v
+    return a
+
+
+##################################################
+#### GENERAL STATISTICS
+
+
+def general_stats_header(header, namespace, scale=None):
+    """
+    Header of a general statistics column from the JSON dump, as it was before the table was rendered.
+    The HTML ID is generated again. `modify` functions were exported as their value for 1, and can only
+    be applied again if they multiply the values by a number: `scale`, recorded in the dump with
+    megaqc.general_stats_modify(). Other `modify` functions are left out.
+    """
+    header = dict(header)
+    # Set again by the table, from the position of the column
+    header.pop("colour", None)
+    rid = header.pop("rid", None)
+    if rid is not None:
+        ns_html = re.sub(r"\W+", "_", namespace).strip().strip("_").lower()
+        prefix = "mqc-generalstats-{}-".format(ns_html)
+        header["rid"] = rid[len(prefix) :] if rid.startswith(prefix) else rid
+    modify = header.pop("modify", None)
+    if modify is None or header.get("shared_key") in ["read_count", "long_read_count", "base_count"]:
+        # Read and base counts are scaled again by the table, from the configured multiplier
+        pass
+    elif scale is not None:
+        if scale != 1:
+            header["modify"] = lambda x, m=scale: x * m if isinstance(x, (int, float)) else x
+    else:
+        logger.warning(
+            "Showing values of general statistics column '{}' as they were parsed: "
+            "its 'modify' function can't be applied again".format(header.get("title", header.get("rid")))
+        )
+    return header
+
+
+def merge_general_stats(dumps):
+    """
+    Merge the general statistics of several runs into the report. Groups of columns added by
+    modules are matched by their namespaces and column keys, samples found again in later runs
+    replace those from earlier runs.
+    """
+    merged = list()
+    order = list()
+    for dump in dumps:
+        run_order = list()
+        # Older dumps don't say which modify functions multiply the values
+        all_headers = dump.get("report_general_stats_headers", [])
+        all_scales = dump.get("report_general_stats_modify", [dict() for _ in all_headers])
+        for data, headers, scales in zip(dump.get("report_general_stats_data", []), all_headers, all_scales):
+            if len(headers) == 0:
+                continue
+            columns = {(h.get("namespace", ""), k) for k, h in headers.items()}
+            for idx, (m_columns, m_data, m_headers) in enumerate(merged):
+                if columns & m_columns:
+                    m_columns.update(columns)
+                    break
+            else:
+                idx = len(merged)
+                m_data, m_headers = OrderedDict(), OrderedDict()
+                merged.append((columns, m_data, m_headers))
+            run_order.append(idx)
+            for k, header in headers.items():
+                if k not in m_headers:
+                    m_headers[k] = general_stats_header(header, header.get("namespace", ""), scales.get(k))
+            for s_name, values in data.items():
+                m_data.setdefault(s_name, dict()).update(values)
+        merge_order(order, run_order)
+    for idx in order:
+        _, m_data, m_headers = merged[idx]
+        report.general_stats_data.append(m_data)
+        report.general_stats_headers.append(m_headers)
+
+
+##################################################
+#### PLOTS
+
+
+def merge_bar_graph(a, b):
+    """Merge the bar graph data from b into a. Series are matched by name, samples in b replace those in a"""
+    for idx, (samples_b, series_b) in enumerate(zip(b["samples"], b["datasets"])):
+        if idx >= len(a["datasets"]):
+            a["samples"].append(samples_b)
+            a["datasets"].append(series_b)
+            continue
+        samples_a = a["samples"][idx]
+        new_samples = [s for s in samples_b if s not in samples_a]
+        samples = samples_a + new_samples
+        by_name = OrderedDict()
+        for series in a["datasets"][idx]:
+            series["data"] = series["data"] + [float("nan")] * len(new_samples)
+            by_name[series["name"]] = series
+        position = {s_name: i for i, s_name in enumerate(samples)}
+        for series in series_b:
+            if series["name"] not in by_name:
+                by_name[series["name"]] = dict(series, data=[float("nan")] * len(samples))
+            data = by_name[series["name"]]["data"]
+            for s_name, value in zip(samples_b, series["data"]):
+                data[position[s_name]] = value
+        # Keep the samples sorted if both runs sorted them
+        if samples_a == sorted(samples_a) and samples_b == sorted(samples_b):
+            order = sorted(range(len(samples)), key=lambda i: samples[i])
+            samples = [samples[i] for i in order]
+            for series in by_name.values():
+                series["data"] = [series["data"][i] for i in order]
+        a["samples"][idx] = samples
+        a["datasets"][idx] = list(by_name.values())
+
+
+def merge_beeswarm(a, b):
+    """Merge the beeswarm data from b into a. Categories are matched by namespace and title"""
+    positions = {(c["namespace"], c["title"]): idx for idx, c in enumerate(a["categories"])}
+    for category, samples_b, data_b in zip(b["categories"], b["samples"], b["datasets"]):
+        idx = positions.get((category["namespace"], category["title"]))
+        if idx is None:
+            a["categories"].append(category)
+            a["samples"].append(samples_b)
+            a["datasets"].append(data_b)
+            continue
+        values = OrderedDict(zip(a["samples"][idx], a["datasets"][idx]))
+        values.update(zip(samples_b, data_b))
+        a["samples"][idx] = list(values.keys())
+        a["datasets"][idx] = list(values.values())
+        a["categories"][idx]["max"] = max(a["categories"][idx]["max"], category["max"])
+        a["categories"][idx]["min"] = min(a["categories"][idx]["min"], category["min"])
+
+
+def merge_series(a, b):
+    """Merge line graph or scatter plot data from b into a. Series or points with the same name are replaced"""
+    for idx, series_b in enumerate(b["datasets"]):
+        if idx >= len(a["datasets"]):
+            a["datasets"].append(series_b)
+            continue
+        names_b = {s.get("name") for s in series_b}
+        a["datasets"][idx] = [s for s in a["datasets"][idx] if s.get("name") not in names_b] + series_b
+
+
+merge_functions = {
+    "bar_graph": merge_bar_graph,
+    "xy_line": merge_series,
+    "scatter": merge_series,
+    "beeswarm": merge_beeswarm,
+}
+
+
+def heatmap_matrix(pdata):
+    """Heatmap values as rows of the y categories, as passed to heatmap.plot(), from the [x, y, value] plot data"""
+    matrix = [[None] * len(pdata["xcats"]) for _ in pdata["ycats"]]
+    for x, y, value in pdata["data"]:
+        matrix[y][x] = value
+    return matrix
+
+
+def merge_plot_data(dumps):
+    """
+    Merge the plot data of several runs, interactive or flat. Returns a dict with a list of plot data for
+    each plot ID: plots that can't be merged (heatmaps, or plots of a different type) are kept as separate plots.
+    """
+    merged = OrderedDict()
+    for dump in dumps:
+        all_plot_data = list(dump.get("report_plot_data", {}).items())
+        all_plot_data.extend(dump.get("report_flat_plot_data", {}).items())
+        for pid, pdata in all_plot_data:
+            if pdata.get("plot_type") not in render_functions:
+                logger.debug("Can't merge plot '{}' of type '{}'".format(pid, pdata.get("plot_type")))
+                continue
+            plots = merged.setdefault(pid, list())
+            for existing in plots:
+                merge_function = merge_functions.get(pdata["plot_type"])
+                if existing["plot_type"] == pdata["plot_type"] and merge_function is not None:
+                    merge_function(existing, pdata)
+                    break
+            else:
+                plots.append(pdata)
+    return merged
+
+
+def render_plots(plots, pid):
+    """HTML for the merged plots with a plot ID"""
+    return "".join(render_functions[pdata["plot_type"]](pid, pdata) for pdata in plots)
+
+
+##################################################
+#### MODULES
+
+
+def module_outlines(dumps, plot_data):
+    """
+    Modules and their sections from the report_modules outlines of all runs, in the order of the
+    runs. Without an outline (dumps from older versions of MultiQC), plots are put in one module.
+    """
+    modules = dict()
+    sections = dict()
+    module_order = list()
+    section_order = dict()
+    for dump in dumps:
+        for mod in dump.get("report_modules", []):
+            modules.setdefault(mod["anchor"], mod)
+            for section in mod.get("sections", []):
+                if section["anchor"] not in sections:
+                    sections[section["anchor"]] = dict(section, plot_ids=list())
+                plot_ids = sections[section["anchor"]]["plot_ids"]
+                plot_ids.extend(pid for pid in section.get("plot_ids", []) if pid not in plot_ids)
+            merge_order(section_order.setdefault(mod["anchor"], list()), [s["anchor"] for s in mod.get("sections", [])])
+        merge_order(module_order, [mod["anchor"] for mod in dump.get("report_modules", [])])
+    outlines = [dict(modules[a], sections=[sections[s] for s in section_order[a]]) for a in module_order]
+
+    placed_plots = {pid for section in sections.values() for pid in section["plot_ids"]}
+    other_plots = [pid for pid in plot_data if pid not in placed_plots]
+    if other_plots:
+        outlines.append(
+            {
+                "name": "Merged data",
+                "anchor": "merged_data",
+                "sections": [
+                    {"name": pid, "anchor": "merged_data-{}".format(pid), "plot_ids": [pid]} for pid in other_plots
+                ],
+            }
+        )
+    return outlines
+
+
+def merge_data(paths):
+    """
+    Merge the data of earlier runs into the report: general statistics, plots, data sources and saved
+    raw data. Returns the list of module objects for the report, with the sections that have plots.
+    """
+    dumps = load_dumps(paths)
+    if len(dumps) == 0:
+        return list()
+
+    for dump in dumps:
+        merge_dicts(report.data_sources, dump.get("report_data_sources", {}))
+    merge_general_stats(dumps)
+
+    saved_raw_data = OrderedDict()
+    for dump in dumps:
+        for fn, data in dump.get("report_saved_raw_data", {}).items():
+            # Written again when the general statistics table is rendered
+            if fn == "multiqc_general_stats":
+                continue
+            if isinstance(data, dict) and isinstance(saved_raw_data.get(fn), dict):
+                merge_dicts(saved_raw_data[fn], data)
+            else:
+                saved_raw_data[fn] = data
+    for fn, data in saved_raw_data.items():
+        report.saved_raw_data[fn] = data
+        util_functions.write_data_file(data, fn)
+
+    plot_data = merge_plot_data(dumps)
+    modules = list()
+    for outline in module_outlines(dumps, plot_data):
+        if outline["anchor"] == "multiqc_runtime":
+            continue
+        mod = BaseMultiqcModule(
+            name=outline["name"],
+            anchor=outline["anchor"],
+            comment=outline.get("comment"),
+            autoformat=False,
+        )
+        if outline.get("intro"):
+            mod.intro = outline["intro"]
+        left_out = list()
+        for section in outline["sections"]:
+            plot = "".join(render_plots(plot_data[pid], pid) for pid in section["plot_ids"] if pid in plot_data)
+            if plot == "":
+                left_out.append(section.get("name") or section["anchor"])
+                continue
+            mod.add_section(
+                name=section.get("name"),
+                anchor=section["anchor"],
+                description=section.get("description") or "",
+                comment=section.get("comment") or "",
+                helptext=section.get("helptext") or "",
+                plot=plot,
+                autoformat=False,
+            )
+        # Only plot data is saved in multiqc_data.json: tables, images and text can't be shown again
+        if len(mod.sections) == 0:
+            logger.warning("Left out module '{}': none of its sections have plot data".format(outline["name"]))
+            continue
+        if left_out:
+            logger.warning(
+                "Left out sections of module '{}' without plot data: {}".format(outline["name"], ", ".join(left_out))
+            )
+        modules.append(mod)
+    logger.info(
+        "Merged data from {} runs: {} modules, {} plots".format(
+            len(dumps), len(modules), sum(len(plots) for plots in plot_data.values())
+        )
+    )
+    return modules
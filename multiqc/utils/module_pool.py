@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+""" MultiQC module process pool. Runs independent modules in worker processes and
+merges what they add to the report back in the original module order, so that the
+report is the same as when the modules are run one after another. """
+
+
+import concurrent.futures
+import copyreg
+import importlib
+import io
+import marshal
+import multiprocessing
+import os
+import pickle
+import random
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+import types
+from concurrent.futures.process import BrokenProcessPool
+
+from ..modules.base_module import BaseMultiqcModule
+from . import config, report, spans
+from .watchdog import ModuleLimitExceeded, ModuleWatchdog, module_limits
+
+logger = config.logger
+
+
+class ModulePool(object):
+    """
+    Runs modules in a pool of `config.module_workers` forked worker processes.
+
+    All modules that can run in the pool are submitted up front, so every worker starts from
+    the report as it is after the file search. A worker runs one module at a time, with a new
+    report state (see report.ReportState) sharing the file search results. It sends back the
+    module output objects along with everything that the module added to its state: general
+    statistics, plot data, saved raw data, data sources, HTML IDs and lint errors. These are
+    merged into the report state in the main process.
+    Data files and exported plots are written to a private directory and moved into place
+    when the results are merged.
+
+    The main process collects the results in module order with collect(). A module has to be
+    run again in the main process (collect() returns None) if it raised an error, if its results
+    couldn't be sent back, or if any of its HTML IDs or data file names clash with those of an
+    earlier module - as these would have been given a different name in a serial run.
+
+    Modules are never run in the pool if they set `serial_only = True`, are listed in
+    `config.module_workers_serial` or are run more than once. On Python before 3.8, or
+    without the 'fork' process start method, all modules are run in the main process.
+    """
+
+    def __init__(self, run_modules, workers=1):
+        self.runtimes = dict()
+        self.peak_rss = dict()
+        self._futures = dict()
+        self._executor = None
+        self._tmp_dir = None
+        self._broken = False
+
+        workers = max(1, int(workers or 1))
+        if workers < 2:
+            return
+        if "fork" not in multiprocessing.get_all_start_methods():
+            logger.warning("Running modules one at a time: module workers need the 'fork' process start method")
+            return
+        # Module results are pickled with reducer_override(), new in Python 3.8
+        if sys.version_info < (3, 8):
+            logger.warning("Running modules one at a time: module workers need Python 3.8 or later")
+            return
+
+        pool_modules = [idx for idx, mod_dict in enumerate(run_modules) if can_run_in_pool(mod_dict, run_modules)]
+        if len(pool_modules) < 2:
+            return
+        workers = min(workers, len(pool_modules))
+        logger.debug("Running {} modules with {} module workers".format(len(pool_modules), workers))
+
+        self._tmp_dir = tempfile.mkdtemp(prefix="multiqc_modules_")
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("fork")
+        )
+        for idx in pool_modules:
+            out_dir = os.path.join(self._tmp_dir, str(idx))
+            self._futures[idx] = self._executor.submit(run_module, run_modules[idx], out_dir)
+
+    def collect(self, mod_idx):
+        """
+        Wait for a module that was run in the pool and merge its results into the report.
+        Returns the list of module output objects, or None if the module wasn't run in the pool
+        or needs to be run again in the main process. Raises UserWarning if the module found
+        no samples, and ModuleLimitExceeded if it went over its limits, as when running it directly.
+        """
+        future = self._futures.pop(mod_idx, None)
+        if future is None:
+            return None
+        out_dir = os.path.join(self._tmp_dir, str(mod_idx))
+        try:
+            result = pickle.loads(future.result())
+        except BrokenProcessPool:
+            if not self._broken:
+                logger.warning("A module worker process died, running the remaining modules one at a time")
+                self._broken = True
+            return None
+        except Exception as e:
+            logger.debug("Could not load results of module worker, running module again: {}".format(e))
+            shutil.rmtree(out_dir, ignore_errors=True)
+            return None
+
+        if result["status"] == "limit":
+            shutil.rmtree(out_dir, ignore_errors=True)
+            self.runtimes[mod_idx] = result["runtime"]
+            self.peak_rss[mod_idx] = result["peak_rss"]
+            raise ModuleLimitExceeded(result["error"])
+        if result["status"] not in ("ok", "no_samples"):
+            logger.debug(
+                "Module could not run in module worker ({}), running it again:\n{}".format(
+                    result["status"], result["error"]
+                )
+            )
+            shutil.rmtree(out_dir, ignore_errors=True)
+            return None
+        clashes = report.state.clashes(result["state"])
+        if clashes:
+            logger.debug("Module results clash with earlier modules, running it again: {}".format(", ".join(clashes)))
+            shutil.rmtree(out_dir, ignore_errors=True)
+            return None
+
+        report.state.merge(result["state"])
+        move_output_files(out_dir)
+        self.runtimes[mod_idx] = result["runtime"]
+        self.peak_rss[mod_idx] = result["peak_rss"]
+        if result["status"] == "no_samples":
+            raise UserWarning
+        return result["output"]
+
+    def shutdown(self, wait=True):
+        """Stop the worker processes and remove the temporary files"""
+        if self._executor is not None:
+            for future in self._futures.values():
+                future.cancel()
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+        self._futures.clear()
+
+
+def can_run_in_pool(mod_dict, run_modules):
+    """Whether a module from the run_modules list can be run in a worker process"""
+    this_module = list(mod_dict.keys())[0]
+    if this_module in config.module_workers_serial:
+        return False
+    if [list(m.keys())[0] for m in run_modules].count(this_module) > 1:
+        return False
+    try:
+        mod = config.avail_modules[this_module].load()
+    except Exception:
+        # Let the main process show the error
+        return False
+    return not getattr(mod, "serial_only", False)
+
+
+def run_module(mod_dict, out_dir, earlier=None):
+    """
+    Run a single module in a worker process, with its own report state. Returns the pickled
+    module output and what the module added to the report. The report state and config are
+    restored afterwards, so that the next module run in the same worker starts from the same state.
+    The HTML IDs and data file names of the modules in the `earlier` report state are not used.
+    """
+    start = time.time()
+    report_state = report.state
+    report.state = report_state.new_module_state(earlier)
+    config_before = dict(vars(config))
+    # Forked workers share the random state, so plot IDs would all be the same
+    random.seed()
+
+    # Write data files and plots to a private directory, to be moved when merging
+    os.makedirs(out_dir)
+    if config.data_dir is not None:
+        config.data_dir = os.path.join(out_dir, "data")
+        os.makedirs(config.data_dir)
+    if config.plots_dir is not None:
+        config.plots_dir = os.path.join(out_dir, "plots")
+        os.makedirs(config.plots_dir)
+
+    result = {"status": "ok", "output": None}
+    this_module = list(mod_dict.keys())[0]
+    mod_cust_config = list(mod_dict.values())[0]
+    if mod_cust_config is None:
+        mod_cust_config = {}
+    watchdog = ModuleWatchdog(this_module, **module_limits(mod_cust_config))
+    try:
+        mod = config.avail_modules[this_module].load()
+        mod.mod_cust_config = mod_cust_config
+        with watchdog, spans.span("module", module=this_module):
+            output = mod()
+        if type(output) != list:
+            output = [output]
+        result["output"] = output
+    except UserWarning:
+        result["status"] = "no_samples"
+    except ModuleLimitExceeded as e:
+        result = {"status": "limit", "error": str(e)}
+    except Exception:
+        result = {"status": "error", "error": traceback.format_exc()}
+
+    try:
+        if result["status"] != "error":
+            result["runtime"] = time.time() - start
+            result["peak_rss"] = watchdog.peak_rss
+        if result["status"] not in ("error", "limit"):
+            result["state"] = report.state.module_results()
+        try:
+            return dump_result(result)
+        except Exception:
+            try:
+                return dump_result(result, drop_unpicklable=True)
+            except Exception:
+                return dump_result({"status": "unpicklable", "error": traceback.format_exc()})
+    finally:
+        report.state = report_state
+        for k in list(vars(config)):
+            if k not in config_before:
+                delattr(config, k)
+        for k, v in config_before.items():
+            setattr(config, k, v)
+
+
+def move_output_files(out_dir):
+    """Move the data files and plots written by a module worker into the real output directories"""
+    for sub_dir, dest_dir in [("data", config.data_dir), ("plots", config.plots_dir)]:
+        src_dir = os.path.join(out_dir, sub_dir)
+        if dest_dir is None or not os.path.isdir(src_dir):
+            continue
+        for root, _, files in os.walk(src_dir):
+            dest_root = os.path.join(dest_dir, os.path.relpath(root, src_dir))
+            if files and not os.path.isdir(dest_root):
+                os.makedirs(dest_root)
+            for fn in files:
+                shutil.move(os.path.join(root, fn), os.path.join(dest_root, fn))
+    shutil.rmtree(out_dir, ignore_errors=True)
+
+
+##################################################
+#### PICKLING MODULE RESULTS
+
+
+class ResultPickler(pickle.Pickler):
+    """
+    Pickler for module results. Modules often keep lambdas and nested functions, for
+    example as `modify` functions of general statistics headers. These can't be pickled
+    by reference, so their code is sent instead (workers run the same interpreter).
+    Needs Python 3.8 or later, for reducer_override() and types.CellType.
+    With `drop_unpicklable`, module object attributes that can't be pickled are left out.
+    """
+
+    def __init__(self, file, drop_unpicklable=False):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.drop_unpicklable = drop_unpicklable
+
+    def reducer_override(self, obj):
+        if isinstance(obj, types.FunctionType) and not is_importable(obj):
+            return reduce_function(obj)
+        if isinstance(obj, types.ModuleType):
+            return importlib.import_module, (obj.__name__,)
+        if self.drop_unpicklable and isinstance(obj, BaseMultiqcModule):
+            state = dict()
+            for k, v in vars(obj).items():
+                try:
+                    dump_result(v)
+                except Exception:
+                    logger.debug("Not sending module attribute back from worker: {}.{}".format(obj.name, k))
+                    continue
+                state[k] = v
+            return copyreg.__newobj__, (type(obj),), state
+        return NotImplemented
+
+
+def dump_result(result, drop_unpicklable=False):
+    f = io.BytesIO()
+    ResultPickler(f, drop_unpicklable).dump(result)
+    return f.getvalue()
+
+
+def is_importable(func):
+    """Whether a function can be found again by its module and name, as pickle does by default"""
+    obj = sys.modules.get(func.__module__)
+    try:
+        for name in func.__qualname__.split("."):
+            obj = getattr(obj, name)
+    except AttributeError:
+        return False
+    return obj is func
+
+
+class EmptyCell(object):
+    """Placeholder for closure cells that haven't been set"""
+
+
+def reduce_function(func):
+    module = sys.modules.get(func.__module__)
+    if module is None or vars(module) is not func.__globals__:
+        raise pickle.PicklingError("Can't pickle function {} without its module".format(func.__qualname__))
+    cells = list()
+    for cell in func.__closure__ or []:
+        try:
+            cells.append(cell.cell_contents)
+        except ValueError:
+            cells.append(EmptyCell)
+    state = {
+        "defaults": func.__defaults__,
+        "kwdefaults": func.__kwdefaults__,
+        "qualname": func.__qualname__,
+        "dict": func.__dict__,
+        "cells": cells,
+    }
+    args = (marshal.dumps(func.__code__), func.__module__, func.__name__, len(cells))
+    return make_function, args, state, None, None, set_function_state
+
+
+def make_function(code, module, name, num_cells):
+    closure = tuple(types.CellType() for _ in range(num_cells)) if num_cells else None
+    return types.FunctionType(marshal.loads(code), vars(importlib.import_module(module)), name, None, closure)
+
+
+def set_function_state(func, state):
+    # Cells are set after creating the function, so that closures referring to themselves work
+    func.__defaults__ = state["defaults"]
+    func.__kwdefaults__ = state["kwdefaults"]
+    func.__qualname__ = state["qualname"]
+    func.__dict__.update(state["dict"])
+    for cell, value in zip(func.__closure__ or [], state["cells"]):
+        if value is not EmptyCell:
+            cell.cell_contents = value
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+""" MultiQC parse cache. Remembers what module parser functions returned for each
+file in an SQLite database next to the report, so that incremental runs over a growing
+set of analysis files only need to parse new or changed files. """
+
+
+import hashlib
+import inspect
+import os
+import pickle
+import sqlite3
+
+from . import config
+
+logger = config.logger
+
+# Fingerprints of parser functions, keyed by module and qualified name
+_parser_versions = dict()
+
+
+def parser_version(parser):
+    """
+    Fingerprint of a parser function: the MultiQC version and the source code of the module
+    that the parser is defined in. Cached results are discarded when this changes.
+    """
+    key = (parser.__module__, parser.__qualname__)
+    if key not in _parser_versions:
+        h = hashlib.sha1("{}\n{}.{}".format(config.version, *key).encode("utf-8"))
+        try:
+            with open(inspect.getsourcefile(parser), "rb") as fh:
+                h.update(fh.read())
+        except (TypeError, IOError, OSError):
+            # No source code to compare, so only the MultiQC version is used
+            pass
+        _parser_versions[key] = h.hexdigest()
+    return _parser_versions[key]
+
+
+def cache_path():
+    """Path to the parse cache database, or None if not running in incremental mode"""
+    if not config.incremental or config.output_dir is None:
+        return None
+    return os.path.join(config.output_dir, config.parse_cache_fn)
+
+
+class ParseCache(object):
+    """
+    On-disk cache of the parsed data for each file found for a cache key (the module anchor and
+    search key), keyed by the real path of the file. A cached result is only used if the file size,
+    modification time and the parser version all match. When saving, results for files that were
+    not found in this run are discarded, so the cache holds the files of the last run for each key.
+
+    Used by BaseMultiqcModule.map_log_files() from the process running the module.
+    """
+
+    def __init__(self, path, key, parser):
+        self.path = path
+        self.key = key
+        self.version = parser_version(parser)
+        self.hits = 0
+        self.misses = 0
+        self._realpaths = dict()
+        self._keys = dict()
+        self._seen = list()
+        self._pending = list()
+        # The report is written at the end of the run, so the output directory may not exist yet
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS parse_results ("
+            "cache_key TEXT, path TEXT, size INTEGER, mtime INTEGER, version TEXT, result BLOB, "
+            "PRIMARY KEY (cache_key, path))"
+        )
+        self.db.commit()
+        # Load all results for this key at once, rather than querying the database for every file
+        self._cached = dict()
+        for path, size, mtime, version, result in self.db.execute(
+            "SELECT path, size, mtime, version, result FROM parse_results WHERE cache_key = ?", (key,)
+        ):
+            if version == self.version:
+                self._cached[path] = (size, mtime, result)
+
+    def file_key(self, f):
+        """Real path, size and mtime of a file from find_log_files(), or None if it can't be stat'd"""
+        if f["root"] not in self._realpaths:
+            self._realpaths[f["root"]] = os.path.realpath(f["root"])
+        path = os.path.join(self._realpaths[f["root"]], f["fn"])
+        try:
+            st = os.stat(path)
+        except (IOError, OSError, ValueError):
+            return None
+        return (path, st.st_size, st.st_mtime_ns)
+
+    def get(self, f):
+        """
+        Look up the parsed data for a file. Returns a tuple (hit, data), as None can be a valid result.
+        The file size and mtime are remembered on a miss, in case the file changes while it is parsed.
+        """
+        key = self.file_key(f)
+        if key is None:
+            self.misses += 1
+            return False, None
+        self._seen.append(key[0])
+        cached = self._cached.get(key[0])
+        if cached is not None and cached[:2] == key[1:]:
+            try:
+                data = pickle.loads(cached[2])
+            except Exception as e:
+                logger.debug("{}: Could not load cached parse result for {}: {}".format(self.key, key[0], e))
+            else:
+                self.hits += 1
+                return True, data
+        self.misses += 1
+        self._keys[(f["root"], f["fn"])] = key
+        return False, None
+
+    def add(self, f, data):
+        """Remember the parsed data for a cache miss. Written to disk by save()"""
+        key = self._keys.pop((f["root"], f["fn"]), None)
+        if key is None:
+            return
+        try:
+            result = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.debug("{}: Could not cache parse result for {}: {}".format(self.key, key[0], e))
+            return
+        self._pending.append((self.key,) + key + (self.version, sqlite3.Binary(result)))
+
+    def save(self):
+        """Write new results to disk, drop results for files that weren't found, and close the database"""
+        with self.db:
+            self.db.execute("CREATE TEMP TABLE seen_paths (path TEXT PRIMARY KEY)")
+            self.db.executemany("INSERT OR IGNORE INTO seen_paths VALUES (?)", [(p,) for p in self._seen])
+            self.db.execute(
+                "DELETE FROM parse_results WHERE cache_key = ? AND path NOT IN (SELECT path FROM seen_paths)",
+                (self.key,),
+            )
+            self.db.executemany("INSERT OR REPLACE INTO parse_results VALUES (?, ?, ?, ?, ?, ?)", self._pending)
+        self._pending = list()
+        self.db.close()
+        logger.debug("{}: Parse cache: {} hits, {} misses".format(self.key, self.hits, self.misses))
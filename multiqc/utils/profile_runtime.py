@@ -3,19 +3,25 @@
 """ Super Special-Case MultiQC module to produce report section on MultiQC run time """
 
 
+import html
 import logging
+import os
 import re
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 
 from multiqc.modules.base_module import BaseMultiqcModule
 from multiqc.plots import bargraph
-from multiqc.utils import report
+from multiqc.utils import report, spans
 
 # Initialise the logger
 log = logging.getLogger(__name__)
 
 
 class MultiqcModule(BaseMultiqcModule):
+
+    # Keys in report.file_search_stats that are not counts of searched files
+    search_meta_prefixes = ("search_cache_", "walk_", "file_type_")
+
     def __init__(self):
 
         # Initialise the parent object
@@ -35,14 +41,27 @@ class MultiqcModule(BaseMultiqcModule):
 
         self.file_search_stats_section()
 
+        self.search_plan_section()
+
+        self.search_cache_section()
+
+        self.file_types_section()
+
         self.search_pattern_times_section()
 
+        self.modules_section()
+
+        self.spans_section()
+
     def file_search_stats_section(self):
         """Count of all files iterated through by MultiQC, by category"""
 
         pdata = OrderedDict()
         pcats = OrderedDict()
         for key in sorted(report.file_search_stats, key=report.file_search_stats.get, reverse=True):
+            # Search cache and directory walk counts are not file categories
+            if key.startswith(self.search_meta_prefixes):
+                continue
             if "skipped_" in key:
                 s_name = "Skipped: {}".format(key.replace("skipped_", "").replace("_", " ").capitalize())
                 pcats[key] = {"name": key, "color": "#999999"}
@@ -65,8 +84,12 @@ class MultiqcModule(BaseMultiqcModule):
             description="""
                 Number of files searched by MultiQC, categorised by what happened to them.
                 **Total file searches: {}**.
+                Walking the analysis directories took {:.2f} seconds, with {} directory listings and {} file stat calls.
             """.format(
-                sum(report.file_search_stats.values())
+                sum(v for k, v in report.file_search_stats.items() if not k.startswith(self.search_meta_prefixes)),
+                report.file_search_stats.get("walk_time", 0),
+                report.file_search_stats.get("walk_scandir_calls", 0),
+                report.file_search_stats.get("walk_stat_calls", 0),
             ),
             helptext="""
                 Note that only files are considered in this plot - skipped directories are not shown.
@@ -83,6 +106,120 @@ class MultiqcModule(BaseMultiqcModule):
             plot=bargraph.plot(pdata, pcats, pconfig),
         )
 
+    def search_plan_section(self):
+        """Section with the filename extensions found, and the modules that could match them"""
+
+        plan = report.search_plan
+        if not plan:
+            return
+
+        pdata = OrderedDict()
+        for ext, count in list(plan["extensions"].items())[:30]:
+            pdata[ext] = {"files": count}
+
+        pconfig = {
+            "id": "multiqc_runtime_search_plan_plot",
+            "title": "MultiQC: Filename extensions",
+            "ylab": "Number of files",
+            "use_legend": False,
+            "cpswitch": False,
+        }
+
+        self.add_section(
+            name="Search plan",
+            anchor="multiqc_runtime_search_plan",
+            description="""
+                Before searching any files, MultiQC counts the filename extensions of all files found
+                and works out which search patterns could possibly match them.
+                **{} of {} search keys could match**, from {} modules. {} modules were ruled out
+                without searching any files. Planning took {:.2f} seconds.
+            """.format(
+                len(plan["search_keys"]),
+                len(plan["search_keys"]) + len(plan["skipped_search_keys"]),
+                len(plan["modules"]),
+                len(plan["skipped_modules"]),
+                plan["time"],
+            ),
+            helptext="""
+                Search patterns that only match certain filenames are only used if a file with a matching
+                extension or name ending was found. Search patterns that only look at file contents
+                or use a filename regex (`fn_re`) can't be ruled out this way, so are always used.
+
+                Modules that could match files: {}
+            """.format(
+                ", ".join("`{}`".format(m) for m in plan["modules"])
+            ),
+            plot=bargraph.plot(pdata, None, pconfig),
+        )
+
+    def search_cache_section(self):
+        """Section with the number of files found in the search cache, if used"""
+
+        if "search_cache_hits" not in report.file_search_stats:
+            return
+
+        pdata = {
+            "Search cache": {
+                "hits": report.file_search_stats["search_cache_hits"],
+                "misses": report.file_search_stats["search_cache_misses"],
+            }
+        }
+        pcats = OrderedDict()
+        pcats["hits"] = {"name": "Cache hits", "color": "#7cb5ec"}
+        pcats["misses"] = {"name": "Cache misses", "color": "#999999"}
+
+        pconfig = {
+            "id": "multiqc_runtime_search_cache_plot",
+            "title": "MultiQC: Search cache",
+            "ylab": "Number of files",
+            "cpswitch_c_active": False,
+        }
+
+        self.add_section(
+            name="Search cache",
+            anchor="multiqc_runtime_search_cache",
+            description="""
+                Number of files with search results loaded from the search cache (`--search-cache`).
+            """,
+            helptext="""
+                * `Cache hits` - File was unchanged since a previous run, so the search result was loaded from the cache
+                * `Cache misses` - File was new or had changed, so it was searched
+            """,
+            plot=bargraph.plot(pdata, pcats, pconfig),
+        )
+
+    def file_types_section(self):
+        """Section with the number of files of each type opened by the file search"""
+
+        pdata = OrderedDict()
+        for key in sorted(report.file_search_stats, key=report.file_search_stats.get, reverse=True):
+            if key.startswith("file_type_"):
+                pdata[key.replace("file_type_", "")] = {"files": report.file_search_stats[key]}
+        if len(pdata) == 0:
+            return
+
+        pconfig = {
+            "id": "multiqc_runtime_file_types_plot",
+            "title": "MultiQC: File types",
+            "ylab": "Number of files",
+            "use_legend": False,
+            "cpswitch": False,
+        }
+
+        self.add_section(
+            name="File types",
+            anchor="multiqc_runtime_file_types",
+            description="""
+                Types of the files that were opened to search their contents, worked out from the first few bytes.
+            """,
+            helptext="""
+                Only `text` files are searched for file contents search patterns. Files of any other
+                type (compressed, images, binary files) are skipped without being read any further.
+                Files that only matched filename search patterns are never opened, so are not counted here.
+            """,
+            plot=bargraph.plot(pdata, None, pconfig),
+        )
+
     def search_pattern_times_section(self):
         """Section with a bar plot showing the time spent on each search pattern"""
 
@@ -125,3 +262,188 @@ class MultiqcModule(BaseMultiqcModule):
             """,
             plot=bargraph.plot(pdata, None, pconfig),
         )
+
+    def modules_section(self):
+        """Section with the time taken and the peak memory use of each module"""
+
+        if len(report.runtimes["mods"]) == 0:
+            return
+
+        time_data = OrderedDict()
+        rss_data = OrderedDict()
+        for key in sorted(report.runtimes["mods"], key=report.runtimes["mods"].get, reverse=True):
+            time_data[key] = {"time": report.runtimes["mods"][key]}
+            peak_rss = report.runtimes["mods_peak_rss"].get(key)
+            if peak_rss is not None:
+                rss_data[key] = {"peak_rss": peak_rss / 1024 / 1024}
+
+        pconfig = {
+            "id": "multiqc_runtime_modules_plot",
+            "title": "MultiQC: Modules",
+            "use_legend": False,
+            "cpswitch": False,
+            "data_labels": [
+                {"name": "Time", "ylab": "Time (seconds)"},
+                {"name": "Peak memory", "ylab": "Peak RSS (MB)"},
+            ],
+        }
+        pcats = [
+            {"time": {"name": "Time (seconds)"}},
+            {"peak_rss": {"name": "Peak RSS (MB)"}},
+        ]
+
+        datasets = [time_data, rss_data] if len(rss_data) > 0 else [time_data]
+        self.add_section(
+            name="Modules",
+            anchor="multiqc_runtime_modules",
+            description="""
+                Time taken to run each module, and the peak memory use (resident set size) of the
+                process running it. **Total module run time: {:.2f} seconds**.
+            """.format(
+                report.runtimes["total_mods"]
+            ),
+            helptext="""
+                The peak memory use is that of the whole MultiQC process (or module worker process,
+                with `--module-workers`) while the module ran, so it includes the memory used by MultiQC itself.
+
+                Modules can be stopped if they run for too long or use too much memory,
+                with `time_limit` and `memory_limit` in the `module_order` config.
+                See the [MultiQC Documentation](https://multiqc.info/docs/#module-time-and-memory-limits).
+            """,
+            plot=bargraph.plot(datasets, pcats[: len(datasets)], pconfig),
+        )
+
+    # Colours of the spans in the timeline, by span name. Plot functions are "<plot type>.plot"
+    span_colours = {
+        "run": "#dddddd",
+        "file_search": "#8085e9",
+        "run_modules": "#cccccc",
+        "module": "#7cb5ec",
+        "find_log_files": "#f7a35c",
+        "map_log_files": "#f7a35c",
+        "plot": "#90ed7d",
+        "compress_json": "#f15c80",
+        "compress_plot_data": "#f15c80",
+        "load_template": "#f15c80",
+        "render_template": "#f15c80",
+    }
+
+    def spans_section(self):
+        """Section with a timeline of the timed parts of the run (see utils/spans.py), and the total time of each"""
+
+        records = spans.all_spans()
+        if len(records) == 0:
+            return
+
+        # Timeline of each process, with nested spans below the span they are in
+        t0 = min(r["start"] for r in records)
+        total = max(r["start"] + r["wall"] for r in records) - t0
+        pids = [os.getpid()] + sorted({r["pid"] for r in records if r["pid"] != os.getpid()})
+        lanes = list()
+        num_hidden = 0
+        for pid in pids:
+            lane_records = [r for r in records if r["pid"] == pid]
+            if len(lane_records) == 0:
+                continue
+            min_depth = min(r["depth"] for r in lane_records)
+            bars = list()
+            num_rows = 0
+            for r in lane_records:
+                left = (r["start"] - t0) / total * 100 if total > 0 else 0
+                width = r["wall"] / total * 100 if total > 0 else 100
+                # Too narrow to see
+                if width < 0.1:
+                    num_hidden += 1
+                    continue
+                row = r["depth"] - min_depth
+                num_rows = max(num_rows, row + 1)
+                label = r["args"].get("module", r["args"].get("sp_key", r["name"]))
+                title = "{}{}: {:.2f}s wall time, {:.2f}s CPU time{}".format(
+                    r["name"],
+                    "".join(" {}={}".format(k, v) for k, v in r["args"].items()),
+                    r["wall"],
+                    r["cpu"],
+                    ", {:.0f} MB peak memory".format(r["peak_rss"] / 1024 / 1024) if r["peak_rss"] else "",
+                )
+                colour = self.span_colours.get(r["name"].split(".")[-1], "#e4d354")
+                bars.append(
+                    '<div class="mqc-runtime-span" style="left: {:.3f}%; width: {:.3f}%; top: {}px; background-color: {};" title="{}">{}</div>'.format(
+                        left, width, row * 20, colour, html.escape(title), html.escape(label)
+                    )
+                )
+            lanes.append(
+                '<p class="text-muted">{}</p><div class="mqc-runtime-spans" style="height: {}px;">{}</div>'.format(
+                    "Main process" if pid == os.getpid() else "Module worker process {}".format(pid),
+                    num_rows * 20,
+                    "".join(bars),
+                )
+            )
+        content = (
+            "<style>"
+            ".mqc-runtime-spans { position: relative; margin-bottom: 15px; }"
+            ".mqc-runtime-span { position: absolute; height: 19px; padding: 0 3px; overflow: hidden; "
+            "white-space: nowrap; text-overflow: ellipsis; font-size: 11px; line-height: 19px; "
+            "border-radius: 2px; box-sizing: border-box; }"
+            "</style>" + "".join(lanes)
+        )
+
+        self.add_section(
+            name="Timeline",
+            anchor="multiqc_runtime_spans",
+            description="""
+                Timeline of the MultiQC run, with the wall time taken by each part of it. Parts of the run that
+                happen within another part are shown below it. Hover over a part to see its CPU time and peak
+                memory use. {} parts of the run are too short to be shown.
+            """.format(
+                num_hidden
+            ),
+            helptext="""
+                The run is timed with _spans_, which are added around the file search, each module, the
+                `find_log_files()` and `map_log_files()` calls of modules, the plot functions, compressing
+                the plot data and rendering the report. For `find_log_files()`, only the time taken to find and read
+                the files is counted, not the time the module spends parsing them.
+
+                The report is written after this timeline is made, so the last parts of the run are only
+                in the files `{}` and `{}` in the data directory. The latter is in the Chrome trace format,
+                which can be opened with [Perfetto](https://ui.perfetto.dev/) or [speedscope](https://www.speedscope.app/).
+            """.format(
+                spans.spans_fn, spans.trace_fn
+            ),
+            content=content,
+        )
+
+        # Total time of spans with the same name
+        wall_data = defaultdict(lambda: {"time": 0})
+        cpu_data = defaultdict(lambda: {"time": 0})
+        for r in records:
+            name = r["name"] if r["name"] != "module" else "module: {}".format(r["args"].get("module"))
+            wall_data[name]["time"] += r["wall"]
+            cpu_data[name]["time"] += r["cpu"]
+        names = sorted(wall_data, key=lambda k: wall_data[k]["time"], reverse=True)
+
+        pconfig = {
+            "id": "multiqc_runtime_span_times_plot",
+            "title": "MultiQC: Time per part of the run",
+            "use_legend": False,
+            "cpswitch": False,
+            "data_labels": [
+                {"name": "Wall time", "ylab": "Wall time (seconds)"},
+                {"name": "CPU time", "ylab": "CPU time (seconds)"},
+            ],
+        }
+        self.add_section(
+            name="Time per part of the run",
+            anchor="multiqc_runtime_span_times",
+            description="""
+                Total wall time and CPU time of each part of the run, added up over all the times it ran.
+            """,
+            helptext="""
+                Times of parts of the run that happen within others are also counted in the outer parts.
+                The CPU time is that of the thread (or, with Python < 3.7, the process) that ran it.
+            """,
+            plot=bargraph.plot(
+                [OrderedDict((k, wall_data[k]) for k in names), OrderedDict((k, cpu_data[k]) for k in names)],
+                None,
+                pconfig,
+            ),
+        )
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+""" MultiQC compiled regex registry. Search patterns and sample name cleaning
+patterns are compiled once and reused for every file and sample, instead of
+relying on the small internal cache of the re module. """
+
+
+import re
+
+from . import config
+
+logger = config.logger
+
+# Compiled regexes, keyed by pattern and flags
+_compiled = dict()
+
+# Normalised exclude_* keys of search patterns, keyed by id() of the search pattern dict
+_excludes = dict()
+
+# Normalised config.fn_clean_exts, see compile_clean_exts()
+_clean_exts = None
+
+# Regex keys of search patterns, compiled by compile_search_patterns()
+sp_regex_keys = ["fn_re", "contents_re", "exclude_fn_re", "exclude_contents_re"]
+
+exclude_keys = ["exclude_fn", "exclude_fn_re", "exclude_contents", "exclude_contents_re"]
+
+
+def get(pattern, flags=0):
+    """Return the compiled regex for a pattern, compiling it the first time it is used"""
+    try:
+        return _compiled[(pattern, flags)]
+    except KeyError:
+        compiled = re.compile(pattern, flags)
+        _compiled[(pattern, flags)] = compiled
+        return compiled
+
+
+def excludes(sp):
+    """
+    The exclude_* keys of a search pattern, with all values as lists.
+    The search pattern dict itself is not modified.
+    """
+    cached = _excludes.get(id(sp))
+    if cached is not None and cached[0] is sp:
+        return cached[1]
+    sp_excludes = dict()
+    for k in exclude_keys:
+        if k in sp:
+            sp_excludes[k] = sp[k] if isinstance(sp[k], list) else [sp[k]]
+    # Keep a reference to the search pattern, so that its id() can't be reused
+    _excludes[id(sp)] = (sp, sp_excludes)
+    return sp_excludes
+
+
+def compile_search_patterns(sps):
+    """
+    Compile all regexes for a list of search patterns up front.
+    Invalid regexes are skipped here - they raise an error where they are used, as before.
+    """
+    for sp in sps:
+        for k in sp_regex_keys:
+            patterns = sp.get(k)
+            if patterns is None:
+                continue
+            for pattern in patterns if isinstance(patterns, list) else [patterns]:
+                try:
+                    get(pattern)
+                except (re.error, TypeError) as e:
+                    logger.debug("Could not compile search pattern regex '{}': {}".format(pattern, e))
+
+
+def compile_clean_exts(clean_exts):
+    """
+    Normalised version of `config.fn_clean_exts` for cleaning sample names: a list of
+    (type, pattern, modules, ext) tuples, with regex patterns compiled, `modules` as a
+    list (or None if not limited to any modules) and the original config entry.
+    Built once and reused until the config list changes length (eg. with `extra_fn_clean_exts`).
+    """
+    global _clean_exts
+    if _clean_exts is not None and _clean_exts[0] is clean_exts and _clean_exts[1] == len(clean_exts):
+        return _clean_exts[2]
+    normalised = list()
+    for ext in clean_exts:
+        if type(ext) is str:
+            ext = {"type": "truncate", "pattern": ext}
+        modules = ext.get("module")
+        if type(modules) is str:
+            modules = [modules]
+        pattern = ext.get("pattern")
+        if ext.get("type") in ("regex", "regex_keep"):
+            pattern = get(pattern)
+        normalised.append((ext.get("type"), pattern, modules, ext))
+    _clean_exts = (clean_exts, len(clean_exts), normalised)
+    return normalised
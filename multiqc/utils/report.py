@@ -5,22 +5,31 @@ module. Is available to subsequent modules. Contains
 helper functions to generate markup for report. """
 
 
+import base64
+import concurrent.futures
 import fnmatch
 import inspect
 import io
+import itertools
 import json
+import math
 import mimetypes
 import os
 import re
+import sqlite3
+import sys
 import time
+import types
+import zlib
 from collections import OrderedDict, defaultdict
 
-import lzstring
-import rich
-import rich.progress
 import yaml
 
-from . import config
+from . import config, file_sniffer, regex_cache, spans
+from .buffer_pool import FileBufferPool
+from .file_walker import walk_analysis_paths
+from .search_cache import SearchCache, pattern_hashes, search_fingerprint
+from .search_progress import SearchProgress
 
 logger = config.logger
 
@@ -35,72 +44,181 @@ except NameError:
     pass  # Python 3
 
 
-# Set up global variables shared across modules
-# Inside a function so that the global vars are reset if MultiQC is run more than once within a single session / environment
-def init():
-    global general_stats_data
-    general_stats_data = list()
-
-    global general_stats_headers
-    general_stats_headers = list()
+class ReportState(object):
+    """
+    Everything that goes into a report: the results of the file search, and everything that
+    modules and plot functions add to the report. The current state is `report.state`, and
+    the attributes of this module (`report.plot_data`, `report.html_ids` etc.) are a facade
+    for the attributes of the current state, so modules can keep using them.
+
+    States of separate runs don't share anything, so each run in a long-lived Python process
+    starts from a fresh state. Modules can also be run with their own state, which is then
+    combined with the report state with merge(), eg. to run modules in separate processes.
+    """
 
-    global general_stats_html
-    general_stats_html = ""
+    # Attributes that modules and plot functions add to, combined by merge()
+    module_attrs = [
+        "general_stats_data",
+        "general_stats_headers",
+        "data_sources",
+        "plot_data",
+        "flat_plot_data",
+        "html_ids",
+        "lint_errors",
+        "num_hc_plots",
+        "num_mpl_plots",
+        "saved_raw_data",
+        "last_found_file",
+        "spans",
+    ]
 
-    global data_sources
-    data_sources = defaultdict(lambda: defaultdict(lambda: defaultdict()))
+    # Results of the file search, which modules read from
+    search_attrs = ["file_search_stats", "searchfiles", "file_buffers", "files", "search_plan"]
+
+    # Everything else, filled in when creating the report
+    report_attrs = [
+        "general_stats_html",
+        "runtimes",
+        "modules_output",
+        "multiqc_command",
+        "plot_compressed_json",
+        "plot_compressed_data",
+    ]
 
-    global plot_data
-    plot_data = dict()
+    def __init__(self):
+        self.general_stats_data = list()
+        self.general_stats_headers = list()
+        self.general_stats_html = ""
+        self.data_sources = defaultdict(lambda: defaultdict(lambda: defaultdict()))
+        self.plot_data = dict()
+        # Data of the plots drawn as flat images: not in the report, but saved in multiqc_data.json
+        self.flat_plot_data = dict()
+        self.html_ids = list()
+        self.lint_errors = list()
+        self.num_hc_plots = 0
+        self.num_mpl_plots = 0
+        self.saved_raw_data = dict()
+        self.last_found_file = None
+        # Timed parts of the run, see spans.Span
+        self.spans = list()
+        self.runtimes = {
+            "total": 0,
+            "total_sp": 0,
+            "total_mods": 0,
+            "total_compression": 0,
+            "sp": defaultdict(),
+            "mods": defaultdict(),
+            "mods_peak_rss": defaultdict(),
+        }
+        self.file_search_stats = {
+            "skipped_symlinks": 0,
+            "skipped_not_a_file": 0,
+            "skipped_ignore_pattern": 0,
+            "skipped_filesize_limit": 0,
+            "skipped_module_specific_max_filesize": 0,
+            "skipped_no_match": 0,
+            "skipped_directory_fn_ignore_dirs": 0,
+            "skipped_file_contents_search_errors": 0,
+        }
+        self.searchfiles = list()
+        # Which search patterns could match the files found, see plan_search()
+        self.search_plan = dict()
+        # Contents of files read during the search, for find_log_files()
+        self.file_buffers = FileBufferPool()
+        # Make a dict of discovered files for each seach key
+        self.files = dict()
+        self.modules_output = list()
+        self.multiqc_command = ""
+        self.plot_compressed_json = ""
+        # Compressed data of each plot, with config.lazy_plot_data
+        self.plot_compressed_data = OrderedDict()
+        # Number of HTML IDs and the data file names taken from earlier modules, see new_module_state()
+        self.earlier_names = None
+
+    def new_module_state(self, earlier=None):
+        """
+        A new state for running modules, with nothing from modules yet but sharing the file search results of this one.
+        With `earlier`, a state with the results of modules run before, the HTML IDs and data file names of those
+        modules are taken - so the new modules pick other ones, as they would after them in one run.
+        """
+        module_state = ReportState()
+        for attr in self.search_attrs:
+            setattr(module_state, attr, getattr(self, attr))
+        if earlier is not None:
+            module_state.html_ids = list(earlier.html_ids)
+            module_state.saved_raw_data = dict.fromkeys(earlier.saved_raw_data)
+            module_state.earlier_names = (len(earlier.html_ids), set(earlier.saved_raw_data))
+        return module_state
+
+    def module_results(self):
+        """
+        A copy of this state with only what modules have added to it, without the file search
+        results. Small enough to send back from another process and merge().
+        """
+        results = ReportState()
+        for attr in self.module_attrs:
+            setattr(results, attr, getattr(self, attr))
+        if self.earlier_names is not None:
+            num_html_ids, data_fns = self.earlier_names
+            results.html_ids = self.html_ids[num_html_ids:]
+            results.saved_raw_data = {fn: d for fn, d in self.saved_raw_data.items() if fn not in data_fns}
+        return results
+
+    def clashes(self, other):
+        """HTML IDs, plot IDs and data file names in another state that are already used in this one"""
+        html_ids = set(self.html_ids)
+        clashes = [i for i in other.html_ids if i in html_ids]
+        clashes.extend([k for k in other.plot_data if k in self.plot_data])
+        clashes.extend([k for k in other.flat_plot_data if k in self.flat_plot_data])
+        clashes.extend([k for k in other.saved_raw_data if k in self.saved_raw_data])
+        return clashes
+
+    def merge(self, other):
+        """
+        Add everything that modules added to another state to this one, as if the
+        modules had been run with this state. Check for clashes() first.
+        """
+        self.general_stats_data.extend(other.general_stats_data)
+        self.general_stats_headers.extend(other.general_stats_headers)
+        self.html_ids.extend(other.html_ids)
+        self.lint_errors.extend(other.lint_errors)
+        self.num_hc_plots += other.num_hc_plots
+        self.num_mpl_plots += other.num_mpl_plots
+        self.plot_data.update(other.plot_data)
+        self.flat_plot_data.update(other.flat_plot_data)
+        self.spans.extend(other.spans)
+        self.saved_raw_data.update(other.saved_raw_data)
+        for module, sections in other.data_sources.items():
+            for section, sources in sections.items():
+                for s_name, source in sources.items():
+                    self.data_sources[module][section][s_name] = source
+        if other.last_found_file is not None:
+            self.last_found_file = other.last_found_file
 
-    global html_ids
-    html_ids = list()
 
-    global lint_errors
-    lint_errors = list()
+class ReportModule(types.ModuleType):
+    """Module class of `multiqc.utils.report`, with the attributes of the current ReportState as module attributes"""
 
-    global num_hc_plots
-    num_hc_plots = 0
 
-    global num_mpl_plots
-    num_mpl_plots = 0
+def _state_property(attr):
+    return property(lambda mod: getattr(mod.state, attr), lambda mod, value: setattr(mod.state, attr, value))
 
-    global saved_raw_data
-    saved_raw_data = dict()
 
-    global last_found_file
-    last_found_file = None
+for _attr in ReportState.module_attrs + ReportState.search_attrs + ReportState.report_attrs:
+    setattr(ReportModule, _attr, _state_property(_attr))
+sys.modules[__name__].__class__ = ReportModule
 
-    global runtimes
-    runtimes = {
-        "total": 0,
-        "total_sp": 0,
-        "total_mods": 0,
-        "total_compression": 0,
-        "sp": defaultdict(),
-        "mods": defaultdict(),
-    }
+# The current report state
+state = ReportState()
 
-    global file_search_stats
-    file_search_stats = {
-        "skipped_symlinks": 0,
-        "skipped_not_a_file": 0,
-        "skipped_ignore_pattern": 0,
-        "skipped_filesize_limit": 0,
-        "skipped_module_specific_max_filesize": 0,
-        "skipped_no_match": 0,
-        "skipped_directory_fn_ignore_dirs": 0,
-        "skipped_file_contents_search_errors": 0,
-    }
 
-    global searchfiles
-    searchfiles = list()
-
-    # Make a dict of discovered files for each seach key
-    global files
-    files = dict()
+def init():
+    """Start a new report, so that nothing is shared if MultiQC is run more than once within a single session / environment"""
+    global state
+    state = ReportState()
 
 
+@spans.timed("file_search")
 def get_filelist(run_module_names):
     """
     Go through all supplied search directories and assembly a master
@@ -108,15 +226,16 @@ def get_filelist(run_module_names):
     """
     # Prep search patterns
     spatterns = [{}, {}, {}, {}, {}, {}, {}]
-    runtimes["sp"] = defaultdict()
+    state.runtimes["sp"] = defaultdict()
     ignored_patterns = []
     skipped_patterns = []
+    run_module_names_lower = {m.lower() for m in run_module_names}
     for key, sps in config.sp.items():
         mod_name = key.split("/", 1)[0]
-        if mod_name.lower() not in [m.lower() for m in run_module_names]:
+        if mod_name.lower() not in run_module_names_lower:
             ignored_patterns.append(key)
             continue
-        files[key] = list()
+        state.files[key] = list()
         if not isinstance(sps, list):
             sps = [sps]
 
@@ -168,173 +287,201 @@ def get_filelist(run_module_names):
         logger.info("Skipping {} file search patterns".format(len(skipped_patterns)))
         logger.debug("Skipping search patterns: {}".format(", ".join(skipped_patterns)))
 
-    def add_file(fn, root):
+    # Go through the analysis directories and get file list
+    total_sp_starttime = time.time()
+    walked_files, walk_stats = walk_analysis_paths(config.analysis_dir, workers=config.search_workers)
+    state.searchfiles.extend(walked_files)
+    for key, count in walk_stats.items():
+        state.file_search_stats[key] = state.file_search_stats.get(key, 0) + count
+    logger.debug(
+        "Found {} files to search in {:.2f}s ({} directory listings, {} stat calls)".format(
+            len(state.searchfiles),
+            walk_stats["walk_time"],
+            walk_stats["walk_scandir_calls"],
+            walk_stats["walk_stat_calls"],
+        )
+    )
+
+    # Index the search patterns by filename, so that each file is only tested against relevant patterns
+    sp_index = SearchPatternIndex(spatterns)
+
+    # Work out which search patterns could match any of the files found, from their names
+    state.search_plan = plan_search(sp_index, state.searchfiles)
+    planned_sps = [sp for key, sps in sp_index.entries if key in state.search_plan["search_keys"] for sp in sps]
+
+    # Compile the search pattern regexes that could be used once, before searching any files
+    regex_cache.compile_search_patterns(planned_sps)
+
+    # Combine the regex contents patterns so that most lines can be ruled out with a single regex search
+    contents_re_prefilter = build_contents_re_prefilter(
+        [sp["contents_re"] for sp in planned_sps if "contents_re" in sp]
+    )
+
+    # Keep the contents of matched files that were read during the search, if configured
+    state.file_buffers.clear()
+    state.file_buffers.max_bytes = int(float(config.search_buffer_mb or 0) * 1024 * 1024)
+
+    def add_file(fn, root, st=None):
         """
         Function applied to each file found when walking the analysis
-        directories. Runs through all search patterns and returns True
-        if a match is found.
+        directories. Runs through all search patterns and returns a dict
+        describing the search result. Does not touch the global report
+        variables, so that it can be run in worker threads.
+        `st` is the stat result for the file from the directory walk, if any.
         """
         f = {"fn": fn, "root": root}
+        result = {"f": f, "matched": False, "keys": [], "stats": defaultdict(int), "sp_times": defaultdict(float)}
+        if st is not None:
+            f["filesize"] = st.st_size
+
+        # Images and compressed files can't match any search pattern, no need to go through them all
+        contents = FileContents(os.path.join(root, fn), prefilter=contents_re_prefilter)
+        if config.ignore_images and not regex_cache.get(r".+_mqc\.(png|jpg|jpeg)").match(fn):
+            (ftype, encoding) = contents.guess_type()
+            if not searchable_encoding(encoding) or (ftype is not None and ftype.startswith("image")):
+                return result
+
+        # Only patterns that could match the filename are tested, see SearchPatternIndex
+        for key, sps in sp_index.candidates(search_fn(fn)):
+            start = time.time()
+            for sp in sps:
+                if search_file(sp, f, key, stats=result["stats"], contents=contents):
+                    # Check that we shouldn't exclude this file
+                    if not exclude_file(sp, f, contents=contents):
+                        # Looks good! Remember this file
+                        result["keys"].append(key)
+                        result["matched"] = True
+                    # Don't keep searching this file for other modules
+                    if not sp.get("shared", False):
+                        result["sp_times"][key] += time.time() - start
+                        result["matched"] = True
+                        finish_file(result, contents)
+                        return result
+                    # Don't look at other patterns for this module
+                    else:
+                        break
+            result["sp_times"][key] += time.time() - start
 
-        # Check that this is a file and not a pipe or anything weird
-        if not os.path.isfile(os.path.join(root, fn)):
-            file_search_stats["skipped_not_a_file"] += 1
-            return False
-
-        # Check that we don't want to ignore this file
-        i_matches = [n for n in config.fn_ignore_files if fnmatch.fnmatch(fn, n)]
-        if len(i_matches) > 0:
-            file_search_stats["skipped_ignore_pattern"] += 1
-            return False
+        finish_file(result, contents)
+        return result
 
-        # Limit search to small files, to avoid 30GB FastQ files etc.
+    def finish_file(result, contents):
+        """
+        Record the file type if the file was opened by the search, and keep the contents
+        of matched files so that the module doesn't need to open them again (see config.search_buffer_mb)
+        """
+        if contents.file_type is not None:
+            result["stats"]["file_type_" + contents.file_type] += 1
+        if state.file_buffers.enabled and len(result["keys"]) > 0 and contents.opened:
+            if result["f"].get("filesize", 0) <= state.file_buffers.max_bytes:
+                result["contents"] = contents.text()
+
+    def cached_result(sf):
+        """Look up a file in the search cache, if we have one. Returns None if it needs to be searched."""
+        if search_cache is None:
+            return None
+        return search_cache.get(sf[0], sf[1], sf[2])
+
+    def add_files(chunk):
+        """Search a batch of files. Used to hand work to the search worker threads."""
+        return [cached if cached is not None else add_file(*sf) for sf, cached in chunk]
+
+    def record_result(result, cached=False):
+        """
+        Merge the result of searching a single file into the global report
+        variables. Always called from the main thread, in the original file order.
+        """
+        if search_cache is not None and not cached:
+            search_cache.add(result)
+        for key in result["keys"]:
+            state.files[key].append(result["f"])
+            state.file_search_stats[key] = state.file_search_stats.get(key, 0) + 1
+        for key, count in result["stats"].items():
+            state.file_search_stats[key] = state.file_search_stats.get(key, 0) + count
+        for key, sp_time in result["sp_times"].items():
+            state.runtimes["sp"][key] = state.runtimes["sp"].get(key, 0) + sp_time
+        if not result["matched"]:
+            state.file_search_stats["skipped_no_match"] += 1
+        if result.get("contents") is not None:
+            state.file_buffers.add(
+                os.path.join(result["f"]["root"], result["f"]["fn"]), result["contents"], uses=len(result["keys"])
+            )
+
+    # Open the persistent search cache if we have one
+    search_cache = None
+    if config.search_cache:
         try:
-            f["filesize"] = os.path.getsize(os.path.join(root, fn))
-        except (IOError, OSError, ValueError, UnicodeDecodeError):
-            logger.debug("Couldn't read file when checking filesize: {}".format(fn))
-        else:
-            if f["filesize"] > config.log_filesize_limit:
-                file_search_stats["skipped_filesize_limit"] += 1
-                return False
-
-        # Test file for each search pattern
-        file_matched = False
-        for patterns in spatterns:
-            for key, sps in patterns.items():
-                start = time.time()
-                for sp in sps:
-                    if search_file(sp, f, key):
-                        # Check that we shouldn't exclude this file
-                        if not exclude_file(sp, f):
-                            # Looks good! Remember this file
-                            files[key].append(f)
-                            file_search_stats[key] = file_search_stats.get(key, 0) + 1
-                            file_matched = True
-                        # Don't keep searching this file for other modules
-                        if not sp.get("shared", False):
-                            runtimes["sp"][key] = runtimes["sp"].get(key, 0) + (time.time() - start)
-                            return True
-                        # Don't look at other patterns for this module
-                        else:
-                            break
-                runtimes["sp"][key] = runtimes["sp"].get(key, 0) + (time.time() - start)
-
-        return file_matched
-
-    # Go through the analysis directories and get file list
-    multiqc_installation_dir_files = [
-        "LICENSE",
-        "CHANGELOG.md",
-        "Dockerfile",
-        "MANIFEST.in",
-        ".gitmodules",
-        "README.md",
-        "CSP.txt",
-        "setup.py",
-        ".gitignore",
-    ]
-    total_sp_starttime = time.time()
-    for path in config.analysis_dir:
-        if os.path.islink(path) and config.ignore_symlinks:
-            file_search_stats["skipped_symlinks"] += 1
-            continue
-        elif os.path.isfile(path):
-            searchfiles.append([os.path.basename(path), os.path.dirname(path)])
-        elif os.path.isdir(path):
-            for root, dirnames, filenames in os.walk(path, followlinks=(not config.ignore_symlinks), topdown=True):
-                bname = os.path.basename(root)
-
-                # Skip any sub-directories matching ignore params
-                orig_dirnames = dirnames[:]
-                for n in config.fn_ignore_dirs:
-                    dirnames[:] = [d for d in dirnames if not fnmatch.fnmatch(d, n.rstrip(os.sep))]
-                    if len(orig_dirnames) != len(dirnames):
-                        removed_dirs = [
-                            os.path.join(root, d) for d in set(orig_dirnames).symmetric_difference(set(dirnames))
-                        ]
-                        file_search_stats["skipped_directory_fn_ignore_dirs"] += len(removed_dirs)
-                        orig_dirnames = dirnames[:]
-                for n in config.fn_ignore_paths:
-                    dirnames[:] = [d for d in dirnames if not fnmatch.fnmatch(os.path.join(root, d), n.rstrip(os.sep))]
-                    if len(orig_dirnames) != len(dirnames):
-                        removed_dirs = [
-                            os.path.join(root, d) for d in set(orig_dirnames).symmetric_difference(set(dirnames))
-                        ]
-                        file_search_stats["skipped_directory_fn_ignore_dirs"] += len(removed_dirs)
-
-                # Skip *this* directory if matches ignore params
-                d_matches = [n for n in config.fn_ignore_dirs if fnmatch.fnmatch(bname, n.rstrip(os.sep))]
-                if len(d_matches) > 0:
-                    file_search_stats["skipped_directory_fn_ignore_dirs"] += 1
-                    continue
-                p_matches = [n for n in config.fn_ignore_paths if fnmatch.fnmatch(root, n.rstrip(os.sep))]
-                if len(p_matches) > 0:
-                    file_search_stats["skipped_directory_fn_ignore_dirs"] += 1
-                    continue
-
-                # Sanity check - make sure that we're not just running in the installation directory
-                if len(filenames) > 0 and all([fn in filenames for fn in multiqc_installation_dir_files]):
-                    logger.error("Error: MultiQC is running in source code directory! {}".format(root))
-                    logger.warning(
-                        "Please see the docs for how to use MultiQC: https://multiqc.info/docs/#running-multiqc"
-                    )
-                    dirnames[:] = []
-                    filenames[:] = []
-                    continue
-
-                # Search filenames in this directory
-                for fn in filenames:
-                    searchfiles.append([fn, root])
+            search_cache = SearchCache(config.search_cache, search_fingerprint(), pattern_hashes(spatterns))
+            logger.debug("Using file search cache: {}".format(config.search_cache))
+        except sqlite3.Error as e:
+            logger.error("Could not open file search cache '{}': {}".format(config.search_cache, e))
 
+    search_workers = max(1, int(config.search_workers or 1))
     # Search through collected files
-    console = rich.console.Console(
-        stderr=True,
-        highlight=False,
-        force_interactive=False if config.no_ansi else None,
-        color_system=None if config.no_ansi else "auto",
-    )
-    progress_obj = rich.progress.Progress(
-        "[blue]|[/]      ",
-        rich.progress.SpinnerColumn(),
-        "[blue]{task.description}[/] |",
-        rich.progress.BarColumn(),
-        "[progress.percentage]{task.percentage:>3.0f}%",
-        "[green]{task.completed}/{task.total}",
-        "[dim]{task.fields[s_fn]}",
-        console=console,
-        disable=config.no_ansi or config.quiet,
-    )
-    with progress_obj as progress:
-        mqc_task = progress.add_task("searching", total=len(searchfiles), s_fn="")
-        for sf in searchfiles:
-            progress.update(mqc_task, advance=1, s_fn=os.path.join(sf[1], sf[0])[-50:])
-            if not add_file(sf[0], sf[1]):
-                file_search_stats["skipped_no_match"] += 1
-        progress.update(mqc_task, s_fn="")
+    with SearchProgress(len(state.searchfiles)) as progress:
+        if search_workers > 1 and len(state.searchfiles) > 1:
+            # Shard the files into batches and search them across a pool of worker threads.
+            # Results are collected in the original order, so the final file lists are the same as a serial search.
+            # Cache lookups happen here in the main thread, as the chunks are prepared.
+            logger.debug("Searching files using {} worker threads".format(search_workers))
+            chunksize = max(1, min(config.search_chunksize, len(state.searchfiles) // search_workers))
+            chunks = [
+                [(sf, cached_result(sf)) for sf in state.searchfiles[i : i + chunksize]]
+                for i in range(0, len(state.searchfiles), chunksize)
+            ]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=search_workers) as executor:
+                for chunk, results in zip(chunks, executor.map(add_files, chunks)):
+                    for (sf, cached), result in zip(chunk, results):
+                        record_result(result, cached=cached is not None)
+                    progress.advance(len(chunk), chunk[-1][0])
+        else:
+            for sf in state.searchfiles:
+                cached = cached_result(sf)
+                if cached is not None:
+                    record_result(cached, cached=True)
+                else:
+                    record_result(add_file(*sf))
+                progress.advance(1, sf)
+
+    if search_cache is not None:
+        state.file_search_stats["search_cache_hits"] = search_cache.hits
+        state.file_search_stats["search_cache_misses"] = search_cache.misses
+        logger.debug("File search cache: {} hits, {} misses".format(search_cache.hits, search_cache.misses))
+        try:
+            search_cache.save()
+        except sqlite3.Error as e:
+            logger.error("Could not save file search cache '{}': {}".format(config.search_cache, e))
 
-    runtimes["total_sp"] = time.time() - total_sp_starttime
+    state.runtimes["total_sp"] = time.time() - total_sp_starttime
 
     # Debug log summary about what we skipped
     summaries = []
-    for key in sorted(file_search_stats, key=file_search_stats.get, reverse=True):
-        if "skipped_" in key and file_search_stats[key] > 0:
-            summaries.append(f"{key}: {file_search_stats[key]}")
+    for key in sorted(state.file_search_stats, key=state.file_search_stats.get, reverse=True):
+        if "skipped_" in key and state.file_search_stats[key] > 0:
+            summaries.append(f"{key}: {state.file_search_stats[key]}")
     logger.debug(f"Summary of files that were skipped by the search: [{'] // ['.join(summaries)}]")
 
 
-def search_file(pattern, f, module_key):
+def search_file(pattern, f, module_key, stats=None, contents=None):
     """
     Function to searach a single file for a single search pattern.
+    Skip counts are added to `stats` if given, otherwise to the global file_search_stats.
+    `contents` is an optional FileContents object, so that a file is only read once
+    when it is tested against many search patterns.
     """
 
-    global file_search_stats
+    if stats is None:
+        stats = state.file_search_stats
     fn_matched = False
     contents_matched = False
 
     # Use mimetypes to exclude binary files where possible
-    if not re.match(r".+_mqc\.(png|jpg|jpeg)", f["fn"]) and config.ignore_images:
-        (ftype, encoding) = mimetypes.guess_type(os.path.join(f["root"], f["fn"]))
-        if encoding is not None:
+    if not regex_cache.get(r".+_mqc\.(png|jpg|jpeg)").match(f["fn"]) and config.ignore_images:
+        if contents is not None:
+            (ftype, encoding) = contents.guess_type()
+        else:
+            (ftype, encoding) = mimetypes.guess_type(os.path.join(f["root"], f["fn"]))
+        if not searchable_encoding(encoding):
             return False
         if ftype is not None and ftype.startswith("image"):
             return False
@@ -342,114 +489,261 @@ def search_file(pattern, f, module_key):
     # Search pattern specific filesize limit
     if pattern.get("max_filesize") is not None and "filesize" in f:
         if f["filesize"] > pattern.get("max_filesize"):
-            file_search_stats["skipped_module_specific_max_filesize"] += 1
+            stats["skipped_module_specific_max_filesize"] += 1
             return False
 
     # Search by file name (glob)
+    fn = search_fn(f["fn"])
     if pattern.get("fn") is not None:
-        if fnmatch.fnmatch(f["fn"], pattern["fn"]):
+        if fnmatch.fnmatch(fn, pattern["fn"]):
             fn_matched = True
             if pattern.get("contents") is None and pattern.get("contents_re") is None:
                 return True
 
     # Search by file name (regex)
     if pattern.get("fn_re") is not None:
-        if re.match(pattern["fn_re"], f["fn"]):
+        if regex_cache.get(pattern["fn_re"]).match(fn):
             fn_matched = True
             if pattern.get("contents") is None and pattern.get("contents_re") is None:
                 return True
 
     # Search by file contents
     if pattern.get("contents") is not None or pattern.get("contents_re") is not None:
-        if pattern.get("contents_re") is not None:
-            repattern = re.compile(pattern["contents_re"])
-        try:
-            file_path = os.path.join(f["root"], f["fn"])
-            with io.open(file_path, "r", encoding="utf-8") as fh:
-                l = 1
-                for line in fh:
-                    # Search by file contents (string)
-                    if pattern.get("contents") is not None:
-                        if pattern["contents"] in line:
-                            contents_matched = True
-                            if pattern.get("fn") is None and pattern.get("fn_re") is None:
-                                return True
-                            break
-                    # Search by file contents (regex)
-                    elif pattern.get("contents_re") is not None:
-                        if re.search(repattern, line):
-                            contents_matched = True
-                            if pattern.get("fn") is None and pattern.get("fn_re") is None:
-                                return True
-                            break
-                    # Break if we've searched enough lines for this pattern
-                    if pattern.get("num_lines") and l >= pattern.get("num_lines"):
-                        break
-                    l += 1
+        # No point reading the file if the filename is also required and didn't match
+        if (pattern.get("fn") is not None or pattern.get("fn_re") is not None) and not fn_matched:
+            return False
+        if contents is None:
+            contents = FileContents(os.path.join(f["root"], f["fn"]))
+        # Search by file contents (string)
+        if pattern.get("contents") is not None:
+            contents_matched = contents.contains(pattern["contents"], pattern.get("num_lines"))
+        # Search by file contents (regex)
+        else:
+            contents_matched = contents.search(pattern["contents_re"], pattern.get("num_lines"))
         # Can't open file - usually because it's a binary file and we're reading as utf-8
-        except (IOError, OSError, ValueError, UnicodeDecodeError) as e:
+        if contents_matched is None:
             if config.report_readerrors:
-                logger.debug(f"Couldn't read file when looking for output: {file_path}, {e}")
-            file_search_stats["skipped_file_contents_search_errors"] += 1
+                logger.debug(f"Couldn't read file when looking for output: {contents.path}, {contents.error}")
+            stats["skipped_file_contents_search_errors"] += 1
             return False
+        if contents_matched and pattern.get("fn") is None and pattern.get("fn_re") is None:
+            return True
 
     return fn_matched and contents_matched
 
 
-def exclude_file(sp, f):
+def search_fn(fn):
+    """
+    Filename used to match search patterns. With `config.search_compressed`,
+    the .gz extension is dropped so that `x.log.gz` is found like `x.log`.
+    """
+    if config.search_compressed and fn.lower().endswith(".gz"):
+        return fn[:-3]
+    return fn
+
+
+def searchable_encoding(encoding):
+    """Whether files with this mimetypes encoding can be searched (gzip only with `config.search_compressed`)"""
+    return encoding is None or (encoding == "gzip" and config.search_compressed)
+
+
+def exclude_file(sp, f, contents=None):
     """
     Exclude discovered files if they match the special exclude_
     search pattern keys
     """
-    # Make everything a list if it isn't already
-    for k in sp:
-        if k in ["exclude_fn", "exclude_fn_re" "exclude_contents", "exclude_contents_re"]:
-            if not isinstance(sp[k], list):
-                sp[k] = [sp[k]]
+    # Everything as a list, without modifying the search pattern
+    excludes = regex_cache.excludes(sp)
+    if len(excludes) == 0:
+        return False
 
     # Search by file name (glob)
-    if "exclude_fn" in sp:
-        for pat in sp["exclude_fn"]:
-            if fnmatch.fnmatch(f["fn"], pat):
-                return True
+    fn = search_fn(f["fn"])
+    for pat in excludes.get("exclude_fn", []):
+        if fnmatch.fnmatch(fn, pat):
+            return True
 
     # Search by file name (regex)
-    if "exclude_fn_re" in sp:
-        for pat in sp["exclude_fn_re"]:
-            if re.match(pat, f["fn"]):
-                return True
+    for pat in excludes.get("exclude_fn_re", []):
+        if regex_cache.get(pat).match(fn):
+            return True
 
     # Search the contents of the file
-    if "exclude_contents" in sp or "exclude_contents_re" in sp:
-        # Compile regex patterns if we have any
-        if "exclude_contents_re" in sp:
-            sp["exclude_contents_re"] = [re.compile(pat) for pat in sp["exclude_contents_re"]]
-        with io.open(os.path.join(f["root"], f["fn"]), "r", encoding="utf-8") as fh:
-            for line in fh:
-                if "exclude_contents" in sp:
-                    for pat in sp["exclude_contents"]:
-                        if pat in line:
-                            return True
-                if "exclude_contents_re" in sp:
-                    for pat in sp["exclude_contents_re"]:
-                        if re.search(pat, line):
-                            return True
+    if "exclude_contents" in excludes or "exclude_contents_re" in excludes:
+        if contents is None:
+            contents = FileContents(os.path.join(f["root"], f["fn"]))
+        for pat in excludes.get("exclude_contents", []):
+            if contents.contains(pat):
+                return True
+        for pat in excludes.get("exclude_contents_re", []):
+            if contents.search(pat):
+                return True
     return False
 
 
+class FileContents(object):
+    """
+    Lazily reads a text file for the file search, so that it is only opened and
+    read once however many search patterns it is tested against.
+    Lines are only read as far as the search patterns need them.
+
+    `prefilter` is an optional tuple from build_contents_re_prefilter(): a compiled regex
+    matching the union of several `contents_re` search patterns, and the set of patterns
+    that it covers. Lines that don't match the union can't match any of the covered
+    patterns, so these are skipped without running every regex on every line.
+
+    When the file is opened, its type is sniffed from the first few bytes (see
+    file_sniffer.py). Binary and compressed files are not decoded as text - they
+    give a read error straight away, without going through every line.
+    With `config.search_compressed`, gzip files are decompressed as they are read.
+    """
+
+    def __init__(self, path, prefilter=None):
+        self.path = path
+        self.lines = list()
+        self.eof = False
+        self.error = None
+        self.file_type = None
+        self.prefilter = prefilter
+        self._fh = None
+        self._text = ""
+        self._text_num_lines = 0
+        self._line_ends = list()
+        self._prefilter_hits = list()
+        self._prefilter_num_lines = 0
+        self._mimetype = None
+
+    @property
+    def opened(self):
+        """True if the file has been opened for reading by a search pattern"""
+        return self._fh is not None or self.eof or self.error is not None
+
+    def text(self):
+        """The full contents of the file, or None if it couldn't be read"""
+        self.read()
+        if self.error is not None:
+            return None
+        return "".join(self.lines)
+
+    def guess_type(self):
+        """Cached result of mimetypes.guess_type() for this file"""
+        if self._mimetype is None:
+            self._mimetype = mimetypes.guess_type(self.path)
+        return self._mimetype
+
+    def read(self, num_lines=None):
+        """Make sure that the first num_lines lines have been read (all lines if None)"""
+        if self.eof or self.error is not None:
+            return
+        if num_lines is not None and len(self.lines) >= num_lines:
+            return
+        try:
+            if self._fh is None:
+                self._fh = self._open()
+            if num_lines is None:
+                rest = self._fh.read().split("\n")
+                self.lines.extend([l + "\n" for l in rest[:-1]])
+                if rest[-1] != "":
+                    self.lines.append(rest[-1])
+                self.eof = True
+            else:
+                while len(self.lines) < num_lines:
+                    line = self._fh.readline()
+                    if line == "":
+                        self.eof = True
+                        break
+                    self.lines.append(line)
+        except (IOError, OSError, ValueError, UnicodeDecodeError, EOFError, zlib.error) as e:
+            self.error = e
+            # Reading everything at once loses the lines before the error. Get them back.
+            if num_lines is None and not isinstance(e, file_sniffer.BinaryFileError):
+                self.lines = list()
+                try:
+                    with file_sniffer.open_text(self.path, decompress=config.search_compressed)[0] as fh:
+                        for line in fh:
+                            self.lines.append(line)
+                except (IOError, OSError, ValueError, UnicodeDecodeError, EOFError, zlib.error):
+                    pass
+        if (self.eof or self.error is not None) and self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def _open(self):
+        """Open the file as text, after checking from the first bytes that it is a text file"""
+        try:
+            fh, self.file_type = file_sniffer.open_text(self.path, decompress=config.search_compressed)
+        except file_sniffer.BinaryFileError as e:
+            # Still counted in the file search stats
+            self.file_type = e.file_type
+            raise
+        return fh
+
+    def _limit(self, num_lines):
+        """Number of lines to search for a pattern limited to num_lines. None if we hit a read error first."""
+        num_lines = num_lines or None
+        self.read(num_lines)
+        if num_lines is None or len(self.lines) < num_lines:
+            if self.error is not None:
+                return None
+            return len(self.lines)
+        return num_lines
+
+    def contains(self, pattern, num_lines=None):
+        """
+        Check whether any of the first num_lines lines contain the string pattern.
+        Returns None if the file couldn't be read far enough to tell.
+        """
+        limit = self._limit(num_lines)
+        lines_checked = len(self.lines) if limit is None else limit
+        # Patterns with newlines in the middle could match across lines in the joined text
+        if "\n" in pattern[:-1] or lines_checked == 0:
+            found = any(pattern in line for line in self.lines[:lines_checked])
+        else:
+            if self._text_num_lines != len(self.lines):
+                self._text = "".join(self.lines)
+                self._text_num_lines = len(self.lines)
+                self._line_ends = list(itertools.accumulate(len(l) for l in self.lines))
+            end = self._line_ends[lines_checked - 1] if lines_checked > 0 else 0
+            found = self._text.find(pattern, 0, end) != -1
+        if found:
+            return True
+        return None if limit is None else False
+
+    def search(self, pattern, num_lines=None):
+        """
+        Check whether any of the first num_lines lines match the regex pattern.
+        Returns None if the file couldn't be read far enough to tell.
+        """
+        limit = self._limit(num_lines)
+        lines_checked = len(self.lines) if limit is None else limit
+        if self.prefilter is not None and pattern in self.prefilter[1]:
+            if self._prefilter_num_lines < len(self.lines):
+                for i in range(self._prefilter_num_lines, len(self.lines)):
+                    if self.prefilter[0].search(self.lines[i]):
+                        self._prefilter_hits.append(i)
+                self._prefilter_num_lines = len(self.lines)
+            candidates = (self.lines[i] for i in self._prefilter_hits if i < lines_checked)
+        else:
+            candidates = self.lines[:lines_checked]
+        regex = regex_cache.get(pattern)
+        if any(regex.search(line) for line in candidates):
+            return True
+        return None if limit is None else False
+
+
 def data_sources_tofile():
     fn = "multiqc_sources.{}".format(config.data_format_extensions[config.data_format])
     with io.open(os.path.join(config.data_dir, fn), "w", encoding="utf-8") as f:
         if config.data_format == "json":
-            jsonstr = json.dumps(data_sources, indent=4, ensure_ascii=False)
+            jsonstr = json.dumps(state.data_sources, indent=4, ensure_ascii=False)
             print(jsonstr.encode("utf-8", "ignore").decode("utf-8"), file=f)
         elif config.data_format == "yaml":
-            yaml.dump(data_sources, f, default_flow_style=False)
+            yaml.dump(state.data_sources, f, default_flow_style=False)
         else:
             lines = [["Module", "Section", "Sample Name", "Source"]]
-            for mod in data_sources:
-                for sec in data_sources[mod]:
-                    for s_name, source in data_sources[mod][sec].items():
+            for mod in state.data_sources:
+                for sec in state.data_sources[mod]:
+                    for s_name, source in state.data_sources[mod][sec].items():
                         lines.append([mod, sec, s_name, source])
             body = "\n".join(["\t".join(l) for l in lines])
             print(body.encode("utf-8", "ignore").decode("utf-8"), file=f)
@@ -459,7 +753,7 @@ def dois_tofile():
     """Find all DOIs listed in report sections and write to a file"""
     # Collect DOIs
     dois = {"MultiQC": ["10.1093/bioinformatics/btw354"]}
-    for mod in modules_output:
+    for mod in state.modules_output:
         if mod.doi is not None and mod.doi != []:
             dois[mod.anchor] = mod.doi
     # Write to a file
@@ -481,9 +775,6 @@ def dois_tofile():
 def save_htmlid(html_id, skiplint=False):
     """Take a HTML ID, sanitise for HTML, check for duplicates and save.
     Returns sanitised, unique ID"""
-    global html_ids
-    global lint_errors
-
     # Trailing whitespace
     html_id_clean = html_id.strip()
 
@@ -511,43 +802,257 @@ def save_htmlid(html_id, skiplint=False):
     if config.lint and not skiplint and html_id != html_id_clean:
         errmsg = "LINT: {}HTML ID was not clean ('{}' -> '{}') ## {}".format(modname, html_id, html_id_clean, codeline)
         logger.error(errmsg)
-        lint_errors.append(errmsg)
+        state.lint_errors.append(errmsg)
 
     # Check for duplicates
     i = 1
     html_id_base = html_id_clean
-    while html_id_clean in html_ids:
+    while html_id_clean in state.html_ids:
         html_id_clean = "{}-{}".format(html_id_base, i)
         i += 1
         if config.lint and not skiplint:
             errmsg = "LINT: {}HTML ID was a duplicate ({}) ## {}".format(modname, html_id_clean, codeline)
             logger.error(errmsg)
-            lint_errors.append(errmsg)
+            state.lint_errors.append(errmsg)
 
     # Remember and return
-    html_ids.append(html_id_clean)
+    state.html_ids.append(html_id_clean)
     return html_id_clean
 
 
+# Codecs for compress_json(), see config.plot_data_codec
+plot_data_codecs = ["zlib", "lzstring"]
+
+# Version of the plot data format in the report, for templates that read the data (see docs/templates.md)
+# 1: all plot data in the mqc_compressed_plotdata element, compressed with lz-string (MultiQC before v1.14)
+# 2: compressed with config.plot_data_codec, and with config.lazy_plot_data in one element per plot
+plot_data_format = 2
+
+
+@spans.timed("compress_json")
 def compress_json(data):
-    """Take a Python data object. Convert to JSON and compress using lzstring"""
-    json_string = json.dumps(data).encode("utf-8", "ignore").decode("utf-8")
-    json_string = sanitise_json(json_string)
-    x = lzstring.LZString()
-    return x.compressToBase64(json_string)
+    """
+    Take a Python data object. Convert to JSON and compress with the codec in config.plot_data_codec:
+    zlib (decompressed in the browser by multiqc_inflate.js) or lzstring (much slower, as it's pure Python).
+    The JSON is compressed as it is made, one chunk at a time. Returns a base64 string.
+    """
+    if config.plot_data_codec not in plot_data_codecs:
+        logger.warning(
+            "Unknown plot_data_codec '{}', using 'zlib'. Choose from: {}".format(
+                config.plot_data_codec, ", ".join(plot_data_codecs)
+            )
+        )
+        config.plot_data_codec = "zlib"
+    if config.plot_data_codec == "lzstring":
+        import lzstring
+
+        x = lzstring.LZString()
+        return x.compressToBase64("".join(json_chunks(data)))
+    compressor = zlib.compressobj(config.plot_data_compression_level)
+    compressed = [compressor.compress(chunk.encode("ascii")) for chunk in json_chunks(data)]
+    compressed.append(compressor.flush())
+    return base64.b64encode(b"".join(compressed)).decode("ascii")
+
+
+@spans.timed("compress_plot_data")
+def compress_plot_data(plot_data):
+    """
+    Compress the data of each plot on its own with compress_json(), so that the report only has to
+    decompress the data of a plot when it is shown. Returns a dict of plot ID to base64 string.
+    """
+    return OrderedDict((plot_id, compress_json(data)) for plot_id, data in plot_data.items())
+
+
+def json_chunks(data):
+    """
+    Yield the JSON of a Python data object in chunks, with one chunk for each key of a dict.
+    The output is ASCII, the same as json.dumps(data), except that NaN and Infinity are written
+    as `null`: they are valid JavaScript, but not valid JSON, so would crash the browser when
+    parsing the JSON. Nothing in the MultiQC front-end uses these values.
+    """
+    encoder = json.JSONEncoder(allow_nan=False)
+    if not isinstance(data, dict):
+        yield encode_finite_json(encoder, data)
+        return
+    yield "{"
+    for idx, (key, value) in enumerate(data.items()):
+        # Encoded as a dict of its own, so the key is converted to a string as by json.dumps()
+        chunk = encode_finite_json(encoder, {key: value})[1:-1]
+        yield chunk if idx == 0 else ", " + chunk
+    yield "}"
+
+
+def encode_finite_json(encoder, data):
+    """JSON of a Python data object, with NaN and Infinity as null. The encoder should have allow_nan=False"""
+    try:
+        return encoder.encode(data)
+    except ValueError:
+        # Most data doesn't have any non-finite values, so is only copied if it does
+        return encoder.encode(replace_non_finite(data))
+
+
+def replace_non_finite(data):
+    """Copy of a Python data object with NaN and Infinity floats replaced by None"""
+    if isinstance(data, float):
+        return data if math.isfinite(data) else None
+    if isinstance(data, dict):
+        return {k: replace_non_finite(v) for k, v in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [replace_non_finite(v) for v in data]
+    return data
+
+
+def build_contents_re_prefilter(patterns):
+    """
+    Combine regex search patterns into a single alternation, for use with FileContents.
+    Patterns that can't safely be combined (backreferences, inline flags) are left out.
+    Returns a tuple of the compiled regex and the set of patterns that it covers,
+    or None if nothing could be combined.
+    """
+    covered = set()
+    for pattern in patterns:
+        if not isinstance(pattern, str) or re.search(r"\\[1-9]|\(\?P=|\(\?[aiLmsux-]+[:)]", pattern):
+            continue
+        try:
+            regex_cache.get(pattern)
+        except re.error:
+            continue
+        covered.add(pattern)
+    if len(covered) == 0:
+        return None
+    try:
+        union = re.compile("|".join("(?:{})".format(p) for p in sorted(covered)))
+    except re.error:
+        return None
+    return (union, covered)
 
 
-def sanitise_json(json_string):
+class SearchPatternIndex(object):
     """
-    The Python json module uses a bunch of values which are valid JavaScript
-    but invalid JSON. These crash the browser when parsing the JSON.
-    Nothing in the MultiQC front-end uses these values, so instead we just
-    do a find-and-replace for them and switch them with `null`, which works fine.
-
-    Side effect: Any string values that include the word "Infinity"
-    (case-sensitive) will have it switched for "null". Hopefully that doesn't happen
-    a lot, otherwise we'll have to do this in a more complicated manner.
+    Index of search patterns by the filename extension or literal filename suffix
+    that they require, derived from their `fn` globs. Used to only test each file
+    against the search patterns that could possibly match its name.
+
+    Patterns without a literal suffix in `fn`, with `fn_re`, or without any filename
+    requirement (contents-only patterns) are kept in a fallback list and tested
+    against every file. Candidates are always returned in the original search order.
     """
-    json_string = re.sub(r"\bNaN\b", "null", json_string)
-    json_string = re.sub(r"\b-?Infinity\b", "null", json_string)
-    return json_string
+
+    def __init__(self, spatterns):
+        self.entries = list()
+        self.by_ext = defaultdict(set)
+        self.by_suffix = defaultdict(set)
+        self.always = set()
+        self._candidates = dict()
+        for patterns in spatterns:
+            for key, sps in patterns.items():
+                entry_idx = len(self.entries)
+                self.entries.append((key, sps))
+                for sp_idx, sp in enumerate(sps):
+                    suffix = self.fn_suffix(sp)
+                    if suffix is None:
+                        self.always.add((entry_idx, sp_idx))
+                    elif "." in suffix:
+                        self.by_ext[suffix.rsplit(".", 1)[1]].add((entry_idx, sp_idx))
+                    else:
+                        self.by_suffix[suffix].add((entry_idx, sp_idx))
+        logger.debug(
+            "Indexed search patterns by filename: {} filename extensions, {} suffixes, {} patterns tested for every file".format(
+                len(self.by_ext), len(self.by_suffix), len(self.always)
+            )
+        )
+
+    @staticmethod
+    def fn_suffix(sp):
+        """
+        Lowercase literal suffix that a filename must end with to match this search pattern,
+        or None if it can't be narrowed down this way. Case is ignored, as fnmatch is
+        case-insensitive on some platforms.
+        """
+        if sp.get("fn_re") is not None or not isinstance(sp.get("fn"), str):
+            return None
+        suffix = re.split(r"[*?\]]", sp["fn"])[-1]
+        if suffix == "" or "[" in suffix:
+            return None
+        return suffix.lower()
+
+    def name_key(self, fn):
+        """Filename extension and indexed suffixes of a filename - files with the same name key have the same candidates"""
+        fn_lower = fn.lower()
+        ext = fn_lower.rsplit(".", 1)[1] if "." in fn_lower else None
+        suffixes = tuple(s for s in self.by_suffix if fn_lower.endswith(s))
+        return (ext, suffixes)
+
+    def candidates(self, fn):
+        """List of (search key, search patterns) which could match this filename, in search order"""
+        return self.name_key_candidates(self.name_key(fn))
+
+    def name_key_candidates(self, name_key):
+        """List of (search key, search patterns) which could match filenames with this name_key()"""
+        ext, suffixes = name_key
+        if name_key not in self._candidates:
+            selected = set(self.always)
+            if ext is not None:
+                selected.update(self.by_ext.get(ext, ()))
+            for s in suffixes:
+                selected.update(self.by_suffix[s])
+            candidates = list()
+            for entry_idx, sp_idx in sorted(selected):
+                key, sps = self.entries[entry_idx]
+                if len(candidates) > 0 and candidates[-1][0] == entry_idx:
+                    candidates[-1][2].append(sps[sp_idx])
+                else:
+                    candidates.append((entry_idx, key, [sps[sp_idx]]))
+            self._candidates[name_key] = [(key, sps) for _, key, sps in candidates]
+        return self._candidates[name_key]
+
+
+def plan_search(sp_index, searchfiles):
+    """
+    Work out which search patterns could match any of the files to search, before searching them.
+    Files are counted by filename extension and indexed suffix (see SearchPatternIndex), and only
+    the search keys that are candidates for at least one of these are kept. Search patterns that
+    can't be ruled out by filename (contents-only patterns, `fn_re`) are always kept.
+    Returns a dict describing the plan, kept as `report.search_plan`.
+    """
+    start = time.time()
+    census = defaultdict(int)
+    for fn, _, _ in searchfiles:
+        census[sp_index.name_key(search_fn(fn))] += 1
+
+    search_keys = set()
+    for name_key in census:
+        search_keys.update(key for key, _ in sp_index.name_key_candidates(name_key))
+
+    extensions = defaultdict(int)
+    for (ext, _), count in census.items():
+        extensions[ext if ext is not None else "(none)"] += count
+
+    all_keys = [key for key, _ in sp_index.entries]
+    modules = list()
+    skipped_modules = list()
+    for key in all_keys:
+        mod_name = key.split("/", 1)[0]
+        if key in search_keys and mod_name not in modules:
+            modules.append(mod_name)
+    for key in all_keys:
+        mod_name = key.split("/", 1)[0]
+        if mod_name not in modules and mod_name not in skipped_modules:
+            skipped_modules.append(mod_name)
+
+    plan = {
+        "extensions": OrderedDict(sorted(extensions.items(), key=lambda x: (-x[1], x[0]))),
+        "search_keys": [key for key in all_keys if key in search_keys],
+        "skipped_search_keys": [key for key in all_keys if key not in search_keys],
+        "modules": modules,
+        "skipped_modules": skipped_modules,
+        "time": time.time() - start,
+    }
+    log_fn = logger.info if config.profile_runtime else logger.debug
+    log_fn(
+        "Search plan: {} of {} search keys could match the {} filename extensions found ({} modules ruled out)".format(
+            len(plan["search_keys"]), len(all_keys), len(extensions), len(skipped_modules)
+        )
+    )
+    logger.debug("Modules that could match files: {}".format(", ".join(modules)))
+    return plan
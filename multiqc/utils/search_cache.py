@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+""" MultiQC file search cache. Remembers the search result for every file in an
+SQLite database, so that unchanged files don't need to be searched again on
+subsequent runs over the same analysis directories. """
+
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from . import config
+
+logger = config.logger
+
+
+# Number of different sets of search patterns (e.g. from different -m / --exclude options) to keep results for
+MAX_PATTERN_SETS = 8
+
+
+def search_fingerprint():
+    """
+    Hash of everything apart from the search patterns that can change the search result for a file:
+    the MultiQC version and the file search config options. When this changes, all cached results are discarded.
+    """
+    fingerprint = {
+        "version": config.version,
+        "fn_ignore_files": config.fn_ignore_files,
+        "fn_ignore_dirs": config.fn_ignore_dirs,
+        "fn_ignore_paths": config.fn_ignore_paths,
+        "log_filesize_limit": config.log_filesize_limit,
+        "ignore_images": config.ignore_images,
+        "ignore_symlinks": config.ignore_symlinks,
+        "search_compressed": config.search_compressed,
+    }
+    return sha1_json(fingerprint)
+
+
+def pattern_hashes(spatterns):
+    """Hash of the search patterns of each search key, from the tiers of search patterns in report.get_filelist()"""
+    return {key: sha1_json([tier, sps]) for tier, tier_sps in enumerate(spatterns) for key, sps in tier_sps.items()}
+
+
+def sha1_json(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class SearchCache(object):
+    """
+    On-disk cache of file search results, keyed by the real path of each file and the set of search
+    patterns used, so that runs with different modules (-m / --exclude) each keep their own results.
+    A cached result is only used if the file size and modification time match. When the search
+    fingerprint changes (new MultiQC version or different ignore options), all old entries are discarded.
+    Results are kept for the MAX_PATTERN_SETS most recently used sets of search patterns.
+
+    A file that didn't match any pattern of a set of patterns can't match any of a subset of them either.
+    So with a new set of patterns, such results from any set that includes all of them are used too.
+    Their skip counts in `stats` may include the patterns of the other modules.
+
+    Only used from the main thread - results from worker threads are added
+    when they are merged back into the report.
+    """
+
+    def __init__(self, path, fingerprint, patterns):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.patterns_id = sha1_json(patterns)
+        self.hits = 0
+        self.misses = 0
+        self._realpaths = dict()
+        self._miss_keys = dict()
+        self._pending = list()
+        self.db = sqlite3.connect(path, timeout=60)
+        # Caches from before results were kept per set of search patterns
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(search_results)")]
+        if columns and "patterns_id" not in columns:
+            self.db.execute("DROP TABLE search_results")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS search_results (path TEXT, size INTEGER, mtime INTEGER, fingerprint TEXT, "
+            "patterns_id TEXT, matched INTEGER, result TEXT, PRIMARY KEY (path, patterns_id))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS pattern_sets (patterns_id TEXT PRIMARY KEY, patterns TEXT, last_used REAL)"
+        )
+        num_deleted = self.db.execute("DELETE FROM search_results WHERE fingerprint != ?", (fingerprint,)).rowcount
+        if num_deleted > 0:
+            logger.info(
+                "MultiQC version or search options changed, cleared {} cached search results".format(num_deleted)
+            )
+
+        # Remember this set of patterns, and forget the least recently used ones
+        self.db.execute(
+            "INSERT OR REPLACE INTO pattern_sets VALUES (?, ?, ?)",
+            (self.patterns_id, json.dumps(patterns, sort_keys=True), time.time()),
+        )
+        old_ids = [
+            row[0]
+            for row in self.db.execute(
+                "SELECT patterns_id FROM pattern_sets ORDER BY last_used DESC LIMIT -1 OFFSET ?", (MAX_PATTERN_SETS,)
+            )
+        ]
+        for patterns_id in old_ids:
+            self.db.execute("DELETE FROM search_results WHERE patterns_id = ?", (patterns_id,))
+            self.db.execute("DELETE FROM pattern_sets WHERE patterns_id = ?", (patterns_id,))
+
+        # Sets of patterns with every pattern of this one, whose results for files that matched nothing can be used
+        self.superset_ids = list()
+        for patterns_id, other in self.db.execute("SELECT patterns_id, patterns FROM pattern_sets"):
+            other = json.loads(other)
+            if patterns_id != self.patterns_id and all(other.get(k) == h for k, h in patterns.items()):
+                self.superset_ids.append(patterns_id)
+        self.db.commit()
+
+    def file_key(self, fn, root, st=None):
+        """
+        Real path, size and mtime for a file. Directory real paths are cached, and the
+        stat result from the directory walk is used if given, to save syscalls.
+        """
+        if root not in self._realpaths:
+            self._realpaths[root] = os.path.realpath(root)
+        path = os.path.join(self._realpaths[root], fn)
+        if st is None:
+            try:
+                st = os.stat(path)
+            except (IOError, OSError, ValueError):
+                return None
+        return (path, st.st_size, st.st_mtime_ns)
+
+    def get(self, fn, root, st=None):
+        """Return the cached search result for a file, or None if missing or out of date"""
+        key = self.file_key(fn, root, st)
+        row = None
+        if key is not None:
+            row = self.db.execute(
+                "SELECT result FROM search_results WHERE path = ? AND size = ? AND mtime = ? AND patterns_id = ?",
+                key + (self.patterns_id,),
+            ).fetchone()
+            if row is None and self.superset_ids:
+                row = self.db.execute(
+                    "SELECT result FROM search_results WHERE path = ? AND size = ? AND mtime = ? AND matched = 0 "
+                    "AND patterns_id IN ({})".format(", ".join("?" * len(self.superset_ids))),
+                    key + tuple(self.superset_ids),
+                ).fetchone()
+        if row is None:
+            self.misses += 1
+            # Keep the size and mtime from before the file was searched, in case it changes in the meantime
+            if key is not None:
+                self._miss_keys[(fn, root)] = key
+            return None
+        self.hits += 1
+        cached = json.loads(row[0])
+        f = {"fn": fn, "root": root}
+        if cached.get("filesize") is not None:
+            f["filesize"] = cached["filesize"]
+        return {"f": f, "matched": cached["matched"], "keys": cached["keys"], "stats": cached["stats"], "sp_times": {}}
+
+    def add(self, result):
+        """Remember the search result for a cache miss. Written to disk in bulk by save()"""
+        key = self._miss_keys.pop((result["f"]["fn"], result["f"]["root"]), None)
+        if key is None:
+            return
+        cached = {
+            "filesize": result["f"].get("filesize"),
+            "matched": result["matched"],
+            "keys": result["keys"],
+            "stats": result["stats"],
+        }
+        self._pending.append(key + (self.fingerprint, self.patterns_id, int(result["matched"]), json.dumps(cached)))
+
+    def save(self):
+        """Write new results to disk and close the database"""
+        if len(self._pending) > 0:
+            self.db.executemany("INSERT OR REPLACE INTO search_results VALUES (?, ?, ?, ?, ?, ?, ?)", self._pending)
+            self.db.commit()
+            self._pending = list()
+        self.db.close()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+""" Progress reporting for the MultiQC file search. Shows a progress bar when
+running in a terminal, and periodic log lines otherwise (eg. in cluster jobs). """
+
+
+import datetime
+import os
+import time
+
+import rich.console
+import rich.progress
+
+from . import config
+
+logger = config.logger
+
+
+class SearchProgress(object):
+    """
+    Context manager tracking how many files have been searched.
+
+    Updates are batched: the clock is only checked every `check_every` files, and the
+    progress bar / log is only touched when `refresh_interval` seconds have passed.
+    In a terminal, a rich progress bar is shown. Otherwise, a log line with the search
+    rate and the estimated time remaining is written every `config.search_progress_log_interval`
+    seconds, so that logs of long batch runs stay useful. Nothing is shown with --quiet.
+    """
+
+    check_every = 32
+    refresh_interval = 0.1
+
+    def __init__(self, total):
+        self.total = total
+        self.completed = 0
+        self._last_sf = None
+        self._unchecked = 0
+        self._progress = None
+        self._task = None
+        self._log_interval = None
+
+        console = rich.console.Console(
+            stderr=True,
+            highlight=False,
+            force_interactive=False if config.no_ansi else None,
+            color_system=None if config.no_ansi else "auto",
+        )
+        if config.quiet:
+            pass
+        elif console.is_interactive and not config.no_ansi:
+            self._progress = rich.progress.Progress(
+                "[blue]|[/]      ",
+                rich.progress.SpinnerColumn(),
+                "[blue]{task.description}[/] |",
+                rich.progress.BarColumn(),
+                "[progress.percentage]{task.percentage:>3.0f}%",
+                "[green]{task.completed}/{task.total}",
+                "[dim]{task.fields[s_fn]}",
+                console=console,
+            )
+        elif config.search_progress_log_interval:
+            self._log_interval = float(config.search_progress_log_interval)
+
+    def __enter__(self):
+        self._start = self._last_refresh = self._last_log = time.time()
+        if self._progress is not None:
+            self._progress.start()
+            self._task = self._progress.add_task("searching", total=self.total, s_fn="")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._progress is not None:
+            self._progress.update(self._task, completed=self.completed, s_fn="")
+            self._progress.stop()
+        elif self._log_interval is not None and self._last_log > self._start:
+            # Only finish off the log if we've been logging progress
+            self.log_progress(time.time())
+
+    def advance(self, num_files, sf):
+        """Count files as searched. `sf` is the last [fn, root, ...] searched, shown in the progress bar."""
+        self.completed += num_files
+        self._last_sf = sf
+        self._unchecked += num_files
+        if self._unchecked >= self.check_every:
+            self._unchecked = 0
+            self.refresh()
+
+    def refresh(self):
+        """Update the progress bar or log, if enough time has passed since the last update"""
+        now = time.time()
+        if now - self._last_refresh < self.refresh_interval:
+            return
+        self._last_refresh = now
+        if self._progress is not None:
+            s_fn = os.path.join(self._last_sf[1], self._last_sf[0])[-50:] if self._last_sf else ""
+            self._progress.update(self._task, completed=self.completed, s_fn=s_fn)
+        elif self._log_interval is not None and now - self._last_log >= self._log_interval:
+            self._last_log = now
+            self.log_progress(now)
+
+    def log_progress(self, now):
+        """Log line with the number of files searched, search rate and estimated time remaining"""
+        elapsed = max(now - self._start, 1e-6)
+        rate = self.completed / elapsed
+        if rate > 0:
+            eta = str(datetime.timedelta(seconds=round((self.total - self.completed) / rate)))
+        else:
+            eta = "unknown"
+        logger.info(
+            "Searching files: {}/{} ({:.0f}%), {:.0f} files/s, ETA {}".format(
+                self.completed, self.total, 100.0 * self.completed / max(self.total, 1), rate, eta
+            )
+        )
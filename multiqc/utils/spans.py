@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+""" MultiQC run time spans. Records the wall time, CPU time and peak memory use of the
+parts of a MultiQC run, so that they can be shown in the report and exported as a trace.
+
+    with spans.span("render_template"):
+        ...
+
+    @spans.timed("bargraph.plot")
+    def plot(data, cats=None, pconfig=None):
+        ...
+
+Spans are nested: a span started while another one is running is shown inside it.
+Finished spans are kept in `report.spans`, so spans of modules run in worker processes
+are merged into the report with the rest of the module results. """
+
+
+import functools
+import inspect
+import io
+import json
+import os
+import threading
+import time
+
+from . import config
+from .watchdog import memory_status
+
+logger = config.logger
+
+# File names of the exported spans, in the data directory
+spans_fn = "multiqc_runtime_spans.json"
+trace_fn = "multiqc_runtime_trace.json"
+
+# CPU time of the current thread, or of the process on Python < 3.7
+thread_time = getattr(time, "thread_time", time.process_time)
+
+# Spans running in each thread, outermost first
+_local = threading.local()
+
+
+def running_spans():
+    """Spans that are running in this thread, outermost first"""
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = list()
+        return _local.stack
+
+
+class Span(object):
+    """
+    A timed part of the MultiQC run. Can be entered more than once, eg. for each item taken
+    from a generator, in which case the times are added up and the span starts when first
+    entered. The span is recorded in the report with close().
+
+    The peak memory use (RSS) is only measured with `--profile-runtime`. It is the process
+    high water mark if this went up while the span ran, otherwise the larger of the RSS at the
+    start and end of the span - as the high water mark can't be reset for nested spans.
+    The peak memory use of spans inside the span is included.
+    """
+
+    def __init__(self, name, args=None, memory=True):
+        self.name = name
+        self.args = args or {}
+        self.memory = memory
+        self.start = None
+        self.depth = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_rss = None
+        self._child_peak_rss = None
+        self._enter_wall = None
+        self._enter_cpu = None
+        self._enter_rss = None
+        self._enter_hwm = None
+
+    def enter(self):
+        stack = running_spans()
+        if self.start is None:
+            self.start = time.time()
+            self.depth = len(stack)
+        stack.append(self)
+        if self.memory and config.profile_runtime:
+            self._enter_rss, self._enter_hwm = memory_status()
+        self._enter_cpu = thread_time()
+        self._enter_wall = time.perf_counter()
+
+    def exit(self):
+        self.wall += time.perf_counter() - self._enter_wall
+        self.cpu += thread_time() - self._enter_cpu
+        stack = running_spans()
+        if self in stack:
+            del stack[stack.index(self) :]
+        if self._enter_rss is not None:
+            rss, hwm = memory_status()
+            if rss is not None:
+                if hwm is not None and self._enter_hwm is not None and hwm > self._enter_hwm:
+                    peak = hwm
+                else:
+                    peak = max(rss, self._enter_rss)
+                self.peak_rss = max(self.peak_rss or 0, peak)
+            self._enter_rss = None
+        if self._child_peak_rss is not None:
+            self.peak_rss = max(self.peak_rss or 0, self._child_peak_rss)
+        # Memory used by this span counts for the span it's in
+        if self.peak_rss is not None and len(stack) > 0:
+            stack[-1]._child_peak_rss = max(stack[-1]._child_peak_rss or 0, self.peak_rss)
+
+    def record(self):
+        """The span as a dict, as saved in `report.spans`"""
+        return {
+            "name": self.name,
+            "args": self.args,
+            "start": self.start,
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "peak_rss": self.peak_rss,
+            "depth": self.depth,
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+        }
+
+    def close(self):
+        """Add the span to the report"""
+        if self.start is None:
+            return
+        from . import report
+
+        report.spans.append(self.record())
+
+    def __enter__(self):
+        self.enter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.exit()
+        self.close()
+        return False
+
+
+def span(name, **args):
+    """Context manager that times a block of code. Keyword arguments are saved with the span"""
+    return Span(name, args)
+
+
+def timed(name=None, args=()):
+    """
+    Decorator that times each call of a function, as a span called `name` (the qualified name of
+    the function by default). The values of the function arguments listed in `args` are saved with the span.
+
+    For generator functions, only the time spent getting each item is counted - not the time
+    spent by the caller on the items. The peak memory use is not measured for these.
+    """
+
+    def decorator(func):
+        span_name = name or func.__qualname__
+        signature = inspect.signature(func) if args else None
+
+        def span_args(call_args, call_kwargs):
+            if signature is None:
+                return None
+            bound = signature.bind_partial(*call_args, **call_kwargs).arguments
+            return {a: str(bound[a]) for a in args if a in bound}
+
+        if inspect.isgeneratorfunction(func):
+
+            @functools.wraps(func)
+            def wrapper(*call_args, **call_kwargs):
+                gen_span = Span(span_name, span_args(call_args, call_kwargs), memory=False)
+                return timed_generator(gen_span, func(*call_args, **call_kwargs))
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*call_args, **call_kwargs):
+                with Span(span_name, span_args(call_args, call_kwargs)):
+                    return func(*call_args, **call_kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def timed_generator(gen_span, gen):
+    """Yield the items of a generator, timing how long it takes to get each one"""
+    try:
+        while True:
+            gen_span.enter()
+            try:
+                item = next(gen)
+            except StopIteration:
+                return
+            finally:
+                gen_span.exit()
+            yield item
+    finally:
+        gen.close()
+        gen_span.close()
+
+
+def all_spans():
+    """
+    Finished spans in the report, and the spans still running in this thread (with their
+    times so far), sorted by start time
+    """
+    from . import report
+
+    records = list(report.spans)
+    for s in running_spans():
+        record = s.record()
+        record["wall"] = s.wall + time.perf_counter() - s._enter_wall
+        record["cpu"] = s.cpu + thread_time() - s._enter_cpu
+        record["peak_rss"] = s.peak_rss if s._child_peak_rss is None else max(s.peak_rss or 0, s._child_peak_rss)
+        records.append(record)
+    return sorted(records, key=lambda r: (r["start"], r["depth"]))
+
+
+def chrome_trace(records):
+    """Spans in the Chrome trace event format, for chrome://tracing, Perfetto or speedscope"""
+    t0 = min([r["start"] for r in records] or [0])
+    events = list()
+    threads = dict()
+    for r in records:
+        tid = threads.setdefault((r["pid"], r["thread"]), len(threads) + 1)
+        args = dict(r["args"], cpu_time=round(r["cpu"], 6))
+        if r["peak_rss"] is not None:
+            args["peak_rss_mb"] = round(r["peak_rss"] / 1024 / 1024, 1)
+        events.append(
+            {
+                "name": r["name"],
+                "cat": "multiqc",
+                "ph": "X",
+                "ts": round((r["start"] - t0) * 1e6),
+                "dur": round(r["wall"] * 1e6),
+                "pid": r["pid"],
+                "tid": tid,
+                "args": args,
+            }
+        )
+    for (pid, thread), tid in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_spans(data_dir):
+    """Write the spans of the run to the data directory, as a list and as a Chrome trace"""
+    records = all_spans()
+    with io.open(os.path.join(data_dir, spans_fn), "w", encoding="utf-8") as fh:
+        json.dump(records, fh, indent=4, ensure_ascii=False)
+    with io.open(os.path.join(data_dir, trace_fn), "w", encoding="utf-8") as fh:
+        json.dump(chrome_trace(records), fh, ensure_ascii=False)
+    logger.debug("Wrote {} run time spans to {}".format(len(records), os.path.join(data_dir, trace_fn)))
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+""" MultiQC pipeline stages. Searching for files, running the modules and rendering the
+report can be run as separate jobs, for example on the nodes of a cluster:
+
+    multiqc --stage search /data -o work
+    multiqc --stage parse --shard 1/4 work -o work    (and 2/4, 3/4, 4/4)
+    multiqc --stage render work
+
+The search stage writes the files found for each module to a JSON file. The parse stage
+runs a shard of the modules with these files, and saves their results in a shard directory.
+The render stage merges the results of all shards in module order and makes the report,
+which is the same as running MultiQC in one go. """
+
+
+import glob
+import io
+import json
+import os
+import pickle
+import shutil
+import sys
+
+from . import config, report, util_functions
+from .module_pool import dump_result, run_module
+from .watchdog import ModuleLimitExceeded
+
+logger = config.logger
+
+# File names of the stage outputs, in the output directory
+search_fn = "multiqc_search.json"
+shard_dir_name = "multiqc_shard_{}_of_{}"
+shard_fn = "multiqc_shard.pickle"
+
+
+def parse_shard(shard):
+    """Shard number and number of shards from a string like '2/8'. Raises ValueError if not valid"""
+    try:
+        shard_num, num_shards = [int(x) for x in str(shard).split("/")]
+    except ValueError:
+        raise ValueError("Shard should be given as 'i/N', eg. '1/4' for the first of four shards: {}".format(shard))
+    if num_shards < 1 or not 1 <= shard_num <= num_shards:
+        raise ValueError("Shard {} is not one of {} shards".format(shard_num, num_shards))
+    return shard_num, num_shards
+
+
+def module_name(mod_dict):
+    return list(mod_dict.keys())[0]
+
+
+##################################################
+#### SEARCH
+
+
+def save_search(run_modules):
+    """Write the modules to run and the files found for them, after report.get_filelist()"""
+    search = {
+        "version": config.version,
+        "analysis_dir": [os.path.abspath(d) for d in config.analysis_dir],
+        "run_modules": run_modules,
+        "files": report.files,
+        "file_search_stats": report.file_search_stats,
+        "search_plan": report.search_plan,
+    }
+    os.makedirs(config.output_dir, exist_ok=True)
+    path = os.path.join(config.output_dir, search_fn)
+    with io.open(path, "w", encoding="utf-8") as fh:
+        json.dump(search, fh, ensure_ascii=False)
+    num_files = sum(len(files) for files in report.files.values())
+    logger.info("Search      : {} files for {} modules".format(num_files, len(run_modules)))
+    logger.info("Search file : {}".format(os.path.relpath(path)))
+
+
+def load_search(paths):
+    """
+    Load the results of the search stage into the report, given the search file or the directory
+    it was written to. Returns the list of modules to run.
+    """
+    if len(paths) != 1:
+        raise ValueError("The parse stage takes one search file, from 'multiqc --stage search'")
+    path = paths[0]
+    if os.path.isdir(path):
+        path = os.path.join(path, search_fn)
+    with io.open(path, "r", encoding="utf-8") as fh:
+        search = json.load(fh)
+    if search["version"] != config.version:
+        logger.warning("Search file is from MultiQC v{}, running v{}".format(search["version"], config.version))
+    logger.info("Search file : {}".format(os.path.abspath(path)))
+    config.analysis_dir = search["analysis_dir"]
+    report.files = search["files"]
+    report.file_search_stats = search["file_search_stats"]
+    report.search_plan = search["search_plan"]
+    return search["run_modules"]
+
+
+##################################################
+#### PARSE
+
+
+def shard_modules(run_modules, shard_num, num_shards):
+    """
+    Indexes of the modules in a shard. Modules are spread over the shards by the number of
+    files found for them, so that each shard has about the same amount of work. A module that
+    is run more than once is always in one shard, so that later runs of it can pick different
+    HTML IDs and data file names to the earlier ones, as they would in a single run.
+    """
+    groups = dict()
+    for mod_idx, mod_dict in enumerate(run_modules):
+        groups.setdefault(module_name(mod_dict).lower(), list()).append(mod_idx)
+    num_files = dict()
+    for name, mod_idxs in groups.items():
+        found = sum(len(files) for key, files in report.files.items() if key.split("/")[0].lower() == name)
+        num_files[name] = (found + 1) * len(mod_idxs)
+    # Largest modules first, each to the shard with the fewest files so far
+    shards = [list() for _ in range(num_shards)]
+    shard_files = [0] * num_shards
+    for name in sorted(groups, key=lambda n: (-num_files[n], groups[n][0])):
+        idx = shard_files.index(min(shard_files))
+        shards[idx].extend(groups[name])
+        shard_files[idx] += num_files[name]
+    return sorted(shards[shard_num - 1])
+
+
+def run_shard(run_modules, shard):
+    """
+    Run the modules of a shard one after another, each with its own report state as in a module
+    worker (see module_pool.run_module()), and save their results in a shard directory.
+    Returns 1 if any module broke, 0 otherwise.
+    """
+    shard_num, num_shards = parse_shard(shard)
+    # Module results are pickled as by module workers, see module_pool.ResultPickler
+    if sys.version_info < (3, 8):
+        raise ValueError("The parse stage needs Python 3.8 or later")
+    shard_dir = os.path.join(config.output_dir, shard_dir_name.format(shard_num, num_shards))
+    if os.path.exists(shard_dir):
+        logger.warning("Deleting    : {}".format(os.path.relpath(shard_dir)))
+        shutil.rmtree(shard_dir)
+    os.makedirs(shard_dir)
+
+    mod_idxs = shard_modules(run_modules, shard_num, num_shards)
+    logger.info(
+        "Shard {} of {}: {}".format(
+            shard_num, num_shards, ", ".join(module_name(run_modules[i]) for i in mod_idxs) or "no modules"
+        )
+    )
+    results = dict()
+    sys_exit_code = 0
+    # Results of the modules run so far, whose HTML IDs and data file names the next modules can't use
+    earlier = report.ReportState()
+    for mod_idx in mod_idxs:
+        result = run_module(run_modules[mod_idx], os.path.join(shard_dir, str(mod_idx)), earlier)
+        loaded = pickle.loads(result)
+        if loaded["status"] == "no_samples":
+            logger.debug("No samples found: {}".format(module_name(run_modules[mod_idx])))
+        elif loaded["status"] == "limit":
+            logger.error(loaded["error"])
+            sys_exit_code = 1
+        elif loaded["status"] != "ok":
+            logger.error(
+                "Oops! The '{}' MultiQC module broke...\n{}".format(module_name(run_modules[mod_idx]), loaded["error"])
+            )
+            sys_exit_code = 1
+        if "state" in loaded:
+            earlier.merge(loaded["state"])
+        results[mod_idx] = result
+
+    shard_results = {
+        "version": config.version,
+        "shard": (shard_num, num_shards),
+        "analysis_dir": config.analysis_dir,
+        "run_modules": run_modules,
+        "results": results,
+    }
+    with io.open(os.path.join(shard_dir, shard_fn), "wb") as fh:
+        fh.write(dump_result(shard_results))
+    logger.info("Shard       : {}".format(os.path.relpath(shard_dir)))
+    # Keep the log of the shard with its results
+    config.data_dir = shard_dir
+    return sys_exit_code
+
+
+##################################################
+#### RENDER
+
+
+class ShardResults(object):
+    """
+    Results of the parse stage, from the shard directories of a run. Used in place of a
+    module_pool.ModulePool when rendering the report, with the same collect() method: the
+    results of each module are merged into the report in module order, as if the modules
+    had been run in this process.
+    """
+
+    def __init__(self, paths):
+        self.runtimes = dict()
+        self.peak_rss = dict()
+        self.run_modules = list()
+        self._results = dict()
+        self._dirs = dict()
+        shards = dict()
+        for shard_dir in self.find_shard_dirs(paths):
+            with io.open(os.path.join(shard_dir, shard_fn), "rb") as fh:
+                shard = pickle.load(fh)
+            if shard["version"] != config.version:
+                logger.warning("Shard {} is from MultiQC v{}".format(shard_dir, shard["version"]))
+            if self.run_modules and shard["run_modules"] != self.run_modules:
+                raise ValueError("Shard {} is not from the same search as the other shards".format(shard_dir))
+            logger.info("Shard       : {}".format(os.path.abspath(shard_dir)))
+            self.run_modules = shard["run_modules"]
+            config.analysis_dir = shard["analysis_dir"]
+            shards[shard["shard"]] = shard_dir
+            for mod_idx, result in shard["results"].items():
+                self._results[mod_idx] = pickle.loads(result)
+                self._dirs[mod_idx] = os.path.join(shard_dir, str(mod_idx))
+        if len(shards) == 0:
+            raise ValueError("No shards found in: {}".format(", ".join(paths)))
+        num_shards = {n for _, n in shards}
+        missing = [i for n in num_shards for i in range(1, n + 1) if (i, n) not in shards]
+        if len(num_shards) > 1 or missing:
+            logger.warning("Missing shards, the report will be incomplete: {}".format(missing or num_shards))
+        self.check_clashes()
+
+    def check_clashes(self):
+        """
+        Raise ValueError if modules in different shards used the same HTML IDs or data file names.
+        In a single run the later module would have picked other ones, so the report would be wrong.
+        """
+        merged = report.ReportState()
+        for mod_idx in sorted(self._results):
+            state = self._results[mod_idx].get("state")
+            if state is None:
+                continue
+            clashes = merged.clashes(state)
+            if clashes:
+                raise ValueError(
+                    "Results of module '{}' clash with those of earlier modules in other shards: {}. "
+                    "Run the parse stage with fewer shards.".format(
+                        module_name(self.run_modules[mod_idx]), ", ".join(clashes)
+                    )
+                )
+            merged.merge(state)
+
+    @staticmethod
+    def find_shard_dirs(paths):
+        """Shard directories, given the shard directories themselves or the directories with them"""
+        shard_dirs = list()
+        for path in paths:
+            if os.path.isfile(path):
+                path = os.path.dirname(path)
+            if os.path.isfile(os.path.join(path, shard_fn)):
+                shard_dirs.append(path)
+            else:
+                found = glob.glob(os.path.join(path, shard_dir_name.format("*", "*"), shard_fn))
+                shard_dirs.extend(sorted(os.path.dirname(fn) for fn in found))
+        return shard_dirs
+
+    def collect(self, mod_idx):
+        """
+        Merge the results of a module into the report. Returns the list of module output objects.
+        Raises UserWarning if the module found no samples or wasn't run by any of the shards,
+        and ModuleLimitExceeded if it went over its limits.
+        """
+        result = self._results.pop(mod_idx, None)
+        if result is None:
+            logger.warning("No results for module '{}' in any shard".format(module_name(self.run_modules[mod_idx])))
+            raise UserWarning
+        if result["status"] == "limit":
+            self.runtimes[mod_idx] = result["runtime"]
+            self.peak_rss[mod_idx] = result["peak_rss"]
+            raise ModuleLimitExceeded(result["error"])
+        if result["status"] not in ("ok", "no_samples"):
+            raise RuntimeError("Module broke when running the parse stage:\n{}".format(result["error"]))
+        report.state.merge(result["state"])
+        copy_output_files(self._dirs[mod_idx])
+        self.runtimes[mod_idx] = result["runtime"]
+        self.peak_rss[mod_idx] = result["peak_rss"]
+        if result["status"] == "no_samples":
+            raise UserWarning
+        return result["output"]
+
+    def shutdown(self, wait=True):
+        self._results.clear()
+
+
+def copy_output_files(out_dir):
+    """Copy the data files and plots of a module from a shard into the output directories"""
+    for sub_dir, dest_dir in [("data", config.data_dir), ("plots", config.plots_dir)]:
+        src_dir = os.path.join(out_dir, sub_dir)
+        if dest_dir is not None and os.path.isdir(src_dir):
+            util_functions.copy_tree(src_dir, dest_dir, preserve=False)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+""" MultiQC report template environment. Templates are loaded from where they are installed,
+with the files of a child template taking precedence over those of its parent template.
+The Jinja environment is kept for the rest of the process, so that templates are only compiled
+once when MultiQC is run many times, and compiled templates are cached on disk for later runs. """
+
+
+import os
+import shutil
+
+from . import config, util_functions
+
+logger = config.logger
+
+# Jinja environments, by template directories and bytecode cache directory
+_environments = dict()
+
+
+def template_dirs(template_mod):
+    """Directories of a template and its parent template, if it has one, child first"""
+    dirs = [template_mod.template_dir]
+    parent = getattr(template_mod, "template_parent", None)
+    if parent is not None:
+        dirs.append(config.avail_templates[parent].load().template_dir)
+    return dirs
+
+
+def template_file(dirs, name):
+    """Path of a template file, from the first template directory that has it"""
+    for d in dirs:
+        path = os.path.join(d, name)
+        if os.path.exists(path):
+            return path
+    return os.path.join(dirs[0], name)
+
+
+def bytecode_cache():
+    """Jinja bytecode cache, in config.template_cache_dir or a private directory in the system temp directory"""
+    import jinja2
+
+    if not config.template_bytecode_cache:
+        return None
+    if config.template_cache_dir:
+        os.makedirs(config.template_cache_dir, exist_ok=True)
+        return jinja2.FileSystemBytecodeCache(config.template_cache_dir)
+    try:
+        return jinja2.FileSystemBytecodeCache()
+    except RuntimeError as e:
+        logger.debug("Not caching compiled templates: {}".format(e))
+        return None
+
+
+def get_environment(dirs):
+    """Jinja environment that loads templates from the first of the template directories that has them"""
+    import jinja2
+
+    key = (tuple(dirs), config.template_bytecode_cache, config.template_cache_dir)
+    if key not in _environments:
+        _environments[key] = jinja2.Environment(
+            loader=jinja2.ChoiceLoader([jinja2.FileSystemLoader(d) for d in dirs]),
+            bytecode_cache=bytecode_cache(),
+        )
+    return _environments[key]
+
+
+def copy_template_files(dirs, name, dest):
+    """Copy a file or directory from the template directories, merging them with the child template files on top"""
+    for d in reversed(dirs):
+        path = os.path.join(d, name)
+        if os.path.isdir(path):
+            util_functions.copy_tree(path, dest)
+        elif os.path.exists(path):
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copy2(path, dest)
@@ -40,6 +40,55 @@ def robust_rmtree(path, logger=None, max_retries=10):
     shutil.rmtree(path)
 
 
+def copy_tree(src, dst, preserve=True):
+    """Copy a directory recursively, merging into and overwriting files in `dst` if it exists.
+    Symlinks are followed. With `preserve`, file modes and times are copied too. Used instead of
+    distutils.dir_util.copy_tree(), as distutils is slow to import and removed in Python 3.12.
+    """
+    os.makedirs(dst, exist_ok=True)
+    for name in os.listdir(src):
+        src_path = os.path.join(src, name)
+        dst_path = os.path.join(dst, name)
+        if os.path.isdir(src_path):
+            copy_tree(src_path, dst_path, preserve)
+        elif preserve:
+            shutil.copy2(src_path, dst_path)
+        else:
+            shutil.copyfile(src_path, dst_path)
+
+
+# matplotlib.pyplot, imported by get_pyplot() the first time it is needed
+_pyplot = None
+_pyplot_error = None
+
+
+def get_pyplot():
+    """Import and return matplotlib.pyplot, for flat plots.
+    Raises ImportError if MatPlotLib can't be loaded, printing an error message the first time.
+    """
+    global _pyplot, _pyplot_error
+    if _pyplot is None and _pyplot_error is None:
+        try:
+            # Import matplot lib but avoid default X environment
+            import matplotlib
+
+            matplotlib.use("Agg")
+            import matplotlib.pyplot as plt
+
+            config.logger.debug("Using matplotlib version {}".format(matplotlib.__version__))
+            _pyplot = plt
+        except Exception as e:
+            # MatPlotLib can break in a variety of ways. Fake an error message and continue without it if so.
+            # The lack of the library is handled where plots are attempted
+            print("##### ERROR! MatPlotLib library could not be loaded!    #####", file=sys.stderr)
+            print("##### Flat plots will instead be plotted as interactive #####", file=sys.stderr)
+            print(e)
+            _pyplot_error = e
+    if _pyplot is None:
+        raise ImportError("MatPlotLib could not be loaded: {}".format(_pyplot_error))
+    return _pyplot
+
+
 def write_data_file(data, fn, sort_cols=False, data_format=None):
     """Write a data file to the report directory. Will not do anything
     if config.data_dir is not set.
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+""" MultiQC module watchdog. Measures the peak memory use of each module, and stops
+modules that run for too long or use too much memory, so that a single pathological
+input file can't stall the whole report. """
+
+
+import os
+import signal
+import threading
+import time
+
+from . import config
+
+logger = config.logger
+
+# Seconds between memory checks, and between repeated signals once a limit is exceeded
+CHECK_INTERVAL = 0.1
+REPEAT_INTERVAL = 1.0
+
+
+class ModuleLimitExceeded(Exception):
+    """Raised in a running module when it goes over its time or memory limit"""
+
+
+def module_limits(mod_cust_config):
+    """
+    Time limit (seconds) and memory limit (MB of RSS) for a module, from its
+    config.module_order entry or the config.module_time_limit / config.module_memory_limit defaults
+    """
+    mod_cust_config = mod_cust_config or {}
+    return {
+        "time_limit": mod_cust_config.get("time_limit", config.module_time_limit),
+        "memory_limit": mod_cust_config.get("memory_limit", config.module_memory_limit),
+    }
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None if it can't be read"""
+    try:
+        with open("/proc/self/statm", "rb") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes since the last reset_peak_rss(), or None if unknown"""
+    try:
+        with open("/proc/self/status", "rb") as fh:
+            for line in fh:
+                if line.startswith(b"VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def memory_status():
+    """Current and peak resident set size of this process in bytes, as a tuple, or (None, None) if unknown"""
+    rss = hwm = None
+    try:
+        with open("/proc/self/status", "rb") as fh:
+            for line in fh:
+                if line.startswith(b"VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith(b"VmHWM:"):
+                    hwm = int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return rss, hwm
+
+
+def reset_peak_rss():
+    """Reset the peak resident set size of this process to the current size. Returns False if not possible"""
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+        return True
+    except (IOError, OSError):
+        return False
+
+
+class ModuleWatchdog(object):
+    """
+    Context manager to run a module with a time limit and a memory limit. When the module goes
+    over a limit, ModuleLimitExceeded is raised in the thread running it, using SIGALRM - so
+    limits can only be enforced in the main thread, on systems with SIGALRM. The signal is
+    repeated every REPEAT_INTERVAL seconds, in case the module catches the exception.
+    Memory use is checked every CHECK_INTERVAL seconds by a separate thread.
+
+    The peak RSS of the process while the module ran is in `peak_rss` (bytes) afterwards. It is only
+    measured with a memory limit or `config.profile_runtime`, as it resets the peak RSS of the process.
+    """
+
+    def __init__(self, name, time_limit=None, memory_limit=None):
+        self.name = name
+        self.time_limit = float(time_limit) if time_limit else None
+        self.memory_limit = int(float(memory_limit) * 1024 * 1024) if memory_limit else None
+        self.peak_rss = None
+        self.measure_memory = self.memory_limit is not None or config.profile_runtime
+        self.exceeded = None
+        self._active = False
+        self._enforce = False
+        self._peak_reset = False
+        self._sampled_peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._old_handler = None
+
+    def __enter__(self):
+        self._start = time.time()
+        if self.measure_memory:
+            self._peak_reset = reset_peak_rss()
+            self._sampled_peak = current_rss() or 0
+        if self.time_limit or self.memory_limit:
+            if hasattr(signal, "SIGALRM") and threading.current_thread() is threading.main_thread():
+                self._enforce = True
+                self._old_handler = signal.signal(signal.SIGALRM, self._on_alarm)
+                if self.time_limit:
+                    signal.setitimer(signal.ITIMER_REAL, self.time_limit, REPEAT_INTERVAL)
+            else:
+                logger.debug("{}: Can't enforce module time and memory limits here".format(self.name))
+        self._active = True
+        # Without a resettable peak, the peak RSS of the module is sampled instead
+        if self.memory_limit or (self.measure_memory and not self._peak_reset):
+            self._thread = threading.Thread(target=self._watch, name="multiqc-watchdog", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._active = False
+        if self._enforce:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._enforce:
+            signal.signal(signal.SIGALRM, self._old_handler)
+        if self.measure_memory:
+            peak = peak_rss() if self._peak_reset else None
+            self.peak_rss = max(peak or 0, self._sampled_peak, current_rss() or 0) or None
+        return False
+
+    def _watch(self):
+        """Sample the RSS of the process until the module finishes, signalling if over the memory limit"""
+        last_signal = 0
+        while not self._stop.wait(CHECK_INTERVAL):
+            rss = current_rss()
+            if rss is None:
+                return
+            self._sampled_peak = max(self._sampled_peak, rss)
+            if self.memory_limit and self._enforce and rss > self.memory_limit:
+                if self.exceeded is None:
+                    self.exceeded = "memory"
+                if time.time() - last_signal >= REPEAT_INTERVAL:
+                    last_signal = time.time()
+                    signal.pthread_kill(threading.main_thread().ident, signal.SIGALRM)
+
+    def _on_alarm(self, signum, frame):
+        if not self._active:
+            return
+        if self.exceeded is None:
+            self.exceeded = "time"
+        if self.exceeded == "memory":
+            raise ModuleLimitExceeded(
+                "The '{}' module used more than the memory limit of {:.0f} MB".format(
+                    self.name, self.memory_limit / 1024 / 1024
+                )
+            )
+        raise ModuleLimitExceeded(
+            "The '{}' module ran for longer than the time limit of {:g} seconds".format(self.name, self.time_limit)
+        )
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+""" Benchmarks the compression of the report plot data (report.compress_json()) with each
+of the codecs in config.plot_data_codec, on made up plot data for different numbers of samples.
+Prints the time taken, the increase in peak memory use (on Linux) and the size of the compressed
+data that goes into the HTML report.
+
+With --per-plot, also compares compressing the data of each plot separately (config.lazy_plot_data),
+and if node is installed, the time the browser takes to decompress the data of the first plot
+and of all plots. """
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+from multiqc.utils import config, report
+from multiqc.utils.watchdog import current_rss, peak_rss, reset_peak_rss
+
+parser = argparse.ArgumentParser(description="Benchmarks the codecs used to compress the report plot data")
+parser.add_argument(
+    "--samples", type=int, nargs="+", default=[100, 1000, 3000], help="Numbers of samples (default: 100 1000 3000)"
+)
+parser.add_argument(
+    "--codecs", nargs="+", default=report.plot_data_codecs, help="Codecs to compare (default: zlib lzstring)"
+)
+parser.add_argument("--levels", type=int, nargs="+", default=[1, 6, 9], help="zlib compression levels (default: 1 6 9)")
+parser.add_argument(
+    "--max-lzstring-samples",
+    type=int,
+    default=1000,
+    help="Largest number of samples to use lzstring for, as it is very slow (default: 1000)",
+)
+parser.add_argument(
+    "--per-plot", action="store_true", help="Also compress the data of each plot separately, as with lazy_plot_data"
+)
+args = parser.parse_args()
+
+# Decompresses plot data with the report JavaScript, printing the times taken in ms as JSON
+DECOMPRESS_JS = """
+const fs = require("fs");
+const vm = require("vm");
+const [js_fn, data_fn, codec] = process.argv.slice(2);
+const ctx = { atob: (s) => Buffer.from(s, "base64").toString("latin1"), TextDecoder, Uint8Array, Uint16Array };
+vm.createContext(ctx);
+vm.runInContext(fs.readFileSync(js_fn, "utf8"), ctx);
+const blobs = JSON.parse(fs.readFileSync(data_fn, "utf8"));
+const times = [];
+let start = process.hrtime.bigint();
+for (const blob of blobs) {
+  JSON.parse(ctx.mqc_decompress(blob, codec));
+  times.push(Number(process.hrtime.bigint() - start) / 1e6);
+}
+console.log(JSON.stringify({ first: times[0], all: times[times.length - 1] }));
+"""
+
+
+def plot_data(num_samples):
+    """Plot data of a typical report: a few bar graphs, line graphs and a heatmap"""
+    random.seed(num_samples)
+    s_names = ["SAMPLE_{:05d}_L001_R1".format(i) for i in range(num_samples)]
+    data = dict()
+    for p in range(4):
+        cats = ["Category {}".format(c) for c in range(6)]
+        data["bargraph_{}".format(p)] = {
+            "plot_type": "bar_graph",
+            "samples": [s_names],
+            # Missing values, as some modules have
+            "datasets": [
+                [{"name": c, "data": [random.randint(0, 10**7) for _ in s_names[1:]] + [float("nan")]} for c in cats]
+            ],
+            "config": {"id": "bargraph_{}".format(p), "title": "Bar graph {}".format(p)},
+        }
+    for p in range(4):
+        data["linegraph_{}".format(p)] = {
+            "plot_type": "xy_line",
+            "datasets": [
+                [{"name": s, "data": [[x, round(random.gauss(30, 5), 2)] for x in range(1, 151)]} for s in s_names]
+            ],
+            "config": {"id": "linegraph_{}".format(p), "title": "Line graph {}".format(p)},
+        }
+    heatmap_samples = s_names[:200]
+    data["heatmap"] = {
+        "plot_type": "heatmap",
+        "data": [
+            [x, y, round(random.random(), 3)] for x in range(len(heatmap_samples)) for y in range(len(heatmap_samples))
+        ],
+        "xcats": heatmap_samples,
+        "ycats": heatmap_samples,
+        "config": {"id": "heatmap", "title": "Heatmap"},
+    }
+    return data
+
+
+def measure(func, *args):
+    """Run a function. Returns its result, the time taken and the increase in peak memory use (MB, if known)"""
+    rss_before = current_rss() if reset_peak_rss() else None
+    start = time.time()
+    result = func(*args)
+    runtime = time.time() - start
+    peak = peak_rss()
+    extra_rss = (peak - rss_before) / 1e6 if rss_before is not None and peak is not None else float("nan")
+    return result, runtime, extra_rss
+
+
+def browser_times(blobs, codec):
+    """Time to decompress the first and all of the compressed blobs in node (ms), or None if node isn't installed
+    or the codec is not zlib"""
+    node = shutil.which("node")
+    if node is None or codec != "zlib":
+        return None
+    js_fn = os.path.join(config.MULTIQC_DIR, "templates", "default", "assets", "js", "multiqc_inflate.js")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        script_fn = os.path.join(tmp_dir, "decompress.js")
+        data_fn = os.path.join(tmp_dir, "data.json")
+        with open(script_fn, "w") as fh:
+            fh.write(DECOMPRESS_JS)
+        with open(data_fn, "w") as fh:
+            json.dump(blobs, fh)
+        output = subprocess.check_output([node, script_fn, js_fn, data_fn, codec])
+    return json.loads(output)
+
+
+def browser_cell(times):
+    """Decompression times for the table"""
+    return "" if times is None else "{:.0f} / {:.0f}".format(times["first"], times["all"])
+
+
+row = "{:>8}  {:>10}  {:<18}  {:>10}  {:>12}  {:>6}  {:>14}" + ("  {:>20}" if args.per_plot else "")
+header = ["Samples", "JSON (MB)", "Codec", "Time (s)", "Output (MB)", "Ratio", "Peak mem (MB)"]
+if args.per_plot:
+    header.append("Browser first/all (ms)")
+print(row.format(*header))
+for num_samples in args.samples:
+    data = plot_data(num_samples)
+    # Converting to JSON is part of compress_json(), whatever the codec
+    json_size, runtime, extra_rss = measure(lambda d: sum(len(c) for c in report.json_chunks(d)), data)
+    print(
+        row.format(
+            num_samples,
+            "{:.1f}".format(json_size / 1e6),
+            "(JSON only)",
+            "{:.2f}".format(runtime),
+            "",
+            "",
+            "{:.0f}".format(extra_rss),
+            "",
+        )
+    )
+    for codec in args.codecs:
+        if codec == "lzstring" and num_samples > args.max_lzstring_samples:
+            continue
+        for level in args.levels if codec == "zlib" else [None]:
+            config.plot_data_codec = codec
+            if level is not None:
+                config.plot_data_compression_level = level
+            name = codec if level is None else "{} ({})".format(codec, level)
+            compressed, runtime, extra_rss = measure(report.compress_json, data)
+            blobs = [compressed]
+            print(
+                row.format(
+                    num_samples,
+                    "{:.1f}".format(json_size / 1e6),
+                    name,
+                    "{:.2f}".format(runtime),
+                    "{:.2f}".format(len(compressed) / 1e6),
+                    "{:.1f}".format(json_size / len(compressed)),
+                    "{:.0f}".format(extra_rss),
+                    browser_cell(browser_times(blobs, codec)) if args.per_plot else "",
+                )
+            )
+            if not args.per_plot:
+                continue
+            compressed, runtime, extra_rss = measure(report.compress_plot_data, data)
+            blobs = list(compressed.values())
+            output_size = sum(len(b) for b in blobs)
+            print(
+                row.format(
+                    num_samples,
+                    "{:.1f}".format(json_size / 1e6),
+                    name + " per plot",
+                    "{:.2f}".format(runtime),
+                    "{:.2f}".format(output_size / 1e6),
+                    "{:.1f}".format(json_size / output_size),
+                    "{:.0f}".format(extra_rss),
+                    browser_cell(browser_times(blobs, codec)),
+                )
+            )
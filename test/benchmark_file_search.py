@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+
+""" Benchmarks the file search (report.get_filelist()) on a made up directory tree, with
+the search patterns of all modules. The search indexes the search patterns by filename and
+reads each file once (see SearchPatternIndex and FileContents). It is compared with a loop
+testing every file against every search pattern, opening the file again for each pattern.
+
+Then benchmarks the steps that use the compiled regex registry (regex_cache.py), against
+how they were done before: matching the filenames with the `fn_re` search patterns, searching
+the text files with the `contents_re` search patterns (one file read and a combined prefilter
+regex, against reading the file for each regex) and cleaning the filenames with clean_s_name().
+
+Prints the time taken, the increase in peak memory use (on Linux), the number of files or
+matches found and whether the result is the same as before.
+
+The tree has a directory per sample, with files named after the `fn` globs of the search
+patterns (with their `contents`), some files found by `fn_re` and `contents_re` patterns,
+and unrelated logs, binary files and images. It is written
+to a temporary directory, or to --tree, where it is kept and reused by later runs. """
+
+import argparse
+import copy
+import io
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+
+from multiqc.modules.base_module import BaseMultiqcModule
+from multiqc.utils import config, file_walker, regex_cache, report
+from multiqc.utils.report import FileContents
+from multiqc.utils.watchdog import current_rss, peak_rss, reset_peak_rss
+
+parser = argparse.ArgumentParser(description="Benchmarks the file search on a made up directory tree")
+parser.add_argument("--files", type=int, default=100000, help="Number of files in the tree (default: 100000)")
+parser.add_argument("--files-per-sample", type=int, default=20, help="Number of files per sample (default: 20)")
+parser.add_argument("--tree", help="Directory to write the tree to and keep, or to reuse if it exists")
+parser.add_argument(
+    "--contents-files", type=int, default=2000, help="Number of text files to search with contents_re (default: 2000)"
+)
+parser.add_argument("--skip-before", action="store_true", help="Don't run the slow ways as before, to compare with")
+args = parser.parse_args()
+
+WORDS = ["sample", "reads", "mapped", "total", "0.5", "123", "QC", "PASS", "version", "=", "\t", ":"]
+
+# Files found by the `fn_re` and `contents_re` search patterns, with their first line
+REGEX_EXAMPLES = [
+    ("*_mqc.tsv", "Sample\tValue"),
+    ("*.wgs_coverage_metrics_tumor.csv", "COVERAGE SUMMARY,,Aligned bases,100"),
+    ("*.qc-coverage-region-1_coverage_metrics.csv", "COVERAGE SUMMARY,,Aligned bases,100"),
+    ("*_kaiju.txt", "file\tpercent\treads\ttaxon_id\ttaxon_name"),
+    ("*_kraken.report", " 12.50\t100\t100\tU\t0\tunclassified"),
+    ("*_sickle.log", "FastQ paired records kept: 1000 (500 pairs)"),
+    ("*.NanoStats.txt", "General summary:"),
+    ("*.quality_by_cycle_metrics", "# picard.analysis.MeanQualityByCycle MEAN_QUALITY"),
+]
+
+
+def search_patterns():
+    """All search patterns of all modules"""
+    return [sp for sps in config.sp.values() for sp in (sps if isinstance(sps, list) else [sps])]
+
+
+def file_templates():
+    """Filenames (with `*` for the sample name) and contents of files that search patterns look for"""
+    templates = list()
+    for sp in search_patterns():
+        if not isinstance(sp.get("fn"), str) or "[" in sp["fn"] or "contents_re" in sp:
+            continue
+        contents = sp.get("contents") if isinstance(sp.get("contents"), str) else ""
+        templates.append((sp["fn"].replace("?", "x"), contents))
+    return templates
+
+
+def make_tree(root, num_files, files_per_sample):
+    """Write a tree of made up files, half found by search patterns and half not"""
+    rng = random.Random(1)
+    templates = file_templates()
+    for i in range(num_files):
+        s_name = "SAMPLE_{:05d}_S{}_L001_R1_001".format(i // files_per_sample, i // files_per_sample % 96 + 1)
+        s_dir = os.path.join(root, "{:03d}".format(i // (files_per_sample * 100)), s_name)
+        if i % files_per_sample == 0:
+            os.makedirs(s_dir, exist_ok=True)
+        lines = [" ".join(rng.choice(WORDS) for _ in range(8)) for _ in range(rng.randint(5, 50))]
+        kind = i % 10
+        if kind == 0:
+            fn_glob, first_line = rng.choice(REGEX_EXAMPLES)
+            fn = fn_glob.replace("*", s_name)
+            lines.insert(0, first_line)
+        elif kind < 5:
+            fn_glob, contents = rng.choice(templates)
+            fn = fn_glob.replace("*", s_name, 1).replace("*", "")
+            lines.insert(rng.randint(0, 3), contents)
+        elif kind < 8:
+            fn = "{}_run_{}.{}".format(s_name, i, rng.choice(["log", "txt", "out", "tsv"]))
+        elif kind == 8:
+            fn = "{}_{}.bin".format(s_name, i)
+            lines = None
+        else:
+            fn = "{}_{}.png".format(s_name, i)
+            lines = None
+        with open(os.path.join(s_dir, os.path.basename(fn)), "wb") as fh:
+            if lines is None:
+                fh.write(bytes(rng.getrandbits(8) for _ in range(512)))
+            else:
+                fh.write("\n".join(lines).encode("utf-8"))
+
+
+def measure(func, *args):
+    """Run a function. Returns its result, the time taken and the increase in peak memory use (MB, if known)"""
+    rss_before = current_rss() if reset_peak_rss() else None
+    start = time.time()
+    result = func(*args)
+    runtime = time.time() - start
+    peak = peak_rss()
+    extra_rss = (peak - rss_before) / 1e6 if rss_before is not None and peak is not None else float("nan")
+    return result, runtime, extra_rss
+
+
+def found_files(files):
+    """Files found for each search key, to compare the results"""
+    return {key: [(f["root"], f["fn"]) for f in fs] for key, fs in files.items() if len(fs) > 0}
+
+
+def indexed_search():
+    """The file search as MultiQC runs it"""
+    report.init()
+    report.get_filelist(list(config.avail_modules))
+    return found_files(report.files)
+
+
+def search_pattern_groups():
+    """Search patterns of all modules, grouped in the order that get_filelist() tests them"""
+    spatterns = [dict() for _ in range(7)]
+    for key, sps in config.sp.items():
+        sps = sps if isinstance(sps, list) else [sps]
+        offset = 4 if any("contents_re" in sp for sp in sps) else 1 if any("contents" in sp for sp in sps) else None
+        if offset is None:
+            spatterns[0][key] = sps
+        elif any("num_lines" in sp for sp in sps):
+            spatterns[offset][key] = sps
+        elif any("max_filesize" in sp for sp in sps):
+            spatterns[offset + 1][key] = sps
+        else:
+            spatterns[offset + 2][key] = sps
+    return spatterns
+
+
+def loop_search():
+    """Test every file against every search pattern, reading the file for each pattern that needs its contents"""
+    spatterns = search_pattern_groups()
+    files = defaultdict(list)
+    searchfiles, _ = file_walker.walk_analysis_paths(config.analysis_dir)
+    for fn, root, st in searchfiles:
+        f = {"fn": fn, "root": root}
+        if st is not None:
+            f["filesize"] = st.st_size
+        stats = defaultdict(int)
+        done = False
+        for patterns in spatterns:
+            for key, sps in patterns.items():
+                for sp in sps:
+                    if report.search_file(sp, f, key, stats=stats):
+                        if not report.exclude_file(sp, f):
+                            files[key].append(f)
+                        done = not sp.get("shared", False)
+                        break
+                if done:
+                    break
+            if done:
+                break
+    return found_files(files)
+
+
+def fn_re_patterns():
+    """All `fn_re` regexes of the search patterns"""
+    patterns = [sp["fn_re"] for sp in search_patterns() if "fn_re" in sp]
+    return [p for ps in patterns for p in (ps if isinstance(ps, list) else [ps])]
+
+
+def contents_re_patterns():
+    """All `contents_re` regexes of the search patterns, with their `num_lines`"""
+    return [(sp["contents_re"], sp.get("num_lines")) for sp in search_patterns() if "contents_re" in sp]
+
+
+def match_fn_re(names, compiled):
+    """Filenames matching each fn_re regex, with the compiled regex registry or the re module"""
+    matches = list()
+    for pattern in fn_re_patterns():
+        regex = regex_cache.get(pattern) if compiled else None
+        for fn in names:
+            if (regex.match(fn) if compiled else re.match(pattern, fn)) is not None:
+                matches.append((pattern, fn))
+    return matches
+
+
+def search_contents_re(paths):
+    """Files matching each contents_re regex, reading each file once with a prefilter regex"""
+    patterns = contents_re_patterns()
+    prefilter = report.build_contents_re_prefilter([p for p, _ in patterns])
+    matches = list()
+    for path in paths:
+        contents = FileContents(path, prefilter=prefilter)
+        matches.extend((pattern, path) for pattern, num_lines in patterns if contents.search(pattern, num_lines))
+    return sorted(matches)
+
+
+def search_contents_re_before(paths):
+    """Files matching each contents_re regex, reading each file line by line for each regex"""
+    matches = list()
+    for pattern, num_lines in contents_re_patterns():
+        repattern = re.compile(pattern)
+        for path in paths:
+            try:
+                with io.open(path, "r", encoding="utf-8") as fh:
+                    for l, line in enumerate(fh, start=1):
+                        if re.search(repattern, line):
+                            matches.append((pattern, path))
+                            break
+                        if num_lines and l >= num_lines:
+                            break
+            except (IOError, OSError, ValueError, UnicodeDecodeError):
+                pass
+    return sorted(matches)
+
+
+def clean_s_names(module, names):
+    """Sample names cleaned by clean_s_name()"""
+    return [module.clean_s_name(fn) for fn in names]
+
+
+def clean_s_names_before(module, names):
+    """Sample names cleaned as clean_s_name() did before the regex registry, without prepend_dirs or replace_names"""
+    clean_exts = copy.deepcopy(config.fn_clean_exts)
+    s_names = list()
+    for s_name_original in names:
+        s_name = os.path.basename(s_name_original)
+        for ext in clean_exts:
+            if "module" in ext:
+                if type(ext["module"]) is str:
+                    ext["module"] = [ext["module"]]
+                if not any([m == module.anchor for m in ext["module"]]):
+                    continue
+            if type(ext) is str:
+                ext = {"type": "truncate", "pattern": ext}
+            if ext.get("type") == "truncate":
+                s_name = s_name.split(ext["pattern"], 1)[0]
+            elif ext.get("type") in ("remove", "replace"):
+                s_name = s_name.replace(ext["pattern"], "")
+            elif ext.get("type") == "regex":
+                s_name = re.sub(ext["pattern"], "", s_name)
+            elif ext.get("type") == "regex_keep":
+                match = re.search(ext["pattern"], s_name)
+                s_name = match.group() if match else s_name
+        for chrs in config.fn_clean_trim:
+            if s_name.endswith(chrs):
+                s_name = s_name[: -len(chrs)]
+            if s_name.startswith(chrs):
+                s_name = s_name[len(chrs) :]
+        s_name = s_name.strip()
+        s_names.append(s_name if s_name != "" else s_name_original)
+    return s_names
+
+
+row = "{:<34}  {:>8}  {:>8}  {:>10}  {:>14}  {:>6}"
+
+
+def compare(name, num_items, now, before, count=len):
+    """Run a benchmark now and as before, and print a row for each"""
+    result, runtime, extra_rss = measure(*now)
+    print(row.format(name, num_items, count(result), "{:.2f}".format(runtime), "{:.0f}".format(extra_rss), ""))
+    if args.skip_before:
+        return
+    result_before, runtime, extra_rss = measure(*before)
+    same = "yes" if result_before == result else "NO"
+    print(
+        row.format(
+            "  before", num_items, count(result_before), "{:.2f}".format(runtime), "{:.0f}".format(extra_rss), same
+        )
+    )
+
+
+config.quiet = True
+config.search_workers = 1
+config.search_cache = None
+tree_dir = args.tree if args.tree is not None else tempfile.mkdtemp(prefix="multiqc_benchmark_")
+try:
+    if not os.path.isdir(tree_dir) or len(os.listdir(tree_dir)) == 0:
+        _, runtime, _ = measure(make_tree, tree_dir, args.files, args.files_per_sample)
+        print("Made {} files in {:.1f}s: {}".format(args.files, runtime, tree_dir))
+    config.analysis_dir = [tree_dir]
+    searchfiles, _ = file_walker.walk_analysis_paths(config.analysis_dir)
+    names = [fn for fn, _, _ in searchfiles]
+    text_paths = [os.path.join(root, fn) for fn, root, _ in searchfiles if not fn.endswith((".bin", ".png"))]
+    text_paths = text_paths[: args.contents_files]
+
+    print(row.format("Benchmark", "Items", "Found", "Time (s)", "Peak mem (MB)", "Same"))
+    num_found = lambda files: sum(len(fs) for fs in files.values())
+    compare("File search", len(names), (indexed_search,), (loop_search,), count=num_found)
+    compare("fn_re filename matches", len(names), (match_fn_re, names, True), (match_fn_re, names, False))
+    compare(
+        "contents_re file matches",
+        len(text_paths),
+        (search_contents_re, text_paths),
+        (search_contents_re_before, text_paths),
+    )
+    module = BaseMultiqcModule(name="Benchmark", anchor="benchmark")
+    compare(
+        "clean_s_name() sample names",
+        len(names),
+        (clean_s_names, module, names),
+        (clean_s_names_before, module, names),
+        count=lambda s_names: len(set(s_names)),
+    )
+finally:
+    if args.tree is None:
+        shutil.rmtree(tree_dir, ignore_errors=True)
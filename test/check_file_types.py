@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+""" Checks that the file search counts the files it opens by type (`file_type_*` in
+report.file_search_stats), including binary and compressed files that aren't searched as text. """
+
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+
+from multiqc.utils import config, report
+
+# Files of each type, with names that don't rule them out before they are opened
+FILES = {
+    "text.txt": b"Some text\n",
+    "gzip.txt": gzip.compress(b"Some text\n"),
+    "zip.txt": None,
+    "image.dat": b"\x89PNG\r\n\x1a\n" + b"\x00" * 100,
+    "binary.dat": bytes(range(256)) * 4,
+}
+EXPECTED = {"file_type_text": 1, "file_type_gzip": 1, "file_type_zip": 1, "file_type_image": 1, "file_type_binary": 1}
+
+tmp_dir = tempfile.mkdtemp(prefix="multiqc_check_")
+try:
+    for fn, contents in FILES.items():
+        if fn == "zip.txt":
+            with zipfile.ZipFile(os.path.join(tmp_dir, fn), "w") as zf:
+                zf.writestr("text.txt", "Some text\n")
+        else:
+            with open(os.path.join(tmp_dir, fn), "wb") as fh:
+                fh.write(contents)
+    config.analysis_dir = [tmp_dir]
+    report.get_filelist(list(config.avail_modules))
+finally:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+counts = {k: v for k, v in report.file_search_stats.items() if k.startswith("file_type_") and v}
+print("File types: {}".format(counts))
+errors = ["{}: {}, expected {}".format(k, counts.get(k, 0), v) for k, v in EXPECTED.items() if counts.get(k, 0) != v]
+for error in errors:
+    print("ERROR: {}".format(error))
+print("File type counts: {}".format("FAILED" if errors else "OK"))
+sys.exit(1 if errors else 0)
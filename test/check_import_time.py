@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+""" Checks that importing MultiQC doesn't import slow libraries that should only be imported
+when they are used, and prints the slowest imports using `python -X importtime`.
+Import times depend on the machine, so they are only checked against a time budget when
+one is given with --budget (on Python 3.7 or later). """
+
+import argparse
+import re
+import subprocess
+import sys
+
+# Slow to import libraries, that MultiQC should only import when they are used
+LAZY_IMPORTS = [
+    "distutils",
+    "jinja2",
+    "lzstring",
+    "matplotlib",
+    "multiqc.plots.table",
+    "numpy",
+    "pkg_resources",
+    "requests",
+]
+
+# MultiQC needs pkg_resources to find its plugins without importlib.metadata
+if sys.version_info < (3, 8):
+    LAZY_IMPORTS.remove("pkg_resources")
+
+parser = argparse.ArgumentParser(description="Checks which libraries are imported along with MultiQC")
+parser.add_argument("--module", default="multiqc.multiqc", help="Module to import (default: multiqc.multiqc)")
+parser.add_argument("--repeats", type=int, default=5, help="Number of times to import, the fastest is printed")
+parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to print")
+parser.add_argument("--budget", type=float, help="Maximum import time in seconds (default: not checked)")
+args = parser.parse_args()
+
+
+def imported_modules(module):
+    """Names of all modules imported along with a module, in a new interpreter"""
+    proc = subprocess.run(
+        [sys.executable, "-c", "import sys, {}; print('\\n'.join(sys.modules))".format(module)],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    return proc.stdout.splitlines()
+
+
+def import_times(module):
+    """Import a module in a new interpreter. Returns a dict of self and cumulative microseconds per module"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = dict()
+    for line in proc.stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+        if m:
+            times[m.group(4)] = (int(m.group(1)), int(m.group(2)), len(m.group(3)))
+    return times
+
+
+def total_time(times):
+    """Cumulative seconds of the top-level imports after interpreter startup (which ends with `site`)"""
+    names = list(times)
+    start = names.index("site") + 1 if "site" in names else 0
+    return sum(times[name][1] for name in names[start:] if times[name][2] == 1) / 1e6
+
+
+errors = list()
+
+# `python -X importtime` is new in Python 3.7, and silently does nothing before
+if sys.version_info < (3, 7):
+    print("Skipping import times: `python -X importtime` needs Python 3.7 or later")
+else:
+    runs = [import_times(args.module) for _ in range(args.repeats)]
+    totals = [total_time(run) for run in runs]
+    fastest = runs[totals.index(min(totals))]
+    print("Slowest imports (cumulative):")
+    for name, (_, cumulative, _) in sorted(fastest.items(), key=lambda x: -x[1][1])[: args.top]:
+        print("  {:>8.1f} ms  {}".format(cumulative / 1e3, name))
+    budget = "" if args.budget is None else ", budget {:.3f}s".format(args.budget)
+    print("Import time of {}: {:.3f}s (fastest of {}{})".format(args.module, min(totals), args.repeats, budget))
+    if args.budget is not None and min(totals) > args.budget:
+        errors.append("Import takes longer than the budget of {:.3f}s".format(args.budget))
+
+modules = imported_modules(args.module)
+lazy = [name for name in LAZY_IMPORTS if any(m == name or m.startswith(name + ".") for m in modules)]
+if lazy:
+    errors.append("Imported at startup, should be imported when needed: {}".format(", ".join(lazy)))
+else:
+    print("No slow libraries imported at startup")
+for error in errors:
+    print("ERROR: {}".format(error))
+sys.exit(1 if errors else 0)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+""" Checks that the report JavaScript (multiqc_inflate.js) decompresses zlib data the same as
+Python's zlib, for streams with stored, fixed and dynamic Huffman blocks, and mixes of them.
+Needs node. The plot data JSON rarely gives stored blocks, but the decoder has to handle them. """
+
+import base64
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import zlib
+
+from multiqc.utils import config, report
+
+# Decompresses base64 zlib streams with the report JavaScript, printing the output as base64
+INFLATE_JS = """
+const fs = require("fs");
+const vm = require("vm");
+const [js_fn, data_fn] = process.argv.slice(2);
+const ctx = { atob: (s) => Buffer.from(s, "base64").toString("latin1"), TextDecoder, Uint8Array, Uint16Array };
+vm.createContext(ctx);
+vm.runInContext(fs.readFileSync(js_fn, "utf8"), ctx);
+const results = {};
+for (const [name, data] of Object.entries(JSON.parse(fs.readFileSync(data_fn, "utf8")))) {
+  try {
+    if (name.startsWith("plot data")) {
+      results[name] = Buffer.from(ctx.mqc_decompress(data, "zlib"), "utf8").toString("base64");
+    } else {
+      results[name] = Buffer.from(ctx.mqc_inflate(new Uint8Array(Buffer.from(data, "base64")))).toString("base64");
+    }
+  } catch (e) {
+    results[name] = "ERROR: " + e.message;
+  }
+}
+console.log(JSON.stringify(results));
+"""
+
+rng = random.Random(1)
+
+
+def text(size):
+    """Compressible text, like the plot data JSON"""
+    words = ["sample", "reads", "mapped", "0.5", "123", '"data": [', "], ", "{", "}"]
+    return "".join(rng.choice(words) for _ in range(size // 5)).encode("ascii")[:size]
+
+
+def noise(size):
+    """Random bytes, which deflate stores uncompressed"""
+    return bytes(rng.getrandbits(8) for _ in range(size))
+
+
+def compress(chunks, level=6, strategy=zlib.Z_DEFAULT_STRATEGY, flush=None):
+    """zlib stream of some chunks of data, optionally flushed after each chunk (sync flushes add empty stored blocks)"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, 8, strategy)
+    out = list()
+    for chunk in chunks:
+        out.append(compressor.compress(chunk))
+        if flush is not None:
+            out.append(compressor.flush(flush))
+    out.append(compressor.flush())
+    return b"".join(out)
+
+
+mixed = [text(5000), noise(3000), text(20000), noise(70000), text(100), noise(1), text(40000)]
+small_text, random_data, fixed_text, dynamic_text = text(10), noise(150000), text(3000), text(200000)
+cases = {
+    "stored, empty": (b"", compress([b""], level=0)),
+    "stored, small": (small_text, compress([small_text], level=0)),
+    "stored, several blocks": (random_data, compress([random_data], level=0)),
+    "fixed": (fixed_text, compress([fixed_text], strategy=zlib.Z_FIXED)),
+    "dynamic": (dynamic_text, compress([dynamic_text])),
+}
+for level in [1, 6, 9]:
+    cases["mixed, level {}".format(level)] = (b"".join(mixed), compress(mixed, level))
+    for flush_name, flush in [("sync", zlib.Z_SYNC_FLUSH), ("full", zlib.Z_FULL_FLUSH)]:
+        cases["mixed, level {}, {} flushes".format(level, flush_name)] = (
+            b"".join(mixed),
+            compress(mixed, level, flush=flush),
+        )
+for num_chunks in range(1, 20):
+    # Sync flushes after chunks of different sizes leave different numbers of bits before each stored block
+    chunks = [text(rng.randint(0, 50)) for _ in range(num_chunks)]
+    cases["sync flushes, {} chunks".format(num_chunks)] = (b"".join(chunks), compress(chunks, flush=zlib.Z_SYNC_FLUSH))
+    cases["fixed, sync flushes, {} chunks".format(num_chunks)] = (
+        b"".join(chunks),
+        compress(chunks, strategy=zlib.Z_FIXED, flush=zlib.Z_SYNC_FLUSH),
+    )
+
+# The plot data as written to the report, with non-ASCII sample names
+plot_data = {"plot_{}".format(i): {"samples": ["Échantillon_{}".format(j) for j in range(i * 10)]} for i in range(5)}
+config.plot_data_codec = "zlib"
+plot_json = "".join(report.json_chunks(plot_data)).encode("utf-8")
+inputs = {name: base64.b64encode(data).decode("ascii") for name, (_, data) in cases.items()}
+inputs["plot data"] = report.compress_json(plot_data)
+expected = {name: base64.b64encode(data).decode("ascii") for name, (data, _) in cases.items()}
+expected["plot data"] = base64.b64encode(plot_json).decode("ascii")
+
+node = shutil.which("node")
+if node is None:
+    print("Skipping: node is not installed")
+    sys.exit(0)
+js_fn = os.path.join(config.MULTIQC_DIR, "templates", "default", "assets", "js", "multiqc_inflate.js")
+with tempfile.TemporaryDirectory() as tmp_dir:
+    script_fn = os.path.join(tmp_dir, "inflate.js")
+    data_fn = os.path.join(tmp_dir, "data.json")
+    with open(script_fn, "w") as fh:
+        fh.write(INFLATE_JS)
+    with open(data_fn, "w") as fh:
+        json.dump(inputs, fh)
+    results = json.loads(subprocess.check_output([node, script_fn, js_fn, data_fn]))
+
+errors = list()
+for name in expected:
+    if results.get(name) != expected[name]:
+        result = results.get(name) or ""
+        errors.append("{}: {}".format(name, result if result.startswith("ERROR") else "output differs"))
+for error in errors:
+    print("ERROR: {}".format(error))
+print("Inflated {} zlib streams: {}".format(len(expected), "FAILED" if errors else "OK"))
+sys.exit(1 if errors else 0)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+""" Checks that `modify` functions of general statistics columns survive a JSON dump and
+`multiqc --merge-data`: functions that multiply the values are applied again, others
+(like `lambda x: 100 - x`) are left out rather than replaced with a wrong multiplier. """
+
+import json
+import sys
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from multiqc.utils import megaqc, merge_data, report
+
+# A run with one general statistics column of each kind
+run = SimpleNamespace(
+    data_sources=dict(),
+    multiqc_command="",
+    plot_data=dict(),
+    flat_plot_data=dict(),
+    saved_raw_data=dict(),
+    general_stats_data=[{"sample_1": {"scaled": 2.0, "inverted": 20.0, "plain": 5.0}}],
+    general_stats_headers=[
+        OrderedDict(
+            [
+                ("scaled", {"namespace": "test", "title": "Scaled", "modify": lambda x: x * 0.001}),
+                ("inverted", {"namespace": "test", "title": "Inverted", "modify": lambda x: 100 - x}),
+                ("plain", {"namespace": "test", "title": "Plain"}),
+            ]
+        )
+    ],
+)
+
+# Write and load the dump as for multiqc_data.json
+dump = json.loads(json.dumps(megaqc.multiqc_dump_json(run), cls=megaqc.MQCJSONEncoder))
+old_dump = dict(dump)
+old_dump.pop("report_general_stats_modify", None)
+
+errors = list()
+for name, dumps, expected in [
+    ("dump", [dump], {"scaled": 0.002, "inverted": 20.0, "plain": 5.0}),
+    ("dump without modify scales", [old_dump], {"scaled": 2.0, "inverted": 20.0, "plain": 5.0}),
+]:
+    report.general_stats_data = list()
+    report.general_stats_headers = list()
+    merge_data.merge_general_stats(dumps)
+    headers = report.general_stats_headers[0]
+    for k, value in report.general_stats_data[0]["sample_1"].items():
+        modify = headers[k].get("modify")
+        shown = modify(value) if modify is not None else value
+        if abs(shown - expected[k]) > 1e-9:
+            errors.append("{}: column '{}' shows {}, expected {}".format(name, k, shown, expected[k]))
+
+for error in errors:
+    print("ERROR: {}".format(error))
+print("Merged modify functions: {}".format("FAILED" if errors else "OK"))
+sys.exit(1 if errors else 0)
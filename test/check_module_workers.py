@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+""" Checks that running modules with --module-workers gives the same results as running
+them one at a time. On Python versions without module worker support, checks that MultiQC
+falls back to running the modules one at a time instead. """
+
+import argparse
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+parser = argparse.ArgumentParser(description="Compares MultiQC runs with and without module workers")
+parser.add_argument("analysis_dir", nargs="+", help="Directories to run MultiQC on")
+parser.add_argument("--workers", type=int, default=2, help="Number of module workers (default: 2)")
+parser.add_argument("--module", "-m", action="append", default=[], help="Modules to run (default: all)")
+args = parser.parse_args()
+
+# Parts of multiqc_data.json that don't depend on how the modules were run
+COMPARE_KEYS = [
+    "report_data_sources",
+    "report_general_stats_data",
+    "report_general_stats_headers",
+    "report_saved_raw_data",
+]
+
+
+def run_multiqc(out_dir, extra_args=()):
+    """Run MultiQC, returning the contents of the data directory and the log"""
+    cmd = [sys.executable, "-m", "multiqc", "-f", "-o", out_dir, "--no-ansi"]
+    for m in args.module:
+        cmd.extend(["-m", m])
+    cmd.extend(extra_args)
+    cmd.extend(args.analysis_dir)
+    print("Running: {}".format(" ".join(cmd)))
+    subprocess.run(cmd, check=True)
+    data_dir = os.path.join(out_dir, "multiqc_data")
+    with io.open(os.path.join(data_dir, "multiqc_data.json"), encoding="utf-8") as fh:
+        data = json.load(fh)
+    with io.open(os.path.join(data_dir, "multiqc.log"), encoding="utf-8") as fh:
+        log = fh.read()
+    return {k: data.get(k) for k in COMPARE_KEYS}, sorted(os.listdir(data_dir)), log
+
+
+tmp_dir = tempfile.mkdtemp(prefix="multiqc_check_")
+try:
+    serial_data, serial_files, _ = run_multiqc(os.path.join(tmp_dir, "serial"))
+    pool_data, pool_files, log = run_multiqc(os.path.join(tmp_dir, "pool"), ["--module-workers", str(args.workers)])
+finally:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+errors = list()
+for k in COMPARE_KEYS:
+    if serial_data[k] != pool_data[k]:
+        errors.append("{} differs with module workers".format(k))
+if serial_files != pool_files:
+    errors.append("Data files differ with module workers: {}".format(sorted(set(serial_files) ^ set(pool_files))))
+if "Traceback" in log:
+    errors.append("Error in the log with module workers")
+if sys.version_info < (3, 8):
+    if "module workers need Python 3.8 or later" not in log:
+        errors.append("Modules were not run one at a time on Python {}.{}".format(*sys.version_info[:2]))
+else:
+    if "module workers" not in log or "Running modules one at a time" in log:
+        errors.append("Modules were not run with module workers")
+    # Modules are only run again in the main process if something went wrong in the worker
+    for message in ["Could not load results of module worker", "Module could not run in module worker"]:
+        if message in log:
+            errors.append("Module run again after: {}".format(message))
+
+for error in errors:
+    print("ERROR: {}".format(error))
+print("Module workers: {}".format("FAILED" if errors else "OK"))
+sys.exit(1 if errors else 0)